@@ -1,83 +1,795 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import numpy as np
+from scipy.spatial import cKDTree
 import json
+import hashlib
 from datetime import datetime, timedelta
 from dateutil import parser
+from dateutil import tz as dateutil_tz
 import io
+import gzip
+import zipfile
+import csv
 import os
+import sys
 from urllib.parse import quote
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
 import threading
+import asyncio
+import aiohttp
+import heapq
+import itertools
+import random
+import time
+import sqlite3
+import multiprocessing
+import queue
+import uuid
+import copy
 from math import radians, cos, sin, asin, sqrt
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import math
+import functools
+import contextlib
+
+# Advisory file locks (POSIX only); elsewhere the in-process lock has to do
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Optional fast paths for API responses; the stdlib is used when they are missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
 # Configuration
 API_BASE_URL = "http://airview.cs.upt.ro"
 
-# Global variable to track scanning status
-scanning_status = {
+# HTTP transport settings (shared connection pool for all upstream calls)
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))  # number of hosts kept pooled
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 32))  # max open connections per host
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 10))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+HTTP_BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.3))
+
+# Async scan engine: number of probes kept in flight at once
+ASYNC_SCAN_CONCURRENCY = int(os.environ.get('ASYNC_SCAN_CONCURRENCY', 200))
+MAX_SCAN_CONCURRENCY = 1000
+# Processes used by the sharded scan engine
+SCAN_PROCESSES = int(os.environ.get('SCAN_PROCESSES', os.cpu_count() or 2))
+SHARD_REPORT_BATCH = 50  # outcomes per progress message from a shard process
+# Candidates queued per in-flight probe; keeps scanner memory flat for any range size
+SCAN_QUEUE_FACTOR = 2
+
+# Adaptive rate control for scans (AIMD on probes in flight)
+SCAN_MIN_CONCURRENCY = 2
+SCAN_TARGET_LATENCY = float(os.environ.get('SCAN_TARGET_LATENCY', 2.0))  # seconds
+SCAN_ERROR_THRESHOLD = 0.1  # fraction of failed probes in the recent window
+SCAN_MAX_RETRIES = 3
+SCAN_RETRY_BACKOFF = 1.0  # seconds, doubled on every retry
+
+# Prioritised "nearby" search around known-active MACs
+NEARBY_SEARCH_RADIUS = 32  # max address distance from a hit that is probed
+NEARBY_MAX_PROBES = 5000
+NEARBY_DENSITY_WINDOW = 200  # probes considered for the early-stop hit density
+NEARBY_MIN_DENSITY = 0.01
+SCAN_WAIT_INTERVAL = 0.05  # seconds
+
+# Probe ledger (per-MAC scan outcomes, used to resume scans and skip dead MACs)
+PROBE_LEDGER_DB = os.environ.get('PROBE_LEDGER_DB', 'probe_ledger.db')
+LEDGER_SKIP_RECENT_HOURS = float(os.environ.get('LEDGER_SKIP_RECENT_HOURS', 24))
+# Outcomes that show a MAC is gone; timeouts and errors say nothing about the device
+LEDGER_ABSENT_STATUSES = ('not_found', 'inactive')
+
+# Latest-reading cache: one /data-intake/<mac> answer serves every lookup
+# within this many seconds (device test, coordinates, latest download)
+LATEST_READING_TTL = float(os.environ.get('LATEST_READING_TTL', 30))
+LATEST_READING_MAX_ENTRIES = int(os.environ.get('LATEST_READING_MAX_ENTRIES', 1024))
+
+# Local hourly AQI history; the 24h endpoint serves at most HISTORY_MAX_FETCH_HOURS per request
+AQI_HISTORY_DB = os.environ.get('AQI_HISTORY_DB', 'aqi_history.db')
+HISTORY_MAX_FETCH_HOURS = int(os.environ.get('HISTORY_MAX_FETCH_HOURS', 168))
+HISTORY_OVERLAP_HOURS = int(os.environ.get('HISTORY_OVERLAP_HOURS', 2))
+# Reads only sync a device last synced longer ago than this; it defaults to the
+# ingestion interval, so devices the daemon keeps current are served locally
+HISTORY_SYNC_MIN_INTERVAL = float(os.environ.get('HISTORY_SYNC_MIN_INTERVAL', os.environ.get('INGEST_INTERVAL', 900)))
+
+# CSV exports are streamed: history is read EXPORT_WINDOW_HOURS at a time
+# and written EXPORT_CHUNK_ROWS rows per chunk
+EXPORT_WINDOW_HOURS = int(os.environ.get('EXPORT_WINDOW_HOURS', 7 * 24))
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 1000))
+
+# Download formats: name -> (file extension, mimetype). CSV variants stream;
+# columnar formats are built as one Arrow table so types survive the trip
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'csv.gz': ('csv.gz', 'application/gzip'),
+    'csv.zst': ('csv.zst', 'application/zstd'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'feather': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+EXPORT_FORMAT_ALIASES = {'gzip': 'csv.gz', 'zstd': 'csv.zst', 'arrow': 'feather', 'ipc': 'feather'}
+EXPORT_CSV_CODECS = {'csv.gz': 'gzip', 'csv.zst': 'zstd'}
+# Low-cardinality text columns stored dictionary-encoded in columnar exports
+EXPORT_DICTIONARY_COLUMNS = ('aqi_level', 'location', 'data_source')
+
+# Bulk exports fetch up to BULK_EXPORT_WORKERS devices at once
+BULK_EXPORT_WORKERS = int(os.environ.get('BULK_EXPORT_WORKERS', 4))
+BULK_EXPORT_MAX_DEVICES = int(os.environ.get('BULK_EXPORT_MAX_DEVICES', 500))
+BULK_EXPORT_LAYOUTS = ('long', 'zip')
+# Long-layout exports summarise the manifest in a header kept under this size
+BULK_MANIFEST_HEADER_MAX_BYTES = int(os.environ.get('BULK_MANIFEST_HEADER_MAX_BYTES', 2048))
+
+# Query results are cached (up to QUERY_CACHE_MAX_BYTES of DataFrames), so paging
+# through a preview and then downloading the same query reuse one upstream fetch
+PREVIEW_PAGE_SIZE = int(os.environ.get('PREVIEW_PAGE_SIZE', 100))
+PREVIEW_MAX_PAGE_SIZE = int(os.environ.get('PREVIEW_MAX_PAGE_SIZE', 1000))
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Ingestion daemon (python app.py ingest): harvests every saved device each INGEST_INTERVAL seconds
+INGEST_INTERVAL = float(os.environ.get('INGEST_INTERVAL', 900))
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', 8))
+INGEST_INCLUDE_SCANNED = os.environ.get('INGEST_INCLUDE_SCANNED', 'false').lower() in ('1', 'true', 'yes')
+INGEST_IN_WEB = os.environ.get('INGEST_IN_WEB', 'false').lower() in ('1', 'true', 'yes')
+
+# Reverse-geocoding cache, keyed by coordinates rounded to GEOCODE_PRECISION
+# decimals (4 decimals is roughly 10 m, well inside a sensor's GPS jitter)
+GEOCODE_CACHE_DB = os.environ.get('GEOCODE_CACHE_DB', 'geocode_cache.db')
+GEOCODE_PRECISION = int(os.environ.get('GEOCODE_PRECISION', 4))
+GEOCODE_TTL_HOURS = float(os.environ.get('GEOCODE_TTL_HOURS', 30 * 24))
+GEOCODE_FAILURE_TTL_SECONDS = float(os.environ.get('GEOCODE_FAILURE_TTL_SECONDS', 300))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get('GEOCODE_CACHE_MAX_ENTRIES', 10000))
+GEOCODE_WARM_WORKERS = int(os.environ.get('GEOCODE_WARM_WORKERS', 8))
+
+# Scan job status (shared between gunicorn workers through SQLite)
+SCAN_JOBS_DB = os.environ.get('SCAN_JOBS_DB', 'scan_jobs.db')
+SCAN_STATUS_PERSIST_INTERVAL = float(os.environ.get('SCAN_STATUS_PERSIST_INTERVAL', 0.5))
+SCAN_JOB_STALE_SECONDS = float(os.environ.get('SCAN_JOB_STALE_SECONDS', 120))
+SCAN_EVENTS_POLL_INTERVAL = float(os.environ.get('SCAN_EVENTS_POLL_INTERVAL', 0.5))
+SCAN_EVENTS_KEEPALIVE = float(os.environ.get('SCAN_EVENTS_KEEPALIVE', 15))
+# Each progress event is a full snapshot, so a job only keeps its latest few;
+# finished jobs and their events are dropped after SCAN_JOB_RETENTION_HOURS
+SCAN_PROGRESS_EVENTS_KEPT = int(os.environ.get('SCAN_PROGRESS_EVENTS_KEPT', 50))
+SCAN_JOB_RETENTION_HOURS = float(os.environ.get('SCAN_JOB_RETENTION_HOURS', 24))
+
+# Scan job manager: jobs running at once per process, and the upstream
+# request budget shared fairly between all running jobs
+SCAN_MAX_JOBS = int(os.environ.get('SCAN_MAX_JOBS', 3))
+SCAN_MAX_QUEUED_JOBS = int(os.environ.get('SCAN_MAX_QUEUED_JOBS', 20))
+GLOBAL_SCAN_CONCURRENCY = int(os.environ.get('GLOBAL_SCAN_CONCURRENCY', 200))
+SCAN_CONTROL_POLL_INTERVAL = float(os.environ.get('SCAN_CONTROL_POLL_INTERVAL', 1.0))
+
+SCAN_STATUS_DEFAULTS = {
+    'job_id': None,
+    'state': 'idle',
+    'concurrency_share': None,
     'in_progress': False,
     'progress': 0,
     'total': 0,
     'active_found': 0,
     'current_mac': '',
+    'engine': '',
+    'concurrency': 0,
+    'retries': 0,
+    'retry_pending': 0,
+    'failed_after_retries': 0,
+    'scan_id': None,
+    'mode': 'range',
+    'resumed': False,
+    'stop_reason': None,
+    'shards': [],
+    'skipped': 0,
     'results': []
 }
 
+# JSON responses: JSON_PROVIDER=orjson (the default) encodes with orjson when it is
+# installed, anything else keeps Flask's stdlib encoder. JSON bodies of at least
+# COMPRESS_MIN_BYTES are brotli- or gzip-compressed for clients that accept it
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson')
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_MIMETYPES = ('application/json', 'application/geo+json')
+PREPARED_JSON_CACHE_ENTRIES = int(os.environ.get('PREPARED_JSON_CACHE_ENTRIES', 16))
+
+# Map grid shared by the full grid, coverage and uncovered-cell layers, so their
+# cell sets line up. MAP_GRID_BBOX is "min_lat,max_lat,min_lon,max_lon" and
+# MAP_GRID_STEP the cell size in degrees (0.009 is about 1 km in Timisoara)
+MAP_GRID_BBOX = tuple(float(v) for v in os.environ.get('MAP_GRID_BBOX', '45.70,45.82,21.15,21.35').split(','))
+MAP_GRID_STEP = float(os.environ.get('MAP_GRID_STEP', 0.009))
+# Sensors reporting within this many hours count as covering their cell
+COVERAGE_MAX_AGE_HOURS = float(os.environ.get('COVERAGE_MAX_AGE_HOURS', 24))
+SPATIAL_GRID_CACHE_SIZE = 8
+# Nearest-uncovered-cell suggestions: neighbours returned per device by default
+# and at most, and how many coverage snapshots keep their KD-tree
+SUGGESTION_DEFAULT_K = 1
+SUGGESTION_MAX_K = 20
+UNCOVERED_INDEX_CACHE_SIZE = 4
+EARTH_RADIUS_M = 6371e3
+# A device is mobile when two of its sightings at most MOBILITY_WINDOW_HOURS
+# apart lie more than MOBILITY_MIN_DISTANCE_M apart; scans classify each MAC
+# from its sightings of the last MOBILITY_LOOKBACK_DAYS
+MOBILITY_WINDOW_HOURS = float(os.environ.get('MOBILITY_WINDOW_HOURS', 6))
+MOBILITY_MIN_DISTANCE_M = float(os.environ.get('MOBILITY_MIN_DISTANCE_M', 100))
+MOBILITY_LOOKBACK_DAYS = float(os.environ.get('MOBILITY_LOOKBACK_DAYS', 7))
+# Coverage heatmap: located history readings are aggregated per map cell into
+# hour and day buckets (in seconds; days are UTC) as they are ingested. Below
+# HEATMAP_BASE_ZOOM every Leaflet zoom level doubles the side of the heatmap
+# squares, up to HEATMAP_MAX_BLOCK cells
+COVERAGE_BUCKETS = (3600, 86400)
+HEATMAP_BASE_ZOOM = int(os.environ.get('HEATMAP_BASE_ZOOM', 13))
+HEATMAP_MAX_BLOCK = int(os.environ.get('HEATMAP_MAX_BLOCK', 8))
+HEATMAP_DEFAULT_HOURS = 24
+HEATMAP_MAX_HOURS = int(os.environ.get('HEATMAP_MAX_HOURS', 90 * 24))
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson.
+    
+    numpy scalars and arrays are encoded natively and the encoded bytes go
+    straight into the response. NaN and infinity are written as null, so
+    payloads built from DataFrames stay valid JSON (the stdlib encoder emits
+    a bare NaN). Anything orjson can't encode falls back to Flask's default
+    handler (dates, decimals, dataclasses).
+    """
+    
+    def _options(self):
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options())
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+if JSON_PROVIDER == 'orjson' and orjson is not None:
+    app.json = OrjsonProvider(app)
+
+
+def compress_body(body, encoding):
+    """Compress a response body for a Content-Encoding of 'br' or 'gzip'"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    # mtime=0 keeps the output (and so its ETag) identical for identical bodies
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+def accepted_encoding(size):
+    """'br' or 'gzip' if a body of `size` bytes should be compressed for the current request, else None"""
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    return encoding if encoding in ('br', 'gzip') else None
+
+@app.after_request
+def compress_json_response(response):
+    """Compress larger JSON bodies and let GET clients revalidate them by ETag"""
+    if (response.direct_passthrough or response.is_streamed or response.mimetype not in COMPRESS_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    body = response.get_data()
+    if len(body) >= COMPRESS_MIN_BYTES:
+        response.vary.add('Accept-Encoding')
+        encoding = accepted_encoding(len(body))
+        if encoding:
+            response.set_data(compress_body(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+    
+    if request.method in ('GET', 'HEAD') and response.status_code == 200:
+        # Tagged after compression, so each encoding of a body has its own tag
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+class PreparedJSON:
+    """A JSON body encoded once, kept with its ETag and its compressed variants.
+    
+    For payloads that only change when their inputs do (map grids): serving
+    one is a header check and a copy, with no encoding or compression work.
+    """
+    
+    def __init__(self, payload):
+        self.body = app.json.dumps(payload).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self._encoded = {}
+        self._lock = threading.Lock()
+    
+    def encoded(self, encoding):
+        with self._lock:
+            if encoding not in self._encoded:
+                self._encoded[encoding] = compress_body(self.body, encoding)
+            return self._encoded[encoding]
+    
+    def response(self):
+        encoding = accepted_encoding(len(self.body))
+        response = Response(self.encoded(encoding) if encoding else self.body, mimetype=app.json.mimetype)
+        if len(self.body) >= COMPRESS_MIN_BYTES:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(f"{self.etag}-{encoding}" if encoding else self.etag)
+        return response.make_conditional(request)
+
+
+class PreparedJSONCache:
+    """Small LRU of PreparedJSON bodies, keyed by whatever determines their content"""
+    
+    def __init__(self, max_entries=PREPARED_JSON_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+    
+    def get(self, key, build):
+        """The prepared body for a key, encoding `build()` on a miss"""
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                return prepared
+        
+        prepared = PreparedJSON(build())
+        with self._lock:
+            self._entries[key] = prepared
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return prepared
+
+
+prepared_json = PreparedJSONCache()
+
+
+class PooledHTTPClient:
+    """Keep-alive HTTP client with per-host connection pooling and retries.
+
+    All upstream requests go through one requests.Session, so connections to
+    airview.cs.upt.ro (and the geocoder) are reused instead of opening a new
+    TCP connection for every call.
+    """
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF):
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+
+        # Only retry idempotent GETs on connection problems and gateway errors;
+        # 404 is a normal answer for an unknown MAC and must not be retried.
+        retry_policy = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry_policy,
+            pool_block=True  # wait for a free connection instead of opening extra ones
+        )
+
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def get(self, url, timeout=None, **kwargs):
+        """GET a URL through the shared pool"""
+        with self._lock:
+            self._requests += 1
+        try:
+            return self.session.get(url, timeout=timeout or self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def stats(self):
+        """Return request and connection reuse counters per host"""
+        hosts = []
+        total_connections = 0
+        total_pool_requests = 0
+
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            total_connections += pool.num_connections
+            total_pool_requests += pool.num_requests
+            hosts.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'reused': max(0, pool.num_requests - pool.num_connections),
+                'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            })
+
+        with self._lock:
+            requests_sent = self._requests
+            errors = self._errors
+
+        return {
+            'requests': requests_sent,
+            'errors': errors,
+            'connections_opened': total_connections,
+            'connections_reused': max(0, total_pool_requests - total_connections),
+            'reuse_ratio': round(1 - total_connections / total_pool_requests, 3) if total_pool_requests else 0.0,
+            'pool_maxsize': self.pool_maxsize,
+            'timeout': self.timeout,
+            'hosts': hosts
+        }
+
+
+# Shared transport used by the API client and single-device lookups
+http_client = PooledHTTPClient()
+# Scan probes get no transport retries: the scanner retries them itself, and
+# the concurrency controller has to see every failed attempt and its latency
+scan_http_client = PooledHTTPClient(retries=0)
+
+
+class LatestReadingCache:
+    """Short-lived per-MAC cache of /api/v1/data-intake/<mac> responses.
+    
+    Testing a device, looking up its coordinates and downloading its latest
+    reading all need the same payload; within `ttl` seconds they share one
+    upstream request. Concurrent requests for a MAC that is already being
+    fetched wait for that fetch instead of sending their own. Only 200 and
+    404 answers are cached; errors and timeouts are raised to every waiter.
+    """
+
+    def __init__(self, ttl=LATEST_READING_TTL, max_entries=LATEST_READING_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, status_code, data)
+        self._in_flight = {}  # key -> Future
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+    
+    def fetch(self, http, base_url, mac, timeout=10):
+        """Return (status_code, data) for a MAC; data is a fresh shallow copy, or None unless 200"""
+        key = (base_url, mac.upper())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], self._copy(entry[2])
+            
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            status_code, data = future.result()
+            return status_code, self._copy(data)
+        
+        try:
+            response = http.get(f"{base_url}/api/v1/data-intake/{quote(mac)}", timeout=timeout)
+            data = response.json() if response.status_code == 200 else None
+            result = (response.status_code, data)
+        except Exception as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if response.status_code in (200, 404):
+                self._entries[key] = (time.monotonic() + self.ttl,) + result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(result)
+        return result[0], self._copy(data)
+    
+    def invalidate(self, base_url, mac):
+        with self._lock:
+            self._entries.pop((base_url, mac.upper()), None)
+    
+    @staticmethod
+    def _copy(data):
+        # Callers enrich the payload in place; keep the cached one pristine
+        if isinstance(data, dict):
+            return dict(data)
+        if isinstance(data, list):
+            return list(data)
+        return data
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }
+
+
+latest_reading_cache = LatestReadingCache()
+
+
+def is_retryable_result(result):
+    """True for probe outcomes caused by upstream load rather than by the MAC itself"""
+    if result['status'] in ('timeout', 'connection_error'):
+        return True
+    reason = str(result.get('reason', ''))
+    return result['status'] == 'error' and (reason == 'http_429' or reason.startswith('http_5'))
+
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter for re-queued scan probes"""
+    return SCAN_RETRY_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+
+class AdaptiveConcurrencyController:
+    """AIMD controller for the number of scan probes kept in flight.
+    
+    The limit grows by one probe per round of successful probes (additive
+    increase) and is halved when the recent error rate or the smoothed
+    latency goes over target (multiplicative decrease), at most once per
+    round so a single burst of timeouts does not collapse it to the floor.
+    """
+
+    def __init__(self, max_limit, initial_limit=None, min_limit=SCAN_MIN_CONCURRENCY,
+                 target_latency=SCAN_TARGET_LATENCY, error_threshold=SCAN_ERROR_THRESHOLD,
+                 increase=1.0, decrease_factor=0.5, window=50):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial_limit or max(self.min_limit, self.max_limit // 2))
+        self.target_latency = target_latency
+        self.error_threshold = error_threshold
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        
+        self._outcomes = deque(maxlen=window)
+        self._latency = None
+        self._since_decrease = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def record(self, latency, failed):
+        """Record one probe outcome and adjust the limit"""
+        with self._lock:
+            self._outcomes.append(failed)
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            self._since_decrease += 1
+            
+            error_rate = sum(self._outcomes) / len(self._outcomes)
+            congested = (failed and error_rate > self.error_threshold) or self._latency > self.target_latency
+            
+            if congested:
+                if self._since_decrease >= self.limit:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._since_decrease = 0
+            else:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+
+# Yielded by a candidate source that has nothing to probe until in-flight results come back
+SCAN_WAIT = object()
+
+
+def mac_to_int(mac):
+    return int(mac.replace(':', '').replace('-', ''), 16)
+
+
+def int_to_mac(value):
+    raw = f"{value:012X}"
+    return ":".join(raw[i:i + 2] for i in range(0, 12, 2))
+
+
+class PrioritizedMACFrontier:
+    """Candidate source that probes outward from known-active MACs.
+    
+    Active devices sit in sparse runs of consecutive addresses, so instead
+    of sweeping a dense square this probes the closest unprobed neighbours
+    of every hit first (priority = distance to the nearest known hit).
+    Every new hit pushes its own neighbours, and the search stops once the
+    hit density over the last `density_window` probes drops below
+    `min_density` or `max_probes` is reached.
+    
+    Iterate it as the scan candidates and pass `observe` as the callback.
+    """
+
+    def __init__(self, seeds, radius=NEARBY_SEARCH_RADIUS, max_probes=NEARBY_MAX_PROBES,
+                 density_window=NEARBY_DENSITY_WINDOW, min_density=NEARBY_MIN_DENSITY, exclude=()):
+        self.radius = radius
+        self.max_probes = max_probes
+        self.min_density = min_density
+        self.stop_reason = None
+        self.hits = set()
+        
+        self._heap = []
+        self._best = {}  # mac int -> best queued priority
+        self._yielded = {mac_to_int(mac) for mac in exclude}
+        self._recent = deque(maxlen=density_window)
+        self._counter = 0
+        self._probes = 0
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        
+        for seed in seeds:
+            seed_int = mac_to_int(seed)
+            self._push(seed_int, 0)  # re-probe the seed itself to refresh its data
+            self._push_neighbours(seed_int)
+    
+    def _push(self, mac_int, priority):
+        if mac_int in self._yielded or not 0 <= mac_int < 1 << 48:
+            return
+        if priority < self._best.get(mac_int, float('inf')):
+            self._best[mac_int] = priority
+            self._counter += 1
+            heapq.heappush(self._heap, (priority, self._counter, mac_int))
+    
+    def _push_neighbours(self, mac_int):
+        oui = mac_int >> 24
+        for distance in range(1, self.radius + 1):
+            for neighbour in (mac_int - distance, mac_int + distance):
+                if neighbour >> 24 == oui:  # stay within the vendor prefix
+                    self._push(neighbour, distance)
+    
+    @property
+    def probes(self):
+        return self._probes
+    
+    @property
+    def planned(self):
+        """Probes made plus queued, capped by max_probes; grows with hits, settles once stopped"""
+        with self._lock:
+            if self.stop_reason is not None:
+                return self._probes
+            return min(self.max_probes, self._probes + len(self._best))
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        with self._lock:
+            while self._heap and self.stop_reason is None:
+                if self._probes >= self.max_probes:
+                    self.stop_reason = 'max_probes'
+                    break
+                priority, _, mac_int = heapq.heappop(self._heap)
+                if mac_int in self._yielded or self._best.get(mac_int) != priority:
+                    continue  # stale heap entry
+                self._yielded.add(mac_int)
+                self._best.pop(mac_int, None)
+                self._probes += 1
+                self._outstanding += 1
+                return int_to_mac(mac_int)
+            
+            if self._outstanding and self.stop_reason is None:
+                return SCAN_WAIT  # hits among in-flight probes may add new neighbours
+            raise StopIteration
+    
+    def observe(self, result, completed=None, total=None):
+        """Scan callback: expand around hits and track hit density"""
+        with self._lock:
+            self._outstanding -= 1
+            is_hit = result['status'] == 'active'
+            self._recent.append(is_hit)
+            
+            if is_hit:
+                mac_int = mac_to_int(result['mac'])
+                self.hits.add(mac_int)
+                self._push_neighbours(mac_int)
+            
+            window_full = len(self._recent) == self._recent.maxlen
+            if window_full and self.stop_reason is None and sum(self._recent) / len(self._recent) < self.min_density:
+                self.stop_reason = 'low_hit_density'
+
+
 class ActiveMACExtractor:
-    def __init__(self, base_url):
+    def __init__(self, base_url, http=None, latest_readings=None, scan_http=None):
         self.base_url = base_url.rstrip('/')
         self.timeout = 10
+        self.http = http or http_client
+        self.scan_http = scan_http or scan_http_client
+        self.latest_readings = latest_readings or latest_reading_cache
     
-    def test_single_mac(self, mac):
-        """Test if a single MAC address is active"""
-        try:
-            url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
-            response = requests.get(url, timeout=self.timeout)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data and isinstance(data, dict):
-                    # Check for essential air quality fields
-                    essential_fields = ['mac', 'timestamp', 't', 'pm25', 'pm10', 'iaq']
-                    found_fields = [field for field in essential_fields if field in data and data[field] is not None]
-                    
-                    if len(found_fields) >= 2:  # At least 2 essential fields present
-                        return {
-                            'mac': mac,
-                            'status': 'active',
-                            'last_update': data.get('timestamp'),
-                            'available_fields': list(data.keys()),
-                            'essential_fields_found': found_fields,
-                            'location': {
-                                'lat': data.get('lat') or data.get('latitude'),
-                                'lng': data.get('lng') or data.get('longitude')
-                            },
-                            'data_quality': 'good' if len(found_fields) >= 4 else 'limited',
-                            'sample_data': {
-                                't': data.get('t'),
-                                'pm25': data.get('pm25'),
-                                'pm10': data.get('pm10'),
-                                'iaq': data.get('iaq')
-                            }
-                        }
-                    else:
-                        return {
-                            'mac': mac,
-                            'status': 'inactive',
-                            'reason': 'insufficient_data',
-                            'available_fields': list(data.keys()) if data else []
+    def classify_response(self, mac, status_code, data):
+        """Turn a data-intake response into a scan result entry"""
+        if status_code == 200:
+            if data and isinstance(data, dict):
+                # Check for essential air quality fields
+                essential_fields = ['mac', 'timestamp', 't', 'pm25', 'pm10', 'iaq']
+                found_fields = [field for field in essential_fields if field in data and data[field] is not None]
+                
+                if len(found_fields) >= 2:  # At least 2 essential fields present
+                    return {
+                        'mac': mac,
+                        'status': 'active',
+                        'last_update': data.get('timestamp'),
+                        'available_fields': list(data.keys()),
+                        'essential_fields_found': found_fields,
+                        'location': {
+                            'lat': data.get('lat') or data.get('latitude'),
+                            'lng': data.get('lng') or data.get('longitude')
+                        },
+                        'data_quality': 'good' if len(found_fields) >= 4 else 'limited',
+                        'sample_data': {
+                            't': data.get('t'),
+                            'pm25': data.get('pm25'),
+                            'pm10': data.get('pm10'),
+                            'iaq': data.get('iaq')
                         }
+                    }
                 else:
-                    return {'mac': mac, 'status': 'inactive', 'reason': 'no_data'}
-            elif response.status_code == 404:
-                return {'mac': mac, 'status': 'not_found', 'reason': 'device_not_found'}
+                    return {
+                        'mac': mac,
+                        'status': 'inactive',
+                        'reason': 'insufficient_data',
+                        'available_fields': list(data.keys()) if data else []
+                    }
+            else:
+                return {'mac': mac, 'status': 'inactive', 'reason': 'no_data'}
+        elif status_code == 404:
+            return {'mac': mac, 'status': 'not_found', 'reason': 'device_not_found'}
+        else:
+            return {'mac': mac, 'status': 'error', 'reason': f'http_{status_code}'}
+    
+    def test_single_mac(self, mac, use_cache=True):
+        """Test if a single MAC address is active
+        
+        Bulk scans pass use_cache=False: they want a fresh answer for every
+        MAC and would only flush useful entries out of the latest-reading cache.
+        Those probes go through scan_http, which never retries on its own.
+        """
+        try:
+            if use_cache:
+                status_code, data = self.latest_readings.fetch(self.http, self.base_url, mac, timeout=self.timeout)
             else:
-                return {'mac': mac, 'status': 'error', 'reason': f'http_{response.status_code}'}
+                url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
+                response = self.scan_http.get(url, timeout=self.timeout)
+                status_code = response.status_code
+                data = response.json() if status_code == 200 else None
+            return self.classify_response(mac, status_code, data)
                 
         except requests.exceptions.Timeout:
             return {'mac': mac, 'status': 'timeout', 'reason': 'connection_timeout'}
@@ -86,78 +798,1471 @@ class ActiveMACExtractor:
         except Exception as e:
             return {'mac': mac, 'status': 'error', 'reason': str(e)}
     
-    def scan_mac_range(self, base_mac, range_size=100, callback=None):
+    async def test_single_mac_async(self, session, mac):
+        """Async version of test_single_mac using a shared aiohttp session"""
+        try:
+            url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
+            async with session.get(url) as response:
+                data = await response.json(content_type=None) if response.status == 200 else None
+                return self.classify_response(mac, response.status, data)
+        
+        except asyncio.TimeoutError:
+            return {'mac': mac, 'status': 'timeout', 'reason': 'connection_timeout'}
+        except aiohttp.ClientConnectionError:
+            return {'mac': mac, 'status': 'connection_error', 'reason': 'cannot_connect'}
+        except Exception as e:
+            return {'mac': mac, 'status': 'error', 'reason': str(e)}
+    
+    def mac_range_bounds(self, base_mac, range_size):
+        """Return (prefix, 4th octet range, 5th octet range) scanned around base_mac"""
+        # Parse the base MAC
+        mac_parts = base_mac.split(":")
+        if len(mac_parts) != 6:
+            raise ValueError("Invalid MAC format")
+        
+        # Convert last two parts to integers for range scanning
+        base_fourth = int(mac_parts[4], 16)
+        base_fifth = int(mac_parts[5], 16)
+        prefix = ":".join(mac_parts[:4])
+        
+        fourth_range = range(max(0, base_fourth - range_size//2), min(256, base_fourth + range_size//2))
+        fifth_range = range(max(0, base_fifth - range_size//2), min(256, base_fifth + range_size//2))
+        return prefix, fourth_range, fifth_range
+    
+    def iter_mac_range(self, base_mac, range_size):
+        """Lazily generate the MACs around base_mac, one at a time"""
+        prefix, fourth_range, fifth_range = self.mac_range_bounds(base_mac, range_size)
+        for i in fourth_range:
+            for j in fifth_range:
+                yield f"{prefix}:{i:02X}:{j:02X}"
+    
+    def scan_candidates(self, mac_candidates, total=None, callback=None, engine='threads', concurrency=None, job=None):
+        """Probe an iterable of candidate MACs with the selected engine"""
+        if engine == 'async':
+            return self.extract_active_macs_async(mac_candidates, concurrency=concurrency or ASYNC_SCAN_CONCURRENCY,
+                                                  callback=callback, total=total, job=job)
+        return self.extract_active_macs_parallel(mac_candidates, max_workers=concurrency or 15,
+                                                 callback=callback, total=total, job=job)
+    
+    def scan_mac_range(self, base_mac, range_size=100, callback=None, engine='threads', concurrency=None, job=None):
         """Scan a range around a known working MAC address"""
         try:
-            # Parse the base MAC
-            mac_parts = base_mac.split(":")
-            if len(mac_parts) != 6:
-                raise ValueError("Invalid MAC format")
-            
-            # Convert last two parts to integers for range scanning
-            base_fourth = int(mac_parts[4], 16)
-            base_fifth = int(mac_parts[5], 16)
+            _, fourth_range, fifth_range = self.mac_range_bounds(base_mac, range_size)
+            total = len(fourth_range) * len(fifth_range)
+            mac_candidates = self.iter_mac_range(base_mac, range_size)
             
-            mac_list = []
-            prefix = ":".join(mac_parts[:4])
-            
-            # Generate range around the base MAC
-            for i in range(max(0, base_fourth - range_size//2), min(256, base_fourth + range_size//2)):
-                for j in range(max(0, base_fifth - range_size//2), min(256, base_fifth + range_size//2)):
-                    mac = f"{prefix}:{i:02X}:{j:02X}"
-                    mac_list.append(mac)
-            
-            return self.extract_active_macs_parallel(mac_list, max_workers=15, callback=callback)
+            return self.scan_candidates(mac_candidates, total, callback, engine, concurrency, job)
             
         except Exception as e:
             print(f"Error in range scan: {e}")
             return []
     
-    def extract_active_macs_parallel(self, mac_list, max_workers=15, callback=None):
-        """Extract active MACs using parallel processing"""
-        global scanning_status
+    def scan_range_sharded(self, base_mac, range_size=100, skip=(), callback=None, shards=None,
+                           shard_engine='threads', concurrency=None, job=None):
+        """Scan a range split across a pool of processes
+        
+        Rows of the 4th octet are dealt round-robin to `shards` processes, each
+        running its own scan engine, so response parsing and result building
+        are not limited by a single interpreter's GIL. Outcomes stream back
+        in batches through a queue and progress is reported across all shards.
+        """
+        owns_job = job is None
+        job = job or ScanJob()
+        prefix, fourth_range, fifth_range = self.mac_range_bounds(base_mac, range_size)
+        shards = max(1, min(shards or SCAN_PROCESSES, len(fourth_range)))
+        # Shards cannot be re-tuned once started, so they split the job's share as it stands now
+        job.poll_control(force=True)
+        per_shard_concurrency = max(1, job.concurrency_limit(concurrency or 15 * shards) // shards)
+        skip = {mac.upper() for mac in skip}
+        
+        shard_rows = [list(fourth_range)[k::shards] for k in range(shards)]
+        shard_skips = []
+        shard_totals = []
+        for rows in shard_rows:
+            row_prefixes = tuple(f"{prefix}:{i:02X}:".upper() for i in rows)
+            shard_skips.append({mac for mac in skip if mac.startswith(row_prefixes)})
+            shard_totals.append(len(rows) * len(fifth_range) - len(shard_skips[-1]))
+        total = sum(shard_totals)
+        
+        controller = AdaptiveConcurrencyController(max_limit=per_shard_concurrency * shards)
+        self._start_scan_status(job, total, 'processes', controller)
+        job.update(shards=[
+            {'shard': k, 'progress': 0, 'total': shard_totals[k], 'active_found': 0} for k in range(shards)
+        ])
+        
+        active_macs = []
+        completed = 0
+        context = multiprocessing.get_context('spawn')  # forking a threaded server process is unsafe
+        
+        progress_queue = context.Queue()
+        stop_event = context.Event()
+        pause_event = context.Event()
+        
+        try:
+            with ProcessPoolExecutor(max_workers=shards, mp_context=context, initializer=_init_shard_worker,
+                                     initargs=(progress_queue, stop_event, pause_event)) as pool:
+                futures = [
+                    pool.submit(_scan_shard, self.base_url, k, prefix, shard_rows[k], list(fifth_range),
+                                shard_skips[k], shard_engine, per_shard_concurrency)
+                    for k in range(shards)
+                ]
+                
+                finished_shards = set()
+                while len(finished_shards) < shards:
+                    # Relay pause/cancel requests to the shard processes
+                    job.poll_control()
+                    if job.cancelled:
+                        stop_event.set()
+                    if job.paused:
+                        pause_event.set()
+                    else:
+                        pause_event.clear()
+                    
+                    try:
+                        shard_index, batch = progress_queue.get(timeout=0.5)
+                    except queue.Empty:
+                        for future in futures:
+                            if future.done() and future.exception():
+                                raise future.exception()
+                        continue
+                    
+                    if batch is None:
+                        finished_shards.add(shard_index)
+                        continue
+                    
+                    for result in batch:
+                        completed += 1
+                        job.shard_progress(shard_index, result['status'] == 'active')
+                        self._record_result(job, result, completed, max(total, completed), active_macs, callback)
+                
+                # Shard return values carry the complete active results
+                active_macs = [result for future in futures for result in future.result()]
+        finally:
+            self._finish_scan_status(job, active_macs, owns_job)
+        
+        return active_macs
+    
+    def _start_scan_status(self, job, total, engine, controller):
+        job.update(
+            in_progress=True,
+            progress=0,
+            total=total,
+            active_found=0,
+            engine=engine,
+            concurrency=job.concurrency_limit(controller.current_limit),
+            retries=0,
+            retry_pending=0,
+            failed_after_retries=0,
+            shards=[],
+            results=[]
+        )
+    
+    def _record_probe(self, job, controller, result, latency, attempt):
+        """Feed a probe outcome to the rate controller; return True if it should be retried"""
+        failed = is_retryable_result(result)
+        controller.record(latency, failed)
+        job.update(concurrency=job.concurrency_limit(controller.current_limit))
+        
+        if not failed:
+            return False
+        if attempt < SCAN_MAX_RETRIES:
+            job.increment('retries')
+            return True
+        job.increment('failed_after_retries')
+        return False
+    
+    def _record_result(self, job, result, completed, total, active_macs, callback):
+        if result['status'] == 'active':
+            active_macs.append(result)
+            job.update(progress=completed, current_mac=result['mac'], active_found=len(active_macs))
+            job.record_active(result)
+            print(f"✅ ACTIVE: {result['mac']} ({completed}/{total})")
+        else:
+            job.update(progress=completed, current_mac=result['mac'])
+        
+        if callback:
+            callback(result, completed, total)
+    
+    def _finish_scan_status(self, job, active_macs, owns_job):
+        job.update(retry_pending=0, results=active_macs)
+        # A job passed in by the caller is finished by the caller once it has post-processed the results
+        if owns_job:
+            job.finish()
+    
+    def _timed_probe(self, mac):
+        started = time.monotonic()
+        result = self.test_single_mac(mac, use_cache=False)
+        return result, time.monotonic() - started
+    
+    def extract_active_macs_parallel(self, mac_candidates, max_workers=15, callback=None, total=None, job=None):
+        """Extract active MACs using parallel processing
+        
+        `mac_candidates` may be any iterable (including a generator). Only a
+        bounded window of futures is kept queued, so memory stays flat and
+        results are reported as soon as the first probes finish. A source
+        may yield SCAN_WAIT when its next candidates depend on results that
+        are still in flight. The number of probes in flight follows an AIMD
+        controller, and MACs that time out or hit a server error are
+        re-queued with exponential backoff.
+        
+        Progress goes to `job`; when no job is given a private one is created.
+        """
+        owns_job = job is None
+        job = job or ScanJob()
+        active_macs = []
+        if total is None:
+            total = len(mac_candidates) if hasattr(mac_candidates, '__len__') else 0
+        
+        controller = AdaptiveConcurrencyController(max_limit=max_workers)
+        self._start_scan_status(job, total, 'threads', controller)
+        
+        mac_iter = iter(job.gate(mac_candidates))
+        retry_heap = []  # (ready_at, mac, attempt)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pending = {}  # future -> (mac, attempt)
+                completed = 0
+                exhausted = False
+                
+                while pending or retry_heap or not exhausted:
+                    # Top up the in-flight window, retries first once their backoff has expired
+                    while len(pending) < job.concurrency_limit(controller.current_limit):
+                        if retry_heap and retry_heap[0][0] <= time.monotonic():
+                            _, mac, attempt = heapq.heappop(retry_heap)
+                        elif not exhausted:
+                            mac = next(mac_iter, None)
+                            if mac is None:
+                                exhausted = True
+                                continue
+                            if mac is SCAN_WAIT:
+                                break
+                            attempt = 0
+                        else:
+                            break
+                        pending[executor.submit(self._timed_probe, mac)] = (mac, attempt)
+                    
+                    job.update(retry_pending=len(retry_heap))
+                    
+                    if not pending:
+                        # Only backed-off retries (or a waiting candidate source) are left
+                        delay = retry_heap[0][0] - time.monotonic() if retry_heap else SCAN_WAIT_INTERVAL
+                        time.sleep(max(0.0, delay))
+                        continue
+                    
+                    wait_timeout = max(0.0, retry_heap[0][0] - time.monotonic()) if retry_heap else None
+                    done, _ = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        mac, attempt = pending.pop(future)
+                        result, latency = future.result()
+                        
+                        if self._record_probe(job, controller, result, latency, attempt):
+                            heapq.heappush(retry_heap, (time.monotonic() + retry_delay(attempt), mac, attempt + 1))
+                            continue
+                        
+                        completed += 1
+                        self._record_result(job, result, completed, max(total, completed), active_macs, callback)
+        finally:
+            self._finish_scan_status(job, active_macs, owns_job)
+        
+        return active_macs
+    
+    def extract_active_macs_async(self, mac_candidates, concurrency=ASYNC_SCAN_CONCURRENCY, callback=None, total=None,
+                                  job=None):
+        """Extract active MACs with asyncio, keeping up to `concurrency` probes in flight"""
+        return asyncio.run(self._extract_active_macs_async(mac_candidates, concurrency, callback, total, job))
+    
+    async def _extract_active_macs_async(self, mac_candidates, concurrency, callback, total, job):
+        owns_job = job is None
+        job = job or ScanJob()
+        active_macs = []
+        if total is None:
+            total = len(mac_candidates) if hasattr(mac_candidates, '__len__') else 0
+        
+        controller = AdaptiveConcurrencyController(max_limit=concurrency)
+        self._start_scan_status(job, total, 'async', controller)
+        
+        # Candidates flow through a bounded queue to a fixed pool of workers;
+        # the controller decides how many of those workers may probe at once
+        work_queue = asyncio.Queue(maxsize=concurrency * SCAN_QUEUE_FACTOR)
+        slots = asyncio.Condition()
+        connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        completed = 0
+        in_flight = 0
+        
+        async def produce():
+            for mac in job.gate(mac_candidates):
+                if mac is SCAN_WAIT:
+                    # The candidate source needs results of probes still in flight, or the job is paused
+                    await asyncio.sleep(SCAN_WAIT_INTERVAL)
+                    continue
+                await work_queue.put((mac, 0))
+        
+        retry_tasks = set()
+        
+        async def requeue(mac, attempt):
+            job.increment('retry_pending')
+            await asyncio.sleep(retry_delay(attempt - 1))
+            job.increment('retry_pending', -1)
+            await work_queue.put((mac, attempt))
+            work_queue.task_done()  # the original attempt is finished only once its retry is queued
+        
+        async def probe_worker(session):
+            nonlocal completed, in_flight
+            while True:
+                mac, attempt = await work_queue.get()
+                requeued = False
+                # Every item must be marked done, or work_queue.join() never returns
+                try:
+                    async with slots:
+                        await slots.wait_for(lambda: in_flight < job.concurrency_limit(controller.current_limit))
+                        in_flight += 1
+                    
+                    started = time.monotonic()
+                    try:
+                        result = await self.test_single_mac_async(session, mac)
+                    finally:
+                        async with slots:
+                            in_flight -= 1
+                            slots.notify_all()
+                    
+                    if self._record_probe(job, controller, result, time.monotonic() - started, attempt):
+                        retry_task = asyncio.create_task(requeue(mac, attempt + 1))
+                        retry_tasks.add(retry_task)
+                        retry_task.add_done_callback(retry_tasks.discard)
+                        requeued = True
+                        continue
+                    
+                    completed += 1
+                    self._record_result(job, result, completed, max(total, completed), active_macs, callback)
+                except Exception as e:
+                    print(f"Error handling probe of {mac}: {e}")
+                finally:
+                    if not requeued:
+                        work_queue.task_done()
+        
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                workers = [asyncio.create_task(probe_worker(session)) for _ in range(concurrency)]
+                await produce()
+                await work_queue.join()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            self._finish_scan_status(job, active_macs, owns_job)
+        
+        return active_macs
+
+
+# Set in each worker process of the sharded scan engine
+_shard_progress_queue = None
+_shard_stop_event = None
+_shard_pause_event = None
+
+
+def _init_shard_worker(progress_queue, stop_event=None, pause_event=None):
+    global _shard_progress_queue, _shard_stop_event, _shard_pause_event
+    _shard_progress_queue = progress_queue
+    _shard_stop_event = stop_event
+    _shard_pause_event = pause_event
+
+
+def _scan_shard(base_url, shard_index, prefix, fourth_values, fifth_values, skip, engine, concurrency):
+    """Process-pool worker: scan one shard of the MAC space and stream outcomes to the parent
+    
+    Outcomes are sent in batches of (shard_index, [results]); a final
+    (shard_index, None) tells the parent this shard has nothing more to send.
+    """
+    scanner = ActiveMACExtractor(base_url)
+    batch = []
+    
+    def shard_candidates():
+        for i in fourth_values:
+            for j in fifth_values:
+                mac = f"{prefix}:{i:02X}:{j:02X}"
+                if mac.upper() not in skip:
+                    yield mac
+    
+    def gated_candidates():
+        for mac in shard_candidates():
+            while _shard_pause_event is not None and _shard_pause_event.is_set():
+                if _shard_stop_event.is_set():
+                    break
+                yield SCAN_WAIT
+            if _shard_stop_event is not None and _shard_stop_event.is_set():
+                return
+            yield mac
+    
+    def report(result, completed, total):
+        nonlocal batch
+        if result['status'] != 'active':
+            # Only the outcome is needed by the parent for progress and the ledger
+            result = {'mac': result['mac'], 'status': result['status'], 'reason': result.get('reason')}
+        batch.append(result)
+        if len(batch) >= SHARD_REPORT_BATCH:
+            _shard_progress_queue.put((shard_index, batch))
+            batch = []
+    
+    try:
+        total = sum(1 for _ in shard_candidates())
+        return scanner.scan_candidates(gated_candidates(), total, callback=report, engine=engine, concurrency=concurrency)
+    finally:
+        if batch:
+            _shard_progress_queue.put((shard_index, batch))
+        _shard_progress_queue.put((shard_index, None))
+
+
+def scan_sighting(entry):
+    """(mac, epoch seconds, lat, lng) of a located, timestamped scan entry, else None
+    
+    Timestamps without a timezone are taken as UTC.
+    """
+    location = entry.get('location')
+    if not entry.get('mac') or not isinstance(location, dict):
+        return None
+    try:
+        observed = parser.isoparse(entry.get('last_update') or entry.get('timestamp'))
+        if observed.tzinfo is None:
+            observed = observed.replace(tzinfo=dateutil_tz.UTC)
+        lat, lng = float(location.get('lat')), float(location.get('lng'))
+    except (TypeError, ValueError):
+        return None
+    return entry['mac'], observed.timestamp(), lat, lng
+
+
+class ProbeLedger:
+    """Persistent SQLite ledger of per-MAC probe outcomes.
+    
+    Every final probe result is written as the scan goes, so an interrupted
+    scan can be resumed, and MACs that recently answered 404 can be skipped
+    (or probed last) when the same neighbourhood is scanned again. `probes`
+    keeps the latest outcome per MAC across scans, `scan_probes` every
+    scan's own outcomes, so a later or concurrent scan of the same MAC
+    doesn't take it out of an earlier scan's resume state. The location
+    reported by each active result is kept as a sighting, building the
+    per-MAC tracks the mobility classification runs on.
+    """
+
+    def __init__(self, db_path=PROBE_LEDGER_DB, flush_every=200):
+        self.db_path = db_path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._sightings = []
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            has_scan_probes = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scan_probes'"
+            ).fetchone() is not None
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    base_mac TEXT NOT NULL,
+                    range_size INTEGER NOT NULL,
+                    engine TEXT,
+                    started_at REAL NOT NULL,
+                    finished_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS probes (
+                    mac TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    reason TEXT,
+                    probed_at REAL NOT NULL,
+                    scan_id INTEGER,
+                    result TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_probes_scan ON probes(scan_id);
+                CREATE TABLE IF NOT EXISTS scan_probes (
+                    scan_id INTEGER NOT NULL,
+                    mac TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    PRIMARY KEY (scan_id, mac)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS sightings (
+                    mac TEXT NOT NULL,
+                    observed_at REAL NOT NULL,
+                    lat REAL NOT NULL,
+                    lng REAL NOT NULL,
+                    PRIMARY KEY (mac, observed_at)
+                );
+                CREATE INDEX IF NOT EXISTS idx_sightings_observed ON sightings(observed_at);
+            """)
+            if not has_scan_probes:
+                # Ledgers from before scan_probes: the outcomes still attributed to each scan
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO scan_probes (scan_id, mac, status, result) "
+                    "SELECT scan_id, mac, status, result FROM probes WHERE scan_id IS NOT NULL"
+                )
+            self._conn.commit()
+    
+    def start_scan(self, base_mac, range_size, engine, resume=False):
+        """Register a scan; with resume=True reuse the last unfinished scan of the same range.
+        
+        Returns (scan_id, resumed).
+        """
+        with self._lock:
+            if resume:
+                row = self._conn.execute(
+                    "SELECT id FROM scans WHERE base_mac = ? AND range_size = ? AND finished_at IS NULL "
+                    "ORDER BY id DESC LIMIT 1",
+                    (base_mac.upper(), range_size)
+                ).fetchone()
+                if row:
+                    return row[0], True
+            
+            cursor = self._conn.execute(
+                "INSERT INTO scans (base_mac, range_size, engine, started_at) VALUES (?, ?, ?, ?)",
+                (base_mac.upper(), range_size, engine, time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid, False
+    
+    def finish_scan(self, scan_id):
+        self.flush()
+        with self._lock:
+            self._conn.execute("UPDATE scans SET finished_at = ? WHERE id = ?", (time.time(), scan_id))
+            self._conn.commit()
+    
+    def probed_in_scan(self, scan_id, statuses=None):
+        """MACs that already have a final outcome recorded for this scan
+        
+        Only outcomes with one of `statuses` count when that is given.
+        """
+        query, params = "SELECT mac FROM scan_probes WHERE scan_id = ?", (scan_id,)
+        if statuses is not None:
+            statuses = tuple(statuses)
+            query += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params += statuses
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return {row[0] for row in rows}
+    
+    def active_results(self, scan_id):
+        """Active results already recorded for this scan"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM scan_probes WHERE scan_id = ? AND status = 'active' AND result IS NOT NULL",
+                (scan_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def recently_not_found(self, prefix, max_age_hours):
+        """MACs under `prefix` that answered not_found within the last `max_age_hours`"""
+        cutoff = time.time() - max_age_hours * 3600
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT mac FROM probes WHERE mac LIKE ? AND status = 'not_found' AND probed_at >= ?",
+                (prefix.upper() + '%', cutoff)
+            ).fetchall()
+        return {row[0] for row in rows}
+    
+    def sightings(self, macs=None, since=None):
+        """(macs, epoch seconds, lats, lngs) arrays of the recorded sightings
+        
+        Restricted to the given MACs and to sightings no older than `since`
+        (epoch seconds) when those are set.
+        """
+        query, params = "SELECT mac, observed_at, lat, lng FROM sightings", ()
+        if since is not None:
+            query, params = query + " WHERE observed_at >= ?", (since,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        
+        frame = pd.DataFrame(rows, columns=['mac', 'observed_at', 'lat', 'lng'])
+        if macs is not None:
+            frame = frame[frame['mac'].isin({mac.upper() for mac in macs})]
+        return (frame['mac'].to_numpy(dtype=object), frame['observed_at'].to_numpy(dtype=float),
+                frame['lat'].to_numpy(dtype=float), frame['lng'].to_numpy(dtype=float))
+    
+    def record(self, scan_id, result):
+        """Buffer one final probe outcome; written in batches of `flush_every`"""
+        mac = result['mac'].upper()
+        stored_result = json.dumps(result) if result['status'] == 'active' else None
+        sighting = scan_sighting(result) if result['status'] == 'active' else None
+        with self._lock:
+            self._buffer.append((mac, result['status'], str(result.get('reason', '')), time.time(), scan_id, stored_result))
+            if sighting:
+                self._sightings.append((mac,) + sighting[1:])
+            should_flush = len(self._buffer) >= self.flush_every
+        if should_flush:
+            self.flush()
+    
+    def flush(self):
+        with self._lock:
+            if not self._buffer:
+                return
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO probes (mac, status, reason, probed_at, scan_id, result) VALUES (?, ?, ?, ?, ?, ?)",
+                self._buffer
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scan_probes (scan_id, mac, status, result) VALUES (?, ?, ?, ?)",
+                [(scan_id, mac, status, result) for mac, status, _, _, scan_id, result in self._buffer]
+            )
+            # A device reporting the same reading to several scans is one sighting
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO sightings (mac, observed_at, lat, lng) VALUES (?, ?, ?, ?)",
+                self._sightings
+            )
+            self._conn.commit()
+            self._buffer = []
+            self._sightings = []
+
+
+class ScanStatusStore:
+    """SQLite-backed store of scan job snapshots and their event stream.
+    
+    The file is shared by every gunicorn worker, so whichever worker answers
+    a status or event-stream request sees the job started by another one.
+    """
+
+    def __init__(self, db_path=SCAN_JOBS_DB, progress_events_kept=SCAN_PROGRESS_EVENTS_KEPT):
+        self.db_path = db_path
+        self.progress_events_kept = progress_events_kept
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    in_progress INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    control TEXT
+                );
+                CREATE TABLE IF NOT EXISTS scan_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_scan_events_job ON scan_events(job_id, seq);
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(scan_jobs)")}
+            if 'control' not in columns:
+                self._conn.execute("ALTER TABLE scan_jobs ADD COLUMN control TEXT")
+            self._conn.commit()
+    
+    def save(self, job_id, state):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scan_jobs (job_id, state, in_progress, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(job_id) DO UPDATE SET state = excluded.state, in_progress = excluded.in_progress, "
+                "updated_at = excluded.updated_at",
+                (job_id, json.dumps(state), int(bool(state.get('in_progress'))), now, now)
+            )
+            self._conn.commit()
+    
+    def _row_to_state(self, row):
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        # A job whose worker died stops being refreshed; don't report it as running forever.
+        # Queued jobs are not refreshed until they start, so they never go stale.
+        if (state.get('in_progress') and state.get('state') != 'queued'
+                and time.time() - row[1] > SCAN_JOB_STALE_SECONDS):
+            state['in_progress'] = False
+            state['stale'] = True
+        return state
+    
+    def load(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, updated_at FROM scan_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_state(row)
+    
+    def latest(self):
+        """Snapshot of the most recently started job, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, updated_at FROM scan_jobs ORDER BY created_at DESC LIMIT 1"
+            ).fetchone()
+        return self._row_to_state(row)
+    
+    def list_jobs(self, limit=50):
+        """Snapshots of the most recent jobs, newest first, without their results"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, updated_at FROM scan_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        jobs = [self._row_to_state(row) for row in rows]
+        for job in jobs:
+            job['results'] = []
+        return jobs
+    
+    def running_count(self):
+        """Jobs running or paused in any worker, ignoring ones that went stale"""
+        cutoff = time.time() - SCAN_JOB_STALE_SECONDS
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM scan_jobs WHERE in_progress = 1 AND updated_at >= ? "
+                "AND json_extract(state, '$.state') != 'queued'", (cutoff,)
+            ).fetchone()
+        return row[0]
+    
+    def touch(self, job_id):
+        with self._lock:
+            self._conn.execute("UPDATE scan_jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+            self._conn.commit()
+    
+    def set_control(self, job_id, action):
+        """Ask the worker running a job to 'cancel', 'pause' or 'resume' it"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE scan_jobs SET control = ? WHERE job_id = ?", (action, job_id))
+            self._conn.commit()
+        return cursor.rowcount > 0
+    
+    def control(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT control FROM scan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+    
+    def add_event(self, job_id, event, payload):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scan_events (job_id, event, payload, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, event, json.dumps(payload), time.time())
+            )
+            if event == 'progress':
+                self._conn.execute(
+                    "DELETE FROM scan_events WHERE job_id = ? AND event = 'progress' AND seq <= "
+                    "(SELECT seq FROM scan_events WHERE job_id = ? AND event = 'progress' "
+                    "ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                    (job_id, job_id, self.progress_events_kept)
+                )
+            self._conn.commit()
+    
+    def events_since(self, job_id, last_seq=0, limit=500):
+        """Events of a job after sequence number `last_seq`, as (seq, event, payload) tuples"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, event, payload FROM scan_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, last_seq, limit)
+            ).fetchall()
+        return [(seq, event, json.loads(payload)) for seq, event, payload in rows]
+    
+    def prune(self, max_age_hours=SCAN_JOB_RETENTION_HOURS):
+        """Drop finished jobs and their events older than `max_age_hours`"""
+        cutoff = time.time() - max_age_hours * 3600
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM scan_events WHERE job_id IN "
+                "(SELECT job_id FROM scan_jobs WHERE in_progress = 0 AND updated_at < ?)", (cutoff,)
+            )
+            self._conn.execute("DELETE FROM scan_jobs WHERE in_progress = 0 AND updated_at < ?", (cutoff,))
+            self._conn.commit()
+
+
+class ScanJob:
+    """Status of one MAC scan, safe to update from any number of worker threads.
+    
+    Every mutation happens under a private lock, so counters such as
+    `progress` and `retries` never lose increments. With a store attached,
+    snapshots are written through (throttled to SCAN_STATUS_PERSIST_INTERVAL)
+    and 'progress', 'active' and 'finished' events are appended for the
+    event-stream endpoint.
+    
+    A job can be paused, resumed and cancelled, from this process or (through
+    the store) from any other worker. Engines draw their candidates through
+    gate(), which holds new probes back while paused and ends the stream once
+    cancelled, and cap their in-flight probes with concurrency_limit().
+    """
+
+    def __init__(self, job_id=None, store=None, **fields):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.store = store
+        self._lock = threading.Lock()
+        self._state = copy.deepcopy(SCAN_STATUS_DEFAULTS)
+        self._state.update(fields, job_id=self.job_id)
+        self._persisted_at = 0.0
+        self._cancelled = threading.Event()
+        self._paused = threading.Event()
+        self._control_polled_at = 0.0
+        self.concurrency_cap = None
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    @property
+    def paused(self):
+        return self._paused.is_set()
+    
+    def cancel(self):
+        self._apply_control('cancel')
+        if self.store is not None:
+            self.store.set_control(self.job_id, 'cancel')
+    
+    def pause(self):
+        self._apply_control('pause')
+        if self.store is not None:
+            self.store.set_control(self.job_id, 'pause')
+    
+    def resume(self):
+        self._apply_control('resume')
+        if self.store is not None:
+            self.store.set_control(self.job_id, 'resume')
+    
+    def _apply_control(self, action):
+        if action == 'cancel' and not self.cancelled:
+            self._cancelled.set()
+            self._paused.clear()
+            self.update(state='cancelling')
+        elif action == 'pause' and not self.paused and not self.cancelled:
+            self._paused.set()
+            self.update(state='paused')
+        elif action == 'resume' and self.paused:
+            self._paused.clear()
+            self.update(state='running')
+    
+    def poll_control(self, force=False):
+        """Pick up control requests and the fair concurrency share from the store"""
+        if self.store is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._control_polled_at < SCAN_CONTROL_POLL_INTERVAL:
+                return
+            self._control_polled_at = now
+        
+        action = self.store.control(self.job_id)
+        if action:
+            self._apply_control(action)
+        
+        share = max(1, GLOBAL_SCAN_CONCURRENCY // max(1, self.store.running_count()))
+        if share != self.concurrency_cap:
+            self.concurrency_cap = share
+            self.update(concurrency_share=share)
+        # Keeps a paused job (which makes no progress updates) from looking stale
+        self.store.touch(self.job_id)
+    
+    def start(self):
+        """Store the job as running (or paused) and take its concurrency share"""
+        with self._lock:
+            self._state['state'] = 'paused' if self.paused else 'running'
+        self.persist(force=True)
+        # Only now does the store count this job, so its share is recounted
+        self.poll_control(force=True)
+    
+    def concurrency_limit(self, limit):
+        """Clamp an engine's in-flight limit to this job's share of the global budget"""
+        cap = self.concurrency_cap
+        return limit if cap is None else max(1, min(limit, cap))
+    
+    def gate(self, mac_candidates):
+        """Pass candidates through, yielding SCAN_WAIT while paused and stopping once cancelled"""
+        for mac in mac_candidates:
+            self.poll_control()
+            while self.paused and not self.cancelled:
+                yield SCAN_WAIT
+                self.poll_control()
+            if self.cancelled:
+                return
+            yield mac
+    
+    def update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+        self.persist()
+    
+    def increment(self, field, amount=1):
+        with self._lock:
+            self._state[field] += amount
+            value = self._state[field]
+        self.persist()
+        return value
+    
+    def get(self, field, default=None):
+        with self._lock:
+            return self._state.get(field, default)
+    
+    def snapshot(self, include_results=True):
+        with self._lock:
+            state = dict(self._state)
+            state['shards'] = [dict(shard) for shard in state['shards']]
+            state['results'] = list(state['results']) if include_results else []
+        return state
+    
+    def shard_progress(self, shard_index, active=False):
+        with self._lock:
+            shard = self._state['shards'][shard_index]
+            shard['progress'] += 1
+            if active:
+                shard['active_found'] += 1
+    
+    def record_active(self, result):
+        """Push a newly found active MAC to event-stream listeners"""
+        if self.store is not None:
+            self.store.add_event(self.job_id, 'active', result)
+    
+    def persist(self, force=False):
+        """Write the snapshot to the store and emit a 'progress' event, at most every SCAN_STATUS_PERSIST_INTERVAL"""
+        if self.store is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._persisted_at < SCAN_STATUS_PERSIST_INTERVAL:
+                return
+            self._persisted_at = now
+        state = self.snapshot()
+        self.store.save(self.job_id, state)
+        self.store.add_event(self.job_id, 'progress', dict(state, results=[]))
+    
+    def finish(self, **fields):
+        fields.setdefault('state', 'cancelled' if self.cancelled else 'finished')
+        with self._lock:
+            self._state.update(fields, in_progress=False, retry_pending=0)
+        self.persist(force=True)
+        if self.store is not None:
+            self.store.add_event(self.job_id, 'finished', self.snapshot())
+
+
+class ScanJobManager:
+    """Runs scan jobs on a bounded pool, queueing the rest in submission order.
+    
+    At most `max_running` jobs scan at once in this process; each running job
+    is capped to an equal share of GLOBAL_SCAN_CONCURRENCY (counted across all
+    workers through the store), so several scans together never exceed the
+    upstream budget.
+    """
+
+    def __init__(self, store, max_running=SCAN_MAX_JOBS, max_queued=SCAN_MAX_QUEUED_JOBS):
+        self.store = store
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix='scan-job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+    
+    def submit(self, target, *args, **fields):
+        """Queue `target(job, *args)` as a new job and return the job.
+        
+        Raises RuntimeError when too many jobs are already waiting.
+        """
+        with self._lock:
+            waiting = sum(1 for job in self._jobs.values() if job.get('state') == 'queued')
+            if waiting >= self.max_queued:
+                raise RuntimeError(f'Too many queued scan jobs (max {self.max_queued})')
+            job = ScanJob(store=self.store, in_progress=True, state='queued', **fields)
+            self._jobs[job.job_id] = job
+        job.persist(force=True)
+        self._executor.submit(self._run, job, target, args)
+        return job
+    
+    def _run(self, job, target, args):
+        try:
+            job.poll_control(force=True)
+            if job.cancelled:
+                job.finish()
+                return
+            job.start()
+            target(job, *args)
+        finally:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            self.store.prune(SCAN_JOB_RETENTION_HOURS)
+    
+    def get(self, job_id):
+        """The live job if it belongs to this process, else None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def control(self, job_id, action):
+        """Cancel, pause or resume a job wherever it runs; returns False for unknown jobs"""
+        job = self.get(job_id)
+        if job is not None:
+            getattr(job, action)()
+            return True
+        # Owned by another worker: leave the request in the store for it to pick up
+        state = self.store.load(job_id)
+        if state is None or not state['in_progress']:
+            return False
+        return self.store.set_control(job_id, action)
+
+
+def plan_scan_candidates(mac_candidates, skip=(), defer=()):
+    """Drop MACs in `skip` and move MACs in `defer` to the end of the stream"""
+    deferred = []
+    for mac in mac_candidates:
+        key = mac.upper()
+        if key in skip:
+            continue
+        if key in defer:
+            deferred.append(mac)
+            continue
+        yield mac
+    yield from deferred
+
+
+class GeocodeCache:
+    """Persistent reverse-geocoding cache shared by all workers through SQLite.
+    
+    Entries are keyed by quantised coordinates, expire after `ttl_hours`
+    (failed lookups after `failure_ttl` seconds, so an unreachable geocoder
+    is not retried on every request) and the least recently used entries
+    are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, db_path=GEOCODE_CACHE_DB, precision=GEOCODE_PRECISION, ttl_hours=GEOCODE_TTL_HOURS,
+                 failure_ttl=GEOCODE_FAILURE_TTL_SECONDS, max_entries=GEOCODE_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.precision = precision
+        self.ttl = ttl_hours * 3600
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS geocode (
+                    key TEXT PRIMARY KEY,
+                    location TEXT,
+                    fetched_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_geocode_last_used ON geocode(last_used);
+            """)
+            self._conn.commit()
+    
+    def key(self, lat, lng):
+        return f"{float(lat):.{self.precision}f},{float(lng):.{self.precision}f}"
+    
+    def get(self, lat, lng, count=True):
+        """Return (found, location); location is None for a cached failed lookup"""
+        key = self.key(lat, lng)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT location, fetched_at FROM geocode WHERE key = ?", (key,)).fetchone()
+            found = row is not None and now - row[1] <= (self.ttl if row[0] is not None else self.failure_ttl)
+            if count:
+                if found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if not found:
+                return False, None
+            self._conn.execute("UPDATE geocode SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return True, row[0]
+    
+    def put(self, lat, lng, location):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, location, fetched_at, last_used) VALUES (?, ?, ?, ?)",
+                (self.key(lat, lng), location, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+    
+    def lookup(self, lat, lng, fetch):
+        """Cached location for (lat, lng), calling `fetch(lat, lng)` on a miss.
+        
+        Concurrent misses for the same key in this process wait for a single
+        fetch instead of all calling the geocoder.
+        """
+        found, location = self.get(lat, lng)
+        if found:
+            return location
+        
+        key = self.key(lat, lng)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            found, location = self.get(lat, lng, count=False)
+            if not found:
+                location = fetch(lat, lng)
+                self.put(lat, lng, location)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return location
+    
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+            hits, misses = self.hits, self.misses
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'precision': self.precision,
+            'ttl_hours': self.ttl / 3600,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None
+        }
+
+
+# AQI categories: values up to each breakpoint (inclusive) fall in the matching level
+AQI_BREAKPOINTS = np.array([50, 100, 150, 200, 300])
+AQI_LEVELS = np.array([
+    "Good", "Moderate", "Unhealthy for Sensitive Groups", "Unhealthy", "Very Unhealthy", "Hazardous"
+], dtype=object)
+
+# The system zone file (if any) lets pandas convert whole arrays; tzlocal() is converted value by value
+LOCAL_TZ = dateutil_tz.gettz() or dateutil_tz.tzlocal()
+HOUR_TIME_LABELS = np.array([f"{hour:02d}:00:00" for hour in range(24)], dtype=object)
+HOUR_NOTE_LABELS = np.array([f" {hour:02d}:00" for hour in range(24)], dtype=object)
+DAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], dtype=object)
+HOURLY_COLUMNS = [
+    'mac', 'timestamp', 'date', 'time', 'hour', 'day_of_week', 'aqi', 'calculatedAqi', 'aqi_level',
+    'measurement_type', 'data_source', 'location', 'latitude', 'longitude', 'hours_ago', 'real_timestamp', 'note'
+]
+
+
+def aqi_levels(values):
+    """Vectorised get_aqi_level: descriptive level for every value of an array"""
+    values = np.asarray(values, dtype='float64')
+    levels = AQI_LEVELS[np.searchsorted(AQI_BREAKPOINTS, values, side='left')]
+    levels[~(values >= 0)] = "No Data"
+    return levels
+
+def reading_position(data):
+    """(lat, lng) reported by a latest-reading payload, or None"""
+    if not isinstance(data, dict):
+        return None
+    try:
+        lat = float(data.get('lat') or data.get('latitude'))
+        lng = float(data.get('lng') or data.get('longitude'))
+    except (TypeError, ValueError):
+        return None
+    return (lat, lng) if math.isfinite(lat) and math.isfinite(lng) else None
+
+
+class HourlyAQIStore:
+    """Local SQLite time series of hourly AQI values per MAC.
+    
+    Rows are keyed by (mac, hour start as epoch seconds), so re-ingesting an
+    overlapping series just refreshes the hours it covers. sync_state keeps
+    the newest hour ingested per MAC, which is all that is needed to know
+    how much of the tail to fetch from upstream next time.
+    
+    Hours ingested with a device position also carry its map grid cell, and
+    coverage_buckets aggregates them per cell and hour/day bucket (reading
+    count, AQI sum and max, last hour seen). Each ingest recomputes only the
+    buckets its hours fall in, so heatmaps over any window read a handful of
+    pre-aggregated rows instead of the raw series.
+    """
+
+    def __init__(self, db_path=AQI_HISTORY_DB, grid=None):
+        self.db_path = db_path
+        self._grid = grid
+        self._grid_fingerprint = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS hourly_aqi (
+                    mac TEXT NOT NULL,
+                    hour_ts INTEGER NOT NULL,
+                    aqi REAL NOT NULL,
+                    ingested_at REAL NOT NULL,
+                    PRIMARY KEY (mac, hour_ts)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    mac TEXT PRIMARY KEY,
+                    last_hour INTEGER NOT NULL,
+                    synced_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS ingest_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at REAL NOT NULL,
+                    finished_at REAL NOT NULL,
+                    devices INTEGER NOT NULL,
+                    readings INTEGER NOT NULL,
+                    errors TEXT
+                );
+                CREATE TABLE IF NOT EXISTS coverage_buckets (
+                    bucket INTEGER NOT NULL,
+                    bucket_ts INTEGER NOT NULL,
+                    cell INTEGER NOT NULL,
+                    readings INTEGER NOT NULL,
+                    aqi_sum REAL NOT NULL,
+                    aqi_max REAL NOT NULL,
+                    last_seen INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, bucket_ts, cell)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS store_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(hourly_aqi)")}
+            for column, column_type in (('lat', 'REAL'), ('lng', 'REAL'), ('cell', 'INTEGER')):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE hourly_aqi ADD COLUMN {column} {column_type}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_hourly_cell ON hourly_aqi(cell, hour_ts)")
+            self._conn.commit()
+    
+    @staticmethod
+    def current_hour(now=None):
+        """Epoch seconds of the start of the current (local) hour"""
+        now = now or datetime.now()
+        return int(now.replace(minute=0, second=0, microsecond=0).timestamp())
+    
+    def sync_state(self, mac):
+        """(last_hour, synced_at) for a MAC, or (None, None) if it was never synced"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_hour, synced_at FROM sync_state WHERE mac = ?", (mac.upper(),)
+            ).fetchone()
+        return row if row else (None, None)
+    
+    def hours_to_fetch(self, mac, now=None):
+        """Length of the upstream series needed to cover everything since the last sync"""
+        last_hour, _ = self.sync_state(mac)
+        if last_hour is None:
+            return HISTORY_MAX_FETCH_HOURS
+        missing = (self.current_hour(now) - last_hour) // 3600
+        # The last synced hour may still have been filling up, so it is fetched again
+        return max(1, min(HISTORY_MAX_FETCH_HOURS, missing + HISTORY_OVERLAP_HOURS))
+    
+    def ingest(self, mac, values, now=None, location=None):
+        """Store an hourly series whose last value is the current hour; -1 marks a missing hour
         
-        active_macs = []
-        total = len(mac_list)
-        
-        scanning_status.update({
-            'in_progress': True,
-            'progress': 0,
-            'total': total,
-            'active_found': 0,
-            'results': []
-        })
+        The sync watermark only moves to the newest hour that has a value, and
+        only when the series reaches back to the current watermark (or is as
+        long as any sync asks for). A short or partial series is stored, but
+        the hours it misses are fetched again next time instead of being
+        skipped for good.
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_mac = {executor.submit(self.test_single_mac, mac): mac for mac in mac_list}
+        `location` is the device's (lat, lng) at ingest time, so it is only
+        stored on the current hour, and only if that hour has no position
+        yet. Earlier hours keep the position they were ingested with, or none.
+        A backfill therefore never places a mobile device's past week in
+        today's map cell.
+        """
+        mac = mac.upper()
+        current_hour = self.current_hour(now)
+        ingested_at = time.time()
+        lat, lng = location if location else (None, None)
+        with self._lock:
+            cell = self._coverage_grid().cell_index(lat, lng) if location else None
+            rows = [
+                (mac, hour_ts, value, ingested_at) + ((lat, lng, cell) if hour_ts == current_hour else (None, None, None))
+                for hour_ts, value in zip(range(current_hour - (len(values) - 1) * 3600, current_hour + 1, 3600), values)
+                if value is not None and value != -1
+            ]
+            self._conn.executemany(
+                "INSERT INTO hourly_aqi (mac, hour_ts, aqi, ingested_at, lat, lng, cell) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(mac, hour_ts) DO UPDATE SET aqi = excluded.aqi, ingested_at = excluded.ingested_at, "
+                "cell = CASE WHEN hourly_aqi.lat IS NULL THEN excluded.cell ELSE hourly_aqi.cell END, "
+                "lat = COALESCE(hourly_aqi.lat, excluded.lat), lng = COALESCE(hourly_aqi.lng, excluded.lng)",
+                rows
+            )
+            if rows:
+                self._update_coverage(mac, rows[0][1], rows[-1][1])
             
-            # Process completed tasks
-            completed = 0
-            for future in as_completed(future_to_mac):
-                result = future.result()
-                completed += 1
-                
-                scanning_status['progress'] = completed
-                scanning_status['current_mac'] = result['mac']
-                
-                if result['status'] == 'active':
-                    active_macs.append(result)
-                    scanning_status['active_found'] = len(active_macs)
-                    print(f"✅ ACTIVE: {result['mac']} ({completed}/{total})")
-                
-                if callback:
-                    callback(result, completed, total)
+            previous = self._conn.execute("SELECT last_hour FROM sync_state WHERE mac = ?", (mac,)).fetchone()
+            series_start = current_hour - (len(values) - 1) * 3600
+            reaches_back = (previous is None or series_start <= previous[0] + 3600
+                            or len(values) >= HISTORY_MAX_FETCH_HOURS)
+            if rows and reaches_back:
+                self._conn.execute(
+                    "INSERT INTO sync_state (mac, last_hour, synced_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(mac) DO UPDATE SET last_hour = MAX(last_hour, excluded.last_hour), "
+                    "synced_at = excluded.synced_at",
+                    (mac, rows[-1][1], ingested_at)
+                )
+            else:
+                self._conn.execute("UPDATE sync_state SET synced_at = ? WHERE mac = ?", (ingested_at, mac))
+            self._conn.commit()
+        return len(rows)
+    
+    def _coverage_grid(self):
+        """The grid cells are assigned on, reassigning stored hours first if it changed; lock held"""
+        grid = self._grid or map_grid()
+        fingerprint = json.dumps([grid.min_lat, grid.min_lon, grid.step, grid.rows, grid.cols])
+        if fingerprint != self._grid_fingerprint:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = 'coverage_grid'").fetchone()
+            if row is None or row[0] != fingerprint:
+                self._rebuild_coverage(grid)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('coverage_grid', ?)", (fingerprint,)
+                )
+                self._conn.commit()
+            self._grid_fingerprint = fingerprint
+        return grid
+    
+    def _rebuild_coverage(self, grid):
+        """Reassign every located hour to `grid` and aggregate all buckets again; lock held"""
+        rows = self._conn.execute("SELECT mac, hour_ts, lat, lng FROM hourly_aqi WHERE lat IS NOT NULL").fetchall()
+        if rows:
+            macs, hours, lats, lngs = zip(*rows)
+            cells = grid.cell_indices(lats, lngs).tolist()
+            self._conn.executemany(
+                "UPDATE hourly_aqi SET cell = ? WHERE mac = ? AND hour_ts = ?",
+                [(cell if cell >= 0 else None, mac, hour_ts) for cell, mac, hour_ts in zip(cells, macs, hours)]
+            )
+        self._conn.execute("DELETE FROM coverage_buckets")
+        for bucket in COVERAGE_BUCKETS:
+            self._conn.execute(
+                "INSERT INTO coverage_buckets (bucket, bucket_ts, cell, readings, aqi_sum, aqi_max, last_seen) "
+                "SELECT ?1, hour_ts - hour_ts % ?1, cell, COUNT(*), SUM(aqi), MAX(aqi), MAX(hour_ts) "
+                "FROM hourly_aqi WHERE cell IS NOT NULL GROUP BY hour_ts - hour_ts % ?1, cell",
+                (bucket,)
+            )
+        self._bump_coverage_version()
+    
+    def _update_coverage(self, mac, first_hour, last_hour):
+        """Recompute the buckets holding a MAC's located hours in [first_hour, last_hour]; lock held"""
+        touched = self._conn.execute(
+            "SELECT DISTINCT cell, hour_ts FROM hourly_aqi "
+            "WHERE mac = ? AND hour_ts >= ? AND hour_ts <= ? AND cell IS NOT NULL",
+            (mac, first_hour, last_hour)
+        ).fetchall()
+        if not touched:
+            return
+        buckets = {(bucket, hour_ts - hour_ts % bucket, cell) for cell, hour_ts in touched for bucket in COVERAGE_BUCKETS}
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO coverage_buckets (bucket, bucket_ts, cell, readings, aqi_sum, aqi_max, last_seen) "
+            "SELECT ?1, ?2, cell, COUNT(*), SUM(aqi), MAX(aqi), MAX(hour_ts) FROM hourly_aqi "
+            "WHERE cell = ?3 AND hour_ts >= ?2 AND hour_ts < ?2 + ?1 GROUP BY cell",
+            sorted(buckets)
+        )
+        self._bump_coverage_version()
+    
+    def _bump_coverage_version(self):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('coverage_version', ?)", (repr(time.time()),)
+        )
+    
+    def positions(self, macs=None, since=None):
+        """(macs, epoch seconds, lats, lngs) arrays of the located hours, like ProbeLedger.sightings"""
+        query, params = "SELECT mac, hour_ts, lat, lng FROM hourly_aqi WHERE lat IS NOT NULL", ()
+        if since is not None:
+            query, params = query + " AND hour_ts >= ?", (int(since),)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
         
-        scanning_status['in_progress'] = False
-        scanning_status['results'] = active_macs
-        return active_macs
+        frame = pd.DataFrame(rows, columns=['mac', 'hour_ts', 'lat', 'lng'])
+        if macs is not None:
+            frame = frame[frame['mac'].isin({mac.upper() for mac in macs})]
+        return (frame['mac'].to_numpy(dtype=object), frame['hour_ts'].to_numpy(dtype=float),
+                frame['lat'].to_numpy(dtype=float), frame['lng'].to_numpy(dtype=float))
+    
+    def coverage_version(self):
+        """Changes whenever the coverage aggregate does (in any process sharing the database)"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = 'coverage_version'").fetchone()
+        return row[0] if row else None
+    
+    def coverage(self, start_ts, end_ts):
+        """Per-cell totals of the readings with start_ts <= hour_ts < end_ts, bounds rounded out to hours
+        
+        Returns (cells, readings, aqi_sum, aqi_max, last_seen) arrays. Whole
+        days inside the window are read from the day buckets and only the
+        hours at its edges from the hour buckets.
+        """
+        hour, day = COVERAGE_BUCKETS
+        start_ts = int(start_ts) - int(start_ts) % hour
+        end_ts = int(end_ts) + (-int(end_ts)) % hour
+        first_day = start_ts + (-start_ts) % day
+        last_day = end_ts - end_ts % day
+        if first_day >= last_day:
+            first_day = last_day = end_ts
+        with self._lock:
+            self._coverage_grid()
+            rows = self._conn.execute(
+                "SELECT cell, SUM(readings), SUM(aqi_sum), MAX(aqi_max), MAX(last_seen) FROM coverage_buckets "
+                "WHERE (bucket = ? AND bucket_ts >= ? AND bucket_ts < ?) "
+                "OR (bucket = ? AND ((bucket_ts >= ? AND bucket_ts < ?) OR (bucket_ts >= ? AND bucket_ts < ?))) "
+                "GROUP BY cell",
+                (day, first_day, last_day, hour, start_ts, first_day, last_day, end_ts)
+            ).fetchall()
+        columns = list(zip(*rows)) or [()] * 5
+        return (np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype=np.int64),
+                np.array(columns[2], dtype=float), np.array(columns[3], dtype=float),
+                np.array(columns[4], dtype=np.int64))
+    
+    def record_ingest_run(self, started_at, finished_at, devices, readings, errors):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ingest_runs (started_at, finished_at, devices, readings, errors) VALUES (?, ?, ?, ?, ?)",
+                (started_at, finished_at, devices, readings, json.dumps(errors))
+            )
+            self._conn.execute("DELETE FROM ingest_runs WHERE id <= (SELECT MAX(id) - 100 FROM ingest_runs)")
+            self._conn.commit()
+    
+    def last_ingest_run(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT started_at, finished_at, devices, readings, errors FROM ingest_runs ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        if row is None:
+            return None
+        started_at, finished_at, devices, readings, errors = row
+        return {
+            'started_at': datetime.fromtimestamp(started_at).isoformat(),
+            'finished_at': datetime.fromtimestamp(finished_at).isoformat(),
+            'duration_seconds': round(finished_at - started_at, 2),
+            'devices': devices,
+            'readings': readings,
+            'errors': json.loads(errors) if errors else {}
+        }
+    
+    def read_arrays(self, mac, start_ts, end_ts):
+        """Same rows as read(), as (hour_ts int64 array, aqi float64 array)"""
+        rows = self.read(mac, start_ts, end_ts)
+        hour_ts = np.fromiter((row[0] for row in rows), dtype='int64', count=len(rows))
+        aqi = np.fromiter((row[1] for row in rows), dtype='float64', count=len(rows))
+        return hour_ts, aqi
+    
+    def read(self, mac, start_ts, end_ts):
+        """(hour_ts, aqi) rows with start_ts <= hour_ts < end_ts, oldest first"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT hour_ts, aqi FROM hourly_aqi WHERE mac = ? AND hour_ts >= ? AND hour_ts < ? ORDER BY hour_ts",
+                (mac.upper(), int(start_ts), int(end_ts))
+            ).fetchall()
+    
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT h.mac, COUNT(*), MIN(h.hour_ts), MAX(h.hour_ts), s.synced_at "
+                "FROM hourly_aqi h LEFT JOIN sync_state s ON s.mac = h.mac GROUP BY h.mac"
+            ).fetchall()
+        return [
+            {
+                'mac': mac,
+                'hours': count,
+                'first_hour': datetime.fromtimestamp(first).isoformat(),
+                'last_hour': datetime.fromtimestamp(last).isoformat(),
+                'synced_at': datetime.fromtimestamp(synced_at).isoformat() if synced_at else None
+            }
+            for mac, count, first, last, synced_at in rows
+        ]
 
 
 class AirQualityAPI:
-    def __init__(self, base_url):
+    def __init__(self, base_url, http=None, geocode_cache=None, latest_readings=None, history_store=None):
         self.base_url = base_url.rstrip('/')
         self.devices_file = 'saved_devices.json'
+        self.http = http or http_client
+        self.geocode_cache = geocode_cache
+        self.latest_readings = latest_readings or latest_reading_cache
+        self.history_store = history_store if history_store is not None else HourlyAQIStore(':memory:')
+    
+    def fetch_latest_reading(self, mac, timeout=10):
+        """(status_code, payload) of the device's latest reading, shared through the latest-reading cache"""
+        return self.latest_readings.fetch(self.http, self.base_url, mac, timeout=timeout)
     
     def get_saved_devices(self):
         """Get list of saved devices from local file"""
@@ -221,11 +2326,9 @@ class AirQualityAPI:
     def test_device(self, mac):
         """Test if a device MAC address works"""
         try:
-            url = f"{self.base_url}/api/v1/data-intake/{mac}"
-            response = requests.get(url, timeout=10)
+            status_code, data = self.fetch_latest_reading(mac)
             
-            if response.status_code == 200:
-                data = response.json()
+            if status_code == 200:
                 if data and isinstance(data, dict):
                     # Look for air quality data fields
                     air_quality_fields = [
@@ -239,10 +2342,10 @@ class AirQualityAPI:
                         return False, "Response doesn't contain expected air quality data"
                 else:
                     return False, "No data available"
-            elif response.status_code == 404:
+            elif status_code == 404:
                 return False, "Device not found"
             else:
-                return False, f"HTTP {response.status_code}"
+                return False, f"HTTP {status_code}"
         except Exception as e:
             return False, f"Connection error: {str(e)}"
     
@@ -250,62 +2353,76 @@ class AirQualityAPI:
         """Convert AQI numeric value to descriptive level"""
         if aqi_value is None or aqi_value < 0:
             return "No Data"
-        elif aqi_value <= 50:
-            return "Good"
-        elif aqi_value <= 100:
-            return "Moderate"
-        elif aqi_value <= 150:
-            return "Unhealthy for Sensitive Groups"
-        elif aqi_value <= 200:
-            return "Unhealthy"
-        elif aqi_value <= 300:
-            return "Very Unhealthy"
-        else:
-            return "Hazardous"
+        return AQI_LEVELS[np.searchsorted(AQI_BREAKPOINTS, aqi_value, side='left')]
     
     def get_location_from_coords(self, lat, lng):
-        """Get location name from coordinates using reverse geocoding"""
+        """Get location name from coordinates using reverse geocoding (cached when a cache is configured)"""
         try:
             if lat and lng and lat != 0 and lng != 0:
-                # Try to get location from a free geocoding service
-                url = f"https://api.bigdatacloud.net/data/reverse-geocode-client?latitude={lat}&longitude={lng}&localityLanguage=en"
-                response = requests.get(url, timeout=5)
-                
-                if response.status_code == 200:
-                    location_data = response.json()
-                    
-                    # Build location string from components
-                    location_parts = []
-                    
-                    if 'locality' in location_data and location_data['locality']:
-                        location_parts.append(location_data['locality'])
-                    elif 'city' in location_data and location_data['city']:
-                        location_parts.append(location_data['city'])
-                    
-                    if 'principalSubdivision' in location_data and location_data['principalSubdivision']:
-                        location_parts.append(location_data['principalSubdivision'])
-                    
-                    if 'countryName' in location_data and location_data['countryName']:
-                        location_parts.append(location_data['countryName'])
-                    
-                    if location_parts:
-                        return ', '.join(location_parts)
-                
+                if self.geocode_cache is not None:
+                    location = self.geocode_cache.lookup(lat, lng, self.reverse_geocode)
+                else:
+                    location = self.reverse_geocode(lat, lng)
+                if location:
+                    return location
+            
             # Fallback to coordinates
             return f"Coordinates: {lat}, {lng}"
-            
+        
         except Exception as e:
             print(f"Error getting location from coords: {e}")
             return f"Coordinates: {lat}, {lng}"
     
+    def reverse_geocode(self, lat, lng):
+        """Look up a location name with the geocoding service; None if it has no answer"""
+        try:
+            # Try to get location from a free geocoding service
+            url = f"https://api.bigdatacloud.net/data/reverse-geocode-client?latitude={lat}&longitude={lng}&localityLanguage=en"
+            response = self.http.get(url, timeout=5)
+            
+            if response.status_code == 200:
+                location_data = response.json()
+                
+                # Build location string from components
+                location_parts = []
+                
+                if 'locality' in location_data and location_data['locality']:
+                    location_parts.append(location_data['locality'])
+                elif 'city' in location_data and location_data['city']:
+                    location_parts.append(location_data['city'])
+                
+                if 'principalSubdivision' in location_data and location_data['principalSubdivision']:
+                    location_parts.append(location_data['principalSubdivision'])
+                
+                if 'countryName' in location_data and location_data['countryName']:
+                    location_parts.append(location_data['countryName'])
+                
+                if location_parts:
+                    return ', '.join(location_parts)
+            return None
+        
+        except Exception as e:
+            print(f"Error reverse geocoding {lat}, {lng}: {e}")
+            return None
+    
+    def warm_geocode_cache(self, macs=None):
+        """Resolve the location of every saved device (or of `macs`) ahead of the first download"""
+        if macs is None:
+            macs = [device['mac'] for device in self.get_saved_devices()]
+        
+        def warm(mac):
+            lat, lng = self.get_device_coordinates(mac)
+            return {'mac': mac, 'latitude': lat, 'longitude': lng, 'location': self.get_location_from_coords(lat, lng)}
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(GEOCODE_WARM_WORKERS, len(macs)))) as executor:
+            return list(executor.map(warm, macs))
+    
     def get_device_coordinates(self, mac):
         """Get device coordinates from the latest data"""
         try:
-            url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
-            response = requests.get(url, timeout=10)
+            status_code, data = self.fetch_latest_reading(mac)
             
-            if response.status_code == 200:
-                data = response.json()
+            if status_code == 200:
                 if isinstance(data, dict):
                     lat = data.get('lat') or data.get('latitude')
                     lng = data.get('lng') or data.get('longitude') 
@@ -320,8 +2437,57 @@ class AirQualityAPI:
             print(f"Error getting device coordinates: {e}")
             return 45.7613, 21.2513
     
-    def get_hourly_data(self, mac, hours_from, hours_to):
-        """Get hourly data using the 24h endpoint with proper data processing"""
+    def build_hourly_frame(self, mac, hour_ts, aqi, location, lat, lng, measurement_type, note_prefix,
+                           start_hour=0, end_hour=23, current_hour=None):
+        """Build the per-reading table for an hourly series with array operations
+        
+        `hour_ts` holds epoch seconds of hour starts and `aqi` the values;
+        missing readings (-1 or NaN) are dropped and only hours of day in
+        [start_hour, end_hour] are kept. Columns match the dicts returned by
+        get_hourly_data and get_date_range_data.
+        """
+        hour_ts = np.asarray(hour_ts, dtype='int64')
+        aqi = np.asarray(aqi, dtype='float64')
+        valid = ~np.isnan(aqi) & (aqi != -1)
+        hour_ts, aqi = hour_ts[valid], aqi[valid]
+        
+        # Local wall-clock time of each hour, as naive datetime64 values
+        local = pd.DatetimeIndex(pd.to_datetime(hour_ts, unit='s', utc=True)).tz_convert(LOCAL_TZ).tz_localize(None)
+        hours = local.hour.to_numpy()
+        keep = (hours >= start_hour) & (hours <= end_hour)
+        local, hours, hour_ts, aqi = local[keep], hours[keep], hour_ts[keep], aqi[keep]
+        
+        order = np.argsort(hour_ts, kind='stable')
+        local, hours, hour_ts, aqi = local[order], hours[order], hour_ts[order], aqi[order]
+        
+        if current_hour is None:
+            current_hour = HourlyAQIStore.current_hour()
+        stamps = np.datetime_as_string(local.to_numpy(), unit='s').astype(object)
+        dates = stamps.astype('U10').astype(object)
+        
+        # Columns are built as object arrays up front; converting numpy strings is what pandas would spend its time on
+        return pd.DataFrame({
+            'mac': mac,
+            'timestamp': stamps + 'Z',
+            'date': dates,
+            'time': HOUR_TIME_LABELS[hours],
+            'hour': hours,
+            'day_of_week': DAY_NAMES[local.dayofweek.to_numpy()],
+            'aqi': aqi,
+            'calculatedAqi': aqi,
+            'aqi_level': aqi_levels(aqi),
+            'measurement_type': measurement_type,
+            'data_source': 'history_store',
+            'location': location,
+            'latitude': lat,
+            'longitude': lng,
+            'hours_ago': (current_hour - hour_ts) // 3600,
+            'real_timestamp': True,
+            'note': note_prefix + dates + HOUR_NOTE_LABELS[hours]
+        }, copy=False)
+    
+    def get_hourly_frame(self, mac, hours_from, hours_to):
+        """Hourly readings of the last 48+ hours from the local history, filtered by hour of day, as a DataFrame"""
         print(f"Requesting hourly data for MAC {mac} from hour {hours_from} to {hours_to}")
         
         # Get device coordinates first
@@ -333,88 +2499,37 @@ class AirQualityAPI:
             # Get enough hours to ensure we have data for the requested time range
             hours_needed = max(48, hours_to - hours_from + 48)  # Get enough data with buffer
             
-            # Use the 24h endpoint that actually works
-            url = f"{self.base_url}/api/v1/data-intake-24h/{quote(mac)}/{hours_needed}"
-            print(f"Trying 24h endpoint: {url}")
+            # A no-op when the ingestion daemon (or another download) synced the device recently
+            self.refresh_history(mac)
             
-            response = requests.get(url, timeout=30)
-            print(f"24h endpoint response: Status {response.status_code}")
+            current_hour = HourlyAQIStore.current_hour()
+            hour_ts, aqi = self.history_store.read_arrays(mac, current_hour - (hours_needed - 1) * 3600, current_hour + 3600)
+            print(f"History has {len(hour_ts)} valid hourly values in the last {hours_needed} hours")
             
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    print(f"24h endpoint returned: {type(data)} with {len(data) if isinstance(data, list) else 'N/A'} items")
-                    
-                    if isinstance(data, list) and len(data) > 0:
-                        print(f"✅ SUCCESS! Found {len(data)} hourly values")
-                        
-                        # Count valid readings for debugging
-                        valid_readings = [x for x in data if x != -1]
-                        print(f"Valid readings: {len(valid_readings)} out of {len(data)}")
-                        
-                        # Process the hourly data array
-                        enhanced_data = []
-                        now = datetime.now()
-                        
-                        for i, aqi_value in enumerate(data):
-                            if aqi_value != -1:  # Only include valid readings
-                                # Calculate the timestamp (going backwards from now)
-                                hours_ago = len(data) - 1 - i
-                                timestamp = now - timedelta(hours=hours_ago)
-                                hour = timestamp.hour
-                                
-                                # Check if this hour is in our requested range
-                                if hours_from <= hour <= hours_to:
-                                    reading = {
-                                        'mac': mac,
-                                        'timestamp': timestamp.isoformat() + 'Z',
-                                        'date': timestamp.strftime('%Y-%m-%d'),
-                                        'time': timestamp.strftime('%H:%M:%S'),
-                                        'hour': hour,
-                                        'day_of_week': timestamp.strftime('%A'),
-                                        'aqi': aqi_value,
-                                        'calculatedAqi': aqi_value,
-                                        'aqi_level': self.get_aqi_level(aqi_value),
-                                        'measurement_type': 'hourly_aqi',
-                                        'data_source': '24h_endpoint_real',
-                                        'location': location,
-                                        'latitude': lat,
-                                        'longitude': lng,
-                                        'hours_ago': hours_ago,
-                                        'real_timestamp': True,
-                                        'note': f'Real hourly AQI reading from {timestamp.strftime("%Y-%m-%d %H:00")}'
-                                    }
-                                    enhanced_data.append(reading)
-                        
-                        if enhanced_data:
-                            # Sort by timestamp (oldest first)
-                            enhanced_data.sort(key=lambda x: x['timestamp'])
-                            print(f"Processed {len(enhanced_data)} valid readings for hours {hours_from}-{hours_to}")
-                            return enhanced_data
-                        else:
-                            print(f"No valid readings found for hours {hours_from}-{hours_to} in the last {hours_needed} hours")
-                            return []
-                            
-                except Exception as json_error:
-                    print(f"Error parsing 24h response: {json_error}")
-                    return []
-                    
-            elif response.status_code == 400:
-                print(f"Bad request (400): {response.text[:200]}")
-                return []
-            elif response.status_code == 404:
-                print("24h endpoint not found (404)")
-                return []
+            frame = self.build_hourly_frame(mac, hour_ts, aqi, location, lat, lng, 'hourly_aqi',
+                                            'Real hourly AQI reading from ', hours_from, hours_to, current_hour)
+            if len(frame):
+                print(f"Processed {len(frame)} valid readings for hours {hours_from}-{hours_to}")
             else:
-                print(f"Error {response.status_code}: {response.text[:100]}")
-                return []
-                
+                print(f"No valid readings found for hours {hours_from}-{hours_to} in the last {hours_needed} hours")
+            return frame
+        
         except Exception as e:
-            print(f"Exception with 24h endpoint: {e}")
-            return []
+            print(f"Error reading hourly history: {e}")
+            return pd.DataFrame(columns=HOURLY_COLUMNS)
     
-    def get_date_range_data(self, mac, start_date, end_date, start_hour=0, end_hour=23):
-        """Get data for specific date range using available endpoints"""
+    def get_hourly_data(self, mac, hours_from, hours_to):
+        """Get hourly readings of the last 48+ hours from the local history, filtered by hour of day"""
+        return self.get_hourly_frame(mac, hours_from, hours_to).to_dict('records')
+    
+    def iter_date_range_frames(self, mac, start_date, end_date, start_hour=0, end_hour=23,
+                               window_hours=EXPORT_WINDOW_HOURS):
+        """Readings for a date range from the local hourly history, one DataFrame per window of hours
+        
+        Only the hours newer than the device's last sync are fetched from
+        upstream, so ranges older than the 24h endpoint's window stay available.
+        The store is read window by window, so memory does not grow with the range.
+        """
         print(f"Requesting date range data from {start_date} to {end_date}, hours {start_hour}-{end_hour}")
         
         # Get device coordinates first
@@ -422,98 +2537,96 @@ class AirQualityAPI:
         location = self.get_location_from_coords(lat, lng)
         print(f"Device location: {location} ({lat}, {lng})")
         
+        start_ts = int(datetime.strptime(start_date, '%Y-%m-%d').timestamp())
+        end_ts = int((datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).timestamp())
+        
+        # Hours already synced don't change upstream, so only a range reaching past them needs a sync
+        last_hour, _ = self.history_store.sync_state(mac)
+        if last_hour is None or end_ts > last_hour:
+            self.refresh_history(mac)
+        
+        current_hour = HourlyAQIStore.current_hour()
+        for window_start in range(start_ts, end_ts, window_hours * 3600):
+            hour_ts, aqi = self.history_store.read_arrays(mac, window_start, min(end_ts, window_start + window_hours * 3600))
+            frame = self.build_hourly_frame(mac, hour_ts, aqi, location, lat, lng, 'historical_aqi',
+                                            'Historical AQI reading from ', start_hour, end_hour, current_hour)
+            if len(frame):
+                yield frame
+    
+    def get_date_range_frame(self, mac, start_date, end_date, start_hour=0, end_hour=23):
+        """Readings for a date range from the local hourly history, as a DataFrame"""
         try:
-            # Calculate how many hours we need to go back to cover the date range
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-            end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-            now = datetime.now()
-            
-            # Calculate hours from now to the start of our date range
-            time_diff = now - start_dt
-            hours_to_fetch = int(time_diff.total_seconds() / 3600) + 48  # Add buffer
-            
-            # Cap at reasonable limit
-            hours_to_fetch = min(hours_to_fetch, 168)  # Max 7 days
-            
-            print(f"Fetching {hours_to_fetch} hours of data to cover date range")
-            
-            # Use the 24h endpoint to get historical data
-            url = f"{self.base_url}/api/v1/data-intake-24h/{quote(mac)}/{hours_to_fetch}"
-            print(f"Trying 24h endpoint for date range: {url}")
-            
-            response = requests.get(url, timeout=30)
-            print(f"24h endpoint response: Status {response.status_code}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                print(f"Got {len(data)} hourly values")
-                
-                if isinstance(data, list) and len(data) > 0:
-                    enhanced_data = []
-                    
-                    for i, aqi_value in enumerate(data):
-                        if aqi_value != -1:  # Only process valid readings
-                            # Calculate the timestamp (going backwards from now)
-                            hours_ago = len(data) - 1 - i
-                            timestamp = now - timedelta(hours=hours_ago)
-                            
-                            # Check if this timestamp falls within our date range and hour range
-                            record_date = timestamp.strftime('%Y-%m-%d')
-                            record_hour = timestamp.hour
-                            
-                            if (start_date <= record_date <= end_date and 
-                                start_hour <= record_hour <= end_hour):
-                                
-                                reading = {
-                                    'mac': mac,
-                                    'timestamp': timestamp.isoformat() + 'Z',
-                                    'date': record_date,
-                                    'time': timestamp.strftime('%H:%M:%S'),
-                                    'hour': record_hour,
-                                    'day_of_week': timestamp.strftime('%A'),
-                                    'aqi': aqi_value,
-                                    'calculatedAqi': aqi_value,
-                                    'aqi_level': self.get_aqi_level(aqi_value),
-                                    'measurement_type': 'historical_aqi',
-                                    'data_source': '24h_endpoint_historical',
-                                    'location': location,
-                                    'latitude': lat,
-                                    'longitude': lng,
-                                    'hours_ago': hours_ago,
-                                    'real_timestamp': True,
-                                    'note': f'Historical AQI reading from {timestamp.strftime("%Y-%m-%d %H:00")}'
-                                }
-                                enhanced_data.append(reading)
-                    
-                    if enhanced_data:
-                        # Sort by timestamp (oldest first)
-                        enhanced_data.sort(key=lambda x: x['timestamp'])
-                        print(f"✅ Found {len(enhanced_data)} real historical readings for date range {start_date} to {end_date}")
-                        return enhanced_data
-                    else:
-                        print(f"No data found in the specified date range {start_date} to {end_date}")
-                        return []
-                else:
-                    print("No valid data in response")
-                    return []
-            else:
-                print(f"Error {response.status_code}: {response.text[:100]}")
-                return []
-                
+            frames = list(self.iter_date_range_frames(mac, start_date, end_date, start_hour, end_hour))
+            if frames:
+                frame = pd.concat(frames, ignore_index=True)
+                print(f"✅ Found {len(frame)} historical readings for date range {start_date} to {end_date}")
+                return frame
+            print(f"No data found in the specified date range {start_date} to {end_date}")
+            return pd.DataFrame(columns=HOURLY_COLUMNS)
+        
         except Exception as e:
             print(f"Error getting date range data: {e}")
-            return []
+            return pd.DataFrame(columns=HOURLY_COLUMNS)
+    
+    def get_date_range_data(self, mac, start_date, end_date, start_hour=0, end_hour=23):
+        """Get data for specific date range from the local hourly history"""
+        return self.get_date_range_frame(mac, start_date, end_date, start_hour, end_hour).to_dict('records')
+    
+    def history_version(self, mac):
+        """(newest stored hour, current hour) of a device's history, syncing it first if a sync is due"""
+        self.refresh_history(mac)
+        last_hour, _ = self.history_store.sync_state(mac)
+        return last_hour, HourlyAQIStore.current_hour()
+    
+    def refresh_history(self, mac):
+        """sync_history for reads: an unreachable upstream is logged and the store served as it is"""
+        try:
+            return self.sync_history(mac)
+        except Exception as e:
+            print(f"History sync for {mac} failed, serving stored history: {e}")
+            return 0
+    
+    def sync_history(self, mac, force=False):
+        """Fetch the hours missing from the local history of a device; returns the readings stored
+        
+        Skipped when the device was synced less than HISTORY_SYNC_MIN_INTERVAL
+        seconds ago, unless `force` is set.
+        """
+        last_hour, synced_at = self.history_store.sync_state(mac)
+        if not force and synced_at and time.time() - synced_at < HISTORY_SYNC_MIN_INTERVAL:
+            return 0
+        
+        hours_to_fetch = self.history_store.hours_to_fetch(mac)
+        url = f"{self.base_url}/api/v1/data-intake-24h/{quote(mac)}/{hours_to_fetch}"
+        print(f"Syncing {hours_to_fetch} hours of history: {url}")
+        
+        response = self.http.get(url, timeout=30)
+        if response.status_code != 200:
+            print(f"History sync for {mac} failed: HTTP {response.status_code}")
+            return 0
+        
+        data = response.json()
+        if not isinstance(data, list):
+            print(f"History sync for {mac}: unexpected response {type(data)}")
+            return 0
+        
+        # The device's current position places the current hour on the coverage map
+        try:
+            status_code, latest = self.fetch_latest_reading(mac)
+            location = reading_position(latest) if status_code == 200 else None
+        except Exception as e:
+            print(f"History sync for {mac}: no position ({e})")
+            location = None
+        return self.history_store.ingest(mac, data, location=location)
     
     def get_device_data(self, mac):
         """Get latest data for a specific device"""
         try:
-            url = f"{self.base_url}/api/v1/data-intake/{quote(mac)}"
-            print(f"Requesting latest data: {url}")
-            response = requests.get(url, timeout=10)
-            print(f"Latest data response: Status {response.status_code}")
+            print(f"Requesting latest data for {mac}")
+            status_code, data = self.fetch_latest_reading(mac)
+            print(f"Latest data response: Status {status_code}")
             
-            if response.status_code == 200:
-                data = response.json()
+            if status_code == 200:
                 print(f"Latest data received: {type(data)}")
                 
                 if isinstance(data, dict):
@@ -551,15 +2664,20 @@ class AirQualityAPI:
                 else:
                     return []
             else:
-                print(f"Error response: {response.text}")
+                print(f"Error response: HTTP {status_code}")
                 return []
         except Exception as e:
             print(f"Error fetching device data: {e}")
             return []
 
 # Initialize API client and MAC scanner
-api_client = AirQualityAPI(API_BASE_URL)
+geocode_cache = GeocodeCache()
+history_store = HourlyAQIStore()
+api_client = AirQualityAPI(API_BASE_URL, geocode_cache=geocode_cache, history_store=history_store)
 mac_scanner = ActiveMACExtractor(API_BASE_URL)
+probe_ledger = ProbeLedger()
+scan_status_store = ScanStatusStore()
+scan_jobs = ScanJobManager(scan_status_store)
 
 def flatten_nested_dict(d, parent_key='', sep='_'):
     """Recursively flatten nested dictionaries"""
@@ -575,78 +2693,715 @@ def flatten_nested_dict(d, parent_key='', sep='_'):
             items.append((new_key, v))
     return dict(items)
 
-def convert_to_csv(data):
-    """Convert JSON data to CSV format"""
-    if not data:
-        return None
+class QueryResultCache:
+    """Content-addressed LRU cache of whole query results (a DataFrame plus its summary stats).
     
-    # Ensure data is a list
-    if isinstance(data, dict):
-        data = [data]
-    elif not isinstance(data, list):
-        return None
+    Keys are digests from query_cache_key, which include how fresh the
+    upstream data is, so a result never needs expiring: new data means a new
+    key and the old entry ages out. The cache is bounded by the memory of the
+    cached frames rather than by their number. Concurrent loads of the same
+    key share one fetch; failures are raised to every waiter and not cached.
+    """
     
-    # If empty list
-    if len(data) == 0:
-        return None
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (size, value)
+        self._in_flight = {}  # key -> Future
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
     
-    try:
-        # Flatten nested objects for CSV
-        flattened_data = []
-        for item in data:
-            if isinstance(item, dict):
-                flattened_item = flatten_nested_dict(item)
-                flattened_data.append(flattened_item)
+    def get_or_load(self, key, loader):
+        """The cached (frame, stats) for a key, calling `loader()` to produce it on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
             else:
-                # Skip non-dict items
-                print(f"Skipping non-dict item: {type(item)}")
+                self.coalesced += 1
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        
+        size = int(value[0].memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            self._in_flight.pop(key, None)
+            # A result bigger than the whole budget is served but not kept
+            if size <= self.max_bytes:
+                self._entries[key] = (size, value)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (evicted_size, _) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_size
+                    self.evictions += 1
+        future.set_result(value)
+        return value
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions
+            }
+
+
+query_cache = QueryResultCache()
+
+
+def parse_data_query(form):
+    """Normalised (data_type, mac, params) of a download or preview form
+    
+    query_cache_key digests this tuple. Raises ValueError with a message for
+    the client if a field is missing or invalid.
+    """
+    mac = form.get('device_mac')
+    data_type = form.get('data_type')
+    
+    if not mac:
+        raise ValueError('Device MAC is required')
+    
+    if data_type == 'time_range' or data_type == 'date_range':
+        return 'date_range', mac, parse_date_range_form(form)
+    if data_type == 'hourly':
+        return 'hourly', mac, parse_hours_form(form)
+    if data_type == 'latest':
+        return 'latest', mac, ()
+    raise ValueError('Invalid data type')
+
+def query_cache_key(api, query):
+    """Digest of a query plus the freshness of the upstream data it reads
+    
+    History queries are versioned by the newest stored hour (after a sync, if
+    one is due) and the current hour, which their hours_ago column depends
+    on. The latest reading is versioned by its own timestamp, fetched through
+    the shared latest-reading cache.
+    """
+    data_type, mac, params = query
+    if data_type == 'latest':
+        status_code, data = api.fetch_latest_reading(mac)
+        version = [status_code, data.get('timestamp') if isinstance(data, dict) else None]
+    else:
+        version = list(api.history_version(mac))
+    
+    payload = json.dumps([data_type, mac, list(params), version], default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def cached_query_result(api, query):
+    """(query key, frame, stats) of a query, loaded once per version of its upstream data"""
+    key = query_cache_key(api, query)
+    
+    def load():
+        frame = load_query_frame(api, query)
+        return frame, summarize_frame(frame)
+    
+    frame, stats = query_cache.get_or_load(key, load)
+    return key, frame, stats
+
+def load_query_frame(api, query):
+    """The whole result of a query as one DataFrame (empty if there is no data)"""
+    data_type, mac, params = query
+    if data_type == 'date_range':
+        return api.get_date_range_frame(mac, *params)
+    if data_type == 'hourly':
+        return api.get_hourly_frame(mac, *params)
+    
+    # The upstream payload defines the columns here; flatten nested objects into them
+    data = api.get_device_data(mac)
+    return pd.DataFrame([flatten_nested_dict(item) for item in data if isinstance(item, dict)])
+
+def date_range_hours(start_date, end_date):
+    """Number of hours covered by an inclusive YYYY-MM-DD date range"""
+    days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+    return max(0, days) * 24
+
+def query_filename(query):
+    """Download filename (without extension) for a query"""
+    data_type, mac, params = query
+    if data_type == 'date_range':
+        return f"date_range_data_{mac}_{params[0]}_to_{params[1]}"
+    if data_type == 'hourly':
+        return f"hourly_data_{mac}_{params[0]}h_to_{params[1]}h"
+    return f"latest_data_{mac}"
+
+def no_data_message(query):
+    """Client-facing error for a query that returned no rows"""
+    data_type, _, params = query
+    if data_type == 'date_range':
+        return f'No data found for dates {params[0]} to {params[1]}. Try different dates.'
+    if data_type == 'hourly':
+        return f'No data found for hours {params[0]} to {params[1]}. Try a different time range.'
+    return 'No latest data found'
+
+def summarize_frame(frame):
+    """Row count, AQI min/max/mean and a per-level histogram of a query result"""
+    stats = {'count': len(frame), 'aqi': None, 'levels': {}}
+    
+    column = next((name for name in ('aqi', 'calculatedAqi', 'dustAqi', 'iaq') if name in frame.columns), None)
+    if column is not None:
+        values = pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values):
+            stats['aqi'] = {
+                'column': column,
+                'min': float(values.min()),
+                'max': float(values.max()),
+                'mean': round(float(values.mean()), 1)
+            }
+    
+    if 'aqi_level' in frame.columns:
+        counts = frame['aqi_level'].value_counts()
+        stats['levels'] = {level: 0 for level in AQI_LEVELS}
+        stats['levels'].update({level: int(count) for level, count in counts.items()})
+    return stats
+
+def frame_records(frame):
+    """JSON-safe row dicts of a frame (missing values become null)"""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+def stream_csv(frames, columns, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield a CSV document chunk by chunk from an iterable of DataFrames
+    
+    Every frame is written with exactly `columns` in that order (missing
+    ones are left empty), so the schema doesn't depend on which rows came
+    first. Values are written as they are; nothing is re-parsed.
+    """
+    header = io.StringIO()
+    # Same line terminator as DataFrame.to_csv, so the file doesn't mix endings
+    csv.writer(header, lineterminator='\n').writerow(columns)
+    yield header.getvalue()
+    
+    for frame in frames:
+        frame = frame.reindex(columns=columns)
+        for offset in range(0, len(frame), chunk_rows):
+            yield frame.iloc[offset:offset + chunk_rows].to_csv(index=False, header=False)
+
+class ByteSink(io.RawIOBase):
+    """Write-only file that keeps what was written until it is drained
+    
+    Unlike BytesIO its contents outlive close(), which Arrow streams call
+    on their sink when they finish.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def compress_stream(chunks, codec):
+    """Compress an iterable of text chunks, yielding bytes as the codec emits them"""
+    sink = ByteSink()
+    with pa.CompressedOutputStream(sink, codec) as stream:
+        for chunk in chunks:
+            stream.write(chunk.encode('utf-8'))
+            if sink.chunks:
+                yield sink.drain()
+    yield sink.drain()
+
+def arrow_table(frames, columns):
+    """Collect frames into one Arrow table with `columns`, dictionary-encoding the label columns"""
+    frame = pd.concat([frame.reindex(columns=columns) for frame in frames], ignore_index=True)
+    table = pa.Table.from_pandas(frame, preserve_index=False).combine_chunks()
+    
+    for name in EXPORT_DICTIONARY_COLUMNS:
+        if name in table.column_names:
+            index = table.schema.get_field_index(name)
+            table = table.set_column(index, name, table.column(index).dictionary_encode())
+    return table
+
+def export_body(frames, columns, export_format='csv', metadata=None):
+    """Encode frames in `export_format`: an iterator of chunks for CSV, bytes for columnar formats
+    
+    `metadata` (a dict of strings) is added to the schema of columnar formats;
+    CSV has nowhere to carry it.
+    """
+    if export_format == 'csv':
+        return stream_csv(frames, columns)
+    if export_format in EXPORT_CSV_CODECS:
+        return compress_stream(stream_csv(frames, columns), EXPORT_CSV_CODECS[export_format])
+    
+    table = arrow_table(frames, columns)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    sink = pa.BufferOutputStream()
+    if export_format == 'parquet':
+        pq.write_table(table, sink, compression='zstd')
+    else:
+        feather.write_feather(table, sink)
+    return sink.getvalue().to_pybytes()
+
+def export_bytes(frames, columns, export_format='csv'):
+    """Encode frames in `export_format` as a single bytes object"""
+    body = export_body(frames, columns, export_format)
+    if isinstance(body, bytes):
+        return body
+    return b''.join(chunk.encode('utf-8') if isinstance(chunk, str) else chunk for chunk in body)
+
+def export_response(frames, columns, filename, export_format='csv', headers=None, metadata=None):
+    """Send frames to the client as an attachment in `export_format`
+    
+    `filename` has no extension; the format's own is appended.
+    """
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    headers = dict(headers or {})
+    headers['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return Response(export_body(frames, columns, export_format, metadata), mimetype=mimetype, headers=headers)
+
+def parse_export_format(value):
+    """Normalise a requested download format, or None if it isn't supported"""
+    export_format = (value or 'csv').strip().lower()
+    export_format = EXPORT_FORMAT_ALIASES.get(export_format, export_format)
+    return export_format if export_format in EXPORT_FORMATS else None
+
+def parse_date_range_form(form):
+    """(start_date, end_date, start_hour, end_hour) from a download form
+    
+    Raises ValueError with a message for the client if a field is missing or invalid.
+    """
+    start_date = form.get('start_date')
+    end_date = form.get('end_date')
+    
+    if not start_date or not end_date:
+        raise ValueError('Start date and end date are required')
+    
+    try:
+        # Validate date format
+        datetime.strptime(start_date, '%Y-%m-%d')
+        datetime.strptime(end_date, '%Y-%m-%d')
+        start_hour = int(form.get('start_hour', '0'))
+        end_hour = int(form.get('end_hour', '23'))
+    except ValueError:
+        raise ValueError('Invalid date format. Use YYYY-MM-DD')
+    
+    if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
+        raise ValueError('Hours must be between 0 and 23')
+    
+    return start_date, end_date, start_hour, end_hour
+
+def parse_hours_form(form):
+    """(hours_from, hours_to) from a download form; raises ValueError like parse_date_range_form"""
+    hours_from = form.get('hours_from')
+    hours_to = form.get('hours_to')
+    
+    if not hours_from or not hours_to:
+        raise ValueError('Hours from and to are required')
+    
+    try:
+        hours_from = int(hours_from)
+        hours_to = int(hours_to)
+    except ValueError:
+        raise ValueError('Hours must be integers')
+    
+    if hours_from < 0 or hours_from > 23 or hours_to < 0 or hours_to > 23:
+        raise ValueError('Hours must be between 0 and 23')
+    
+    if hours_from >= hours_to:
+        raise ValueError('Start hour must be less than end hour')
+    
+    return hours_from, hours_to
+
+def parse_bulk_macs(form, saved_devices):
+    """MACs requested for a bulk export, deduplicated in request order
+    
+    `device_macs` may be repeated or comma-separated; `all_devices` selects
+    every saved device instead.
+    """
+    if form.get('all_devices', '').lower() in ('1', 'true', 'yes', 'on'):
+        requested = [device.get('mac', '') for device in saved_devices]
+    else:
+        requested = [mac for value in form.getlist('device_macs') for mac in value.split(',')]
+    
+    macs = []
+    seen = set()
+    for mac in requested:
+        mac = mac.strip()
+        if mac and mac.upper() not in seen:
+            seen.add(mac.upper())
+            macs.append(mac)
+    return macs
+
+def iter_bulk_frames(api, macs, start_date, end_date, start_hour=0, end_hour=23, workers=BULK_EXPORT_WORKERS):
+    """Fetch the date range of several devices concurrently
+    
+    Yields (mac, frame, manifest_entry) in the order of `macs`; frame is None
+    when the device had no readings or failed, and the entry says which.
+    """
+    def fetch(mac):
+        frames = list(api.iter_date_range_frames(mac, start_date, end_date, start_hour, end_hour))
+        return pd.concat(frames, ignore_index=True) if frames else None
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(macs))), thread_name_prefix='bulk-export')
+    try:
+        futures = [executor.submit(fetch, mac) for mac in macs]
+        for mac, future in zip(macs, futures):
+            try:
+                frame = future.result()
+            except Exception as e:
+                print(f"Bulk export of {mac} failed: {e}")
+                yield mac, None, {'mac': mac, 'status': 'error', 'rows': 0, 'error': str(e)}
                 continue
+            
+            if frame is None:
+                yield mac, None, {'mac': mac, 'status': 'empty', 'rows': 0}
+            else:
+                yield mac, frame, {'mac': mac, 'status': 'ok', 'rows': len(frame)}
+    finally:
+        # A client that disconnects mid-stream shouldn't leave queued fetches running
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def bulk_manifest_header(manifest, full_manifest, max_bytes=BULK_MANIFEST_HEADER_MAX_BYTES):
+    """Summary of a bulk export's manifest for the X-Export-Manifest header
+    
+    Successful devices are only counted; empty and failed ones are listed
+    while the header stays within `max_bytes`, and counted beyond that.
+    `full_manifest` tells the client where the complete one can be found.
+    """
+    entries = manifest['devices']
+    summary = {
+        'devices': len(entries),
+        'ok': sum(1 for entry in entries if entry['status'] == 'ok'),
+        'rows': sum(entry['rows'] for entry in entries),
+        'empty': [entry['mac'] for entry in entries if entry['status'] == 'empty'],
+        'failed': {entry['mac']: entry['error'] for entry in entries if entry['status'] == 'error'},
+        'full_manifest': full_manifest
+    }
+    header = json.dumps(summary, separators=(',', ':'))
+    if len(header) <= max_bytes:
+        return header
+    summary.update(empty=len(summary['empty']), failed=len(summary['failed']), truncated=True)
+    return json.dumps(summary, separators=(',', ':'))
+
+def stream_bulk_zip(results, export_format, manifest):
+    """Stream a zip with one file per device, then manifest.json with the per-device entries"""
+    extension = EXPORT_FORMATS[export_format][0]
+    # Only plain CSV gains from deflate; the other formats are compressed already
+    compression = zipfile.ZIP_DEFLATED if export_format == 'csv' else zipfile.ZIP_STORED
+    sink = ByteSink()
+    
+    with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+        for mac, frame, entry in results:
+            manifest['devices'].append(entry)
+            if frame is not None:
+                entry['file'] = f"{mac.replace(':', '-')}.{extension}"
+                archive.writestr(entry['file'], export_bytes([frame], HOURLY_COLUMNS, export_format))
+                yield sink.drain()
+        
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    yield sink.drain()
+
+def known_active_macs():
+    """MACs of saved devices plus active MACs from the last scan results"""
+    macs = {device['mac'].upper() for device in api_client.get_saved_devices() if device.get('mac')}
+    try:
+        if os.path.exists('mac_scan_results.json'):
+            for entry in load_mac_scan_data('mac_scan_results.json'):
+                if entry.get('mac') and entry.get('status', 'active') == 'active':
+                    macs.add(entry['mac'].upper())
+    except ValueError as e:
+        print(f"Error loading scan results for seeding: {e}")
+    return sorted(macs)
+
+
+class IngestionScheduler:
+    """Keeps the local hourly history of every saved device current.
+    
+    Every `interval` seconds each target MAC's missing tail is fetched with
+    at most `concurrency` requests in flight. Per-device lag is read back
+    from the store's sync state, so metrics are correct in any process, not
+    only the one running the scheduler.
+    """
+
+    def __init__(self, api, store, interval=INGEST_INTERVAL, concurrency=INGEST_CONCURRENCY,
+                 include_scanned=INGEST_INCLUDE_SCANNED):
+        self.api = api
+        self.store = store
+        self.interval = interval
+        self.concurrency = concurrency
+        self.include_scanned = include_scanned
+        self._stop = threading.Event()
+        self._thread = None
+        self._cycle_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+    
+    def targets(self):
+        """Saved devices, plus active MACs from the last scan when include_scanned is set"""
+        if self.include_scanned:
+            return known_active_macs()
+        return sorted({device['mac'].upper() for device in self.api.get_saved_devices() if device.get('mac')})
+    
+    def run_once(self):
+        """Sync every target once; returns the run summary (skipped if a cycle is already running)"""
+        if not self._cycle_lock.acquire(blocking=False):
+            return None
+        try:
+            started_at = time.time()
+            macs = self.targets()
+            readings = 0
+            errors = {}
+            
+            with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(macs)))) as executor:
+                futures = {executor.submit(self.api.sync_history, mac, True): mac for mac in macs}
+                for future in as_completed(futures):
+                    try:
+                        readings += future.result()
+                    except Exception as e:
+                        errors[futures[future]] = str(e)
+            
+            self.store.record_ingest_run(started_at, time.time(), len(macs), readings, errors)
+            print(f"Ingestion cycle: {len(macs)} devices, {readings} readings, {len(errors)} errors "
+                  f"in {time.time() - started_at:.1f} s")
+            return self.store.last_ingest_run()
+        finally:
+            self._cycle_lock.release()
+    
+    def run_forever(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Ingestion cycle failed: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+    
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run_forever, name='ingestion', daemon=True)
+                self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def metrics(self):
+        """Ingestion lag per device and the summary of the last cycle"""
+        current_hour = HourlyAQIStore.current_hour()
+        now = time.time()
+        devices = []
+        for mac in self.targets():
+            last_hour, synced_at = self.store.sync_state(mac)
+            devices.append({
+                'mac': mac,
+                'last_hour': datetime.fromtimestamp(last_hour).isoformat() if last_hour else None,
+                'lag_hours': (current_hour - last_hour) // 3600 if last_hour else None,
+                'seconds_since_sync': round(now - synced_at, 1) if synced_at else None
+            })
+        
+        lags = [device['seconds_since_sync'] for device in devices if device['seconds_since_sync'] is not None]
+        return {
+            'interval': self.interval,
+            'concurrency': self.concurrency,
+            'include_scanned': self.include_scanned,
+            'running_here': self._thread is not None and self._thread.is_alive(),
+            'devices_tracked': len(devices),
+            'devices_never_synced': sum(1 for device in devices if device['last_hour'] is None),
+            'max_seconds_since_sync': max(lags) if lags else None,
+            'mean_seconds_since_sync': round(sum(lags) / len(lags), 1) if lags else None,
+            'last_run': self.store.last_ingest_run(),
+            'devices': devices
+        }
+
+
+ingestion_scheduler = IngestionScheduler(api_client, history_store)
+
+
+@app.before_request
+def start_ingestion_in_web():
+    """With INGEST_IN_WEB, a serving process runs the scheduler, started by its first request
+    
+    Never at import: scan shard processes import this module too, and each
+    would run its own ingestion cycles against the upstream.
+    """
+    if INGEST_IN_WEB:
+        ingestion_scheduler.start()
+
+
+def scan_macs_background(job, base_mac, range_size, engine='threads', concurrency=None,
+                         resume=False, recent_policy='skip', skip_recent_hours=LEDGER_SKIP_RECENT_HOURS,
+                         mode='range', shards=None):
+    """Background function to scan MACs, reporting progress to `job`
+    
+    mode='range' sweeps the square of octet pairs around base_mac;
+    mode='nearby' probes outward from every known-active MAC instead.
+    """
+    try:
+        ledger_key = base_mac if mode == 'range' else 'NEARBY'
+        scan_id, resumed = probe_ledger.start_scan(ledger_key, range_size, engine, resume=resume)
         
-        if not flattened_data:
-            return None
+        # MACs already probed by the scan being resumed are not probed again;
+        # MACs that answered 404 recently are skipped or left for last
+        already_probed = probe_ledger.probed_in_scan(scan_id) if resumed else set()
+        previous_results = probe_ledger.active_results(scan_id) if resumed else []
         
-        # Create DataFrame
-        df = pd.DataFrame(flattened_data)
+        prefix = mac_scanner.mac_range_bounds(base_mac, range_size)[0] if mode == 'range' else ''
+        recent_dead = set()
+        if recent_policy != 'probe':
+            recent_dead = probe_ledger.recently_not_found(prefix, skip_recent_hours) - already_probed
         
-        # Handle datetime columns
-        for col in df.columns:
-            if 'timestamp' in col.lower() or 'time' in col.lower():
-                try:
-                    df[col] = pd.to_datetime(df[col], errors='ignore')
-                except:
-                    pass
+        skip = already_probed | recent_dead if recent_policy == 'skip' else already_probed
+        defer = recent_dead if recent_policy == 'defer' else set()
         
-        return df.to_csv(index=False)
-    
-    except Exception as e:
-        print(f"Error converting to CSV: {e}")
-        return None
-
-def scan_macs_background(base_mac, range_size):
-    """Background function to scan MACs"""
-    try:
-        results = mac_scanner.scan_mac_range(base_mac, range_size)
+        frontier = None
+        if mode == 'nearby':
+            # Deferring is meaningless for a priority search, so recent 404s are always excluded
+            frontier = PrioritizedMACFrontier(known_active_macs(), exclude=already_probed | recent_dead)
+            candidates = frontier
+            total = frontier.planned
+        elif engine == 'processes':
+            candidates, total = None, None
+        else:
+            total = sum(1 for mac in mac_scanner.iter_mac_range(base_mac, range_size) if mac.upper() not in skip)
+            candidates = plan_scan_candidates(mac_scanner.iter_mac_range(base_mac, range_size), skip, defer)
+        
+        job.update(scan_id=scan_id, mode=mode, resumed=resumed, skipped=len(skip), stop_reason=None)
+        
+        def record_probe(result, completed, total):
+            probe_ledger.record(scan_id, result)
+            if frontier is not None:
+                frontier.observe(result)
+                job.update(stop_reason=frontier.stop_reason, total=max(frontier.planned, completed))
+        
+        try:
+            if job.cancelled:
+                new_results = []
+            elif engine == 'processes':
+                # Shards are planned from the octet bounds, so deferred MACs are simply probed
+                new_results = mac_scanner.scan_range_sharded(base_mac, range_size, skip=skip, callback=record_probe,
+                                                             shards=shards, concurrency=concurrency, job=job)
+            else:
+                new_results = mac_scanner.scan_candidates(candidates, total, callback=record_probe,
+                                                          engine=engine, concurrency=concurrency, job=job)
+        finally:
+            probe_ledger.flush()
+        if not job.cancelled:
+            # A cancelled scan stays open in the ledger so it can be resumed later
+            probe_ledger.finish_scan(scan_id)
+        
+        # Merge with active MACs found before the scan was interrupted
+        merged = {result['mac'].upper(): result for result in previous_results}
+        merged.update({result['mac'].upper(): result for result in new_results})
+        results = list(merged.values())
+        tag_device_types(results)
         print(f"Background scan completed: {len(results)} active MACs found")
         
-        # Save results to file
+        # Merge into the shared results file; other jobs' results stay
         scan_data = {
             'scan_timestamp': datetime.now().isoformat(),
+            'scan_id': scan_id,
+            'mode': mode,
             'base_mac': base_mac,
             'range_size': range_size,
+            'engine': engine,
+            'resumed': resumed,
+            'cancelled': job.cancelled,
+            'skipped': len(skip),
+            'probes': job.get('progress'),
             'total_active': len(results),
             'results': results
         }
+        merge_scan_results(scan_data, probe_ledger.probed_in_scan(scan_id, statuses=LEDGER_ABSENT_STATUSES))
         
-        with open('mac_scan_results.json', 'w') as f:
-            json.dump(scan_data, f, indent=2)
+        job.finish(results=results, active_found=len(results))
             
     except Exception as e:
         print(f"Error in background scan: {e}")
-        global scanning_status
-        scanning_status['in_progress'] = False
+        job.finish(state='failed', error=str(e))
+
+_scan_results_lock = threading.Lock()
+
+@contextlib.contextmanager
+def scan_results_file_lock(path):
+    """Hold the in-process lock and, where supported, an OS lock on `path`.lock"""
+    with _scan_results_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def merge_scan_results(scan_data, absent_macs, path='mac_scan_results.json'):
+    """Merge one job's scan_data into the shared results file; returns the merged results
+    
+    Results of other jobs (other prefixes, earlier or concurrent scans) are
+    kept, except `absent_macs`, the MACs this job found gone; a probe that
+    failed or timed out leaves the MAC's entry alone. MACs it found active
+    replace their previous entries. The file is rewritten through a temporary
+    file and os.replace under scan_results_file_lock, so concurrent jobs and
+    readers never see a partial or lost write.
+    """
+    absent_macs = {mac.upper() for mac in absent_macs}
+    with scan_results_file_lock(path):
+        try:
+            existing = load_mac_scan_data(path) if os.path.exists(path) else []
+        except ValueError as e:
+            print(f"Replacing unreadable scan results: {e}")
+            existing = []
+        
+        merged = {
+            entry['mac'].upper(): entry
+            for entry in existing
+            if isinstance(entry, dict) and entry.get('mac') and entry['mac'].upper() not in absent_macs
+        }
+        merged.update({result['mac'].upper(): result for result in scan_data['results']})
+        results = list(merged.values())
+        
+        payload = dict(scan_data, total_active=len(results), results=results)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(payload, f, indent=2)
+        os.replace(temp_path, path)
+    return results
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """Element-wise great-circle distances in metres between arrays of points"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
 
 def haversine_distance(lat1, lon1, lat2, lon2):
-    R = 6371e3  # Earth radius in meters
+    R = EARTH_RADIUS_M  # Earth radius in meters
     phi1, phi2 = math.radians(lat1), math.radians(lat2)
     dphi = math.radians(lat2 - lat1)
     dlambda = math.radians(lon2 - lon1)
@@ -654,50 +3409,124 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     a = math.sin(dphi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda/2)**2
     return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
-def compute_movement_by_mac(data):
-    from collections import defaultdict
-
-    mac_locations = defaultdict(list)
-
-    # Group and collect by MAC
-    for entry in data:
-        mac = entry.get("mac")
-        location = entry.get("location")
-        timestamp = entry.get("last_update") or entry.get("timestamp")
+def window_extents(values, starts, ends):
+    """(min, max) of values[starts[i]:ends[i]] for every window, from a sparse table
+    
+    Windows must be non-empty. Level k of the table holds the extremes of the
+    2**k values starting at each position, so a window is covered by two
+    overlapping blocks of its largest power-of-two length; only one level is
+    held at a time.
+    """
+    levels = np.frexp((ends - starts).astype(float))[1] - 1
+    lows, highs = np.empty(len(starts)), np.empty(len(starts))
+    low = high = np.asarray(values, dtype=float)
+    for k in range(int(levels.max(initial=0)) + 1):
+        if k:
+            half = 1 << (k - 1)
+            low = np.minimum(low[:-half], low[half:])
+            high = np.maximum(high[:-half], high[half:])
+        at = np.flatnonzero(levels == k)
+        tail = ends[at] - (1 << k)
+        lows[at] = np.minimum(low[starts[at]], low[tail])
+        highs[at] = np.maximum(high[starts[at]], high[tail])
+    return lows, highs
 
-        if mac and location and timestamp:
-            try:
-                dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-                lat = location.get("lat")
-                lng = location.get("lng")
-                if lat is not None and lng is not None:
-                    mac_locations[mac].append((dt, lat, lng))
-            except Exception:
-                continue
+def classify_mobility(macs, timestamps, lats, lngs, window_hours=MOBILITY_WINDOW_HOURS,
+                      min_distance_m=MOBILITY_MIN_DISTANCE_M, pair_batch=1_000_000):
+    """'mobile' or 'static' for every MAC of a set of sightings
+    
+    A MAC is mobile when two of its sightings taken at most `window_hours`
+    apart lie more than `min_distance_m` apart. Sightings are sorted by MAC
+    and time once, and each opens a window reaching `window_hours` ahead.
+    The window's bounding box in local metres settles most windows outright
+    (a side longer than the threshold is mobile, a diagonal shorter than it
+    static); for the rest, haversine distances from the window's first
+    sighting to the others are computed in batches of `pair_batch` pairs.
+    `timestamps` are epoch seconds.
+    """
+    times = np.asarray(timestamps, dtype=float)
+    lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+    keep = np.isfinite(times) & np.isfinite(lats) & np.isfinite(lngs)
+    codes, names = pd.factorize(np.asarray(macs, dtype=object)[keep])
+    if not len(names):
+        return {}
+    order = np.lexsort((times[keep], codes))
+    codes, times, lats, lngs = codes[order], times[keep][order], lats[keep][order], lngs[keep][order]
+    
+    # Equirectangular metres around each MAC's mean latitude; the 1% margin on
+    # box decisions covers the projection error over a city-sized track
+    mean_lat = np.bincount(codes, weights=lats) / np.bincount(codes)
+    x = np.radians(lngs) * EARTH_RADIUS_M * np.cos(np.radians(mean_lat))[codes]
+    y = np.radians(lats) * EARTH_RADIUS_M
+    
+    # Shifting every MAC's times past the previous MAC's last sighting plus a
+    # window keeps each window within one MAC
+    window = window_hours * 3600
+    first = np.flatnonzero(np.r_[True, np.diff(codes) != 0])
+    last = np.r_[first[1:], len(codes)] - 1
+    shift = np.r_[0, np.cumsum(times[last] - times[first] + window + 1)[:-1]] - times[first]
+    key = times + shift[codes]
+    starts = np.arange(len(key))
+    ends = np.searchsorted(key, key + window, side='right')
+    
+    x_low, x_high = window_extents(x, starts, ends)
+    y_low, y_high = window_extents(y, starts, ends)
+    width, height = x_high - x_low, y_high - y_low
+    mobile = np.maximum(width, height) > min_distance_m * 1.01
+    unsure = np.flatnonzero(~mobile & (np.hypot(width, height) > min_distance_m * 0.99))
+    
+    pairs = ends[unsure] - unsure - 1
+    total = np.cumsum(pairs)
+    done = 0
+    while done < len(unsure):
+        before = total[done - 1] if done else 0
+        stop = max(int(np.searchsorted(total, before + pair_batch, side='right')), done + 1)
+        counts = pairs[done:stop]
+        origin = np.repeat(unsure[done:stop], counts)
+        other = origin + 1 + np.arange(len(origin)) - np.repeat(np.cumsum(counts) - counts, counts)
+        far = haversine_distances(lats[origin], lngs[origin], lats[other], lngs[other]) > min_distance_m
+        mobile[origin[far]] = True
+        done = stop
+    
+    is_mobile = np.zeros(len(names), dtype=bool)
+    is_mobile[codes[mobile]] = True
+    return {mac: 'mobile' if moving else 'static' for mac, moving in zip(names, is_mobile)}
 
-    # Determine mobility
-    result = {}
-    for mac, points in mac_locations.items():
-        # Sort points by time
-        points.sort(key=lambda x: x[0])
-        is_mobile = False
-
-        for i in range(len(points)):
-            t1, lat1, lon1 = points[i]
-            for j in range(i+1, len(points)):
-                t2, lat2, lon2 = points[j]
-                time_diff = abs((t2 - t1).total_seconds()) / 3600.0  # hours
-                if time_diff > 6:
-                    break  # Only compare within 6h
-                dist = haversine(lat1, lon1, lat2, lon2)
-                if dist > 100:
-                    is_mobile = True
-                    break
-            if is_mobile:
-                break
+def compute_movement_by_mac(data, ledger=None, store=None):
+    """'mobile' or 'static' for every MAC among scan entries (keyed upper-case), by classify_mobility
+    
+    A MAC's track is its entries' own located readings plus, over the last
+    MOBILITY_LOOKBACK_DAYS, its probe-ledger sightings and the positions in
+    its synced hourly history, so results saved before the ledger recorded
+    sightings are still classified. MACs without any position are static.
+    """
+    ledger = ledger or probe_ledger
+    store = store or history_store
+    macs = {entry['mac'].upper() for entry in data if entry.get('mac')}
+    if not macs:
+        return {}
+    
+    since = time.time() - MOBILITY_LOOKBACK_DAYS * 86400
+    tracks = [ledger.sightings(macs, since=since), store.positions(macs, since=since)]
+    own = [sighting for sighting in map(scan_sighting, data) if sighting]
+    if own:
+        own_macs, times, lats, lngs = zip(*own)
+        tracks.append((np.array([mac.upper() for mac in own_macs], dtype=object), np.array(times),
+                       np.array(lats), np.array(lngs)))
+    
+    device_types = classify_mobility(*(np.concatenate(part) for part in zip(*tracks)))
+    return {mac: device_types.get(mac, 'static') for mac in macs}
 
-        result[mac] = "mobile" if is_mobile else "static"
-    return result
+def tag_device_types(results, ledger=None, store=None):
+    """Set device_type on scan results by compute_movement_by_mac
+    
+    Done as results are saved, so /api/mobile_suggestions can read the type
+    straight from them.
+    """
+    device_types = compute_movement_by_mac(results, ledger, store)
+    for result in results:
+        result['device_type'] = device_types.get(result['mac'].upper(), 'static')
+    return device_types
 
 def load_mac_scan_data(filepath):
     """Load and normalize MAC scan result data from JSON file."""
@@ -722,112 +3551,304 @@ def load_mac_scan_data(filepath):
         raise ValueError(f"Failed to parse MAC scan JSON: {e}")
 
 
-def assign_grid_cell(lat, lon, step=0.009):
-    return (round(lat - (lat % step), 3), round(lon - (lon % step), 3))
 
+class SpatialGrid:
+    """Square map cells of `step` degrees covering a bounding box.
+    
+    Cells are addressed by integer (row, col), counted from the south-west
+    corner, or by their flat index row * cols + col. Points are assigned in
+    bulk with array arithmetic, and cell sets (coverage, uncovered cells) are
+    boolean bitmaps of length `size`, so set operations are single NumPy
+    expressions. Cell edges are integer multiples of the step and don't
+    drift the way repeatedly adding a float step does. The GeoJSON features
+    are built on first use and reused.
+    """
+    
+    def __init__(self, min_lat, max_lat, min_lon, max_lon, step):
+        self.min_lat = min_lat
+        self.min_lon = min_lon
+        self.step = step
+        # The epsilon absorbs float error when the span is a whole number of steps
+        self.rows = max(0, math.ceil((max_lat - min_lat) / step - 1e-9))
+        self.cols = max(0, math.ceil((max_lon - min_lon) / step - 1e-9))
+        self.lat_edges = np.round(min_lat + np.arange(self.rows + 1) * step, 6)
+        self.lon_edges = np.round(min_lon + np.arange(self.cols + 1) * step, 6)
+        self._features = None
+        self._lock = threading.Lock()
+    
+    @property
+    def size(self):
+        return self.rows * self.cols
+    
+    def cell_index(self, lat, lon):
+        """Index of the cell containing a point, or None if it lies outside the grid"""
+        index = int(self.cell_indices([lat], [lon])[0])
+        return index if index >= 0 else None
+    
+    def cell_indices(self, lats, lons):
+        """Cell index of every point at once; -1 for points outside the grid (or NaN)"""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        with np.errstate(invalid='ignore'):
+            # The epsilon keeps a point on a cell edge in that cell despite float error
+            rows = np.floor((lats - self.min_lat) / self.step + 1e-9)
+            cols = np.floor((lons - self.min_lon) / self.step + 1e-9)
+            inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return np.where(inside, rows * self.cols + cols, -1).astype(np.int64)
+    
+    def row_col(self, indices):
+        """(rows, cols) arrays of flat cell indices"""
+        return np.divmod(np.asarray(indices, dtype=np.int64), self.cols)
+    
+    def bitmap(self, indices=()):
+        """Boolean cell set with the given indices (negative ones are ignored) set"""
+        cells = np.zeros(self.size, dtype=bool)
+        indices = np.asarray(indices, dtype=np.int64)
+        cells[indices[indices >= 0]] = True
+        return cells
+    
+    def coverage(self, lats, lons):
+        """Bitmap of the cells containing at least one of the points"""
+        return self.bitmap(self.cell_indices(lats, lons))
+    
+    def cell_origin(self, index):
+        """(lat, lon) of the south-west corner of a cell"""
+        row, col = divmod(int(index), self.cols)
+        return float(self.lat_edges[row]), float(self.lon_edges[col])
+    
+    def cell_centers(self, indices):
+        """(lats, lons) of the centres of the given cells"""
+        rows, cols = self.row_col(indices)
+        return (self.lat_edges[rows] + self.lat_edges[rows + 1]) / 2, (self.lon_edges[cols] + self.lon_edges[cols + 1]) / 2
+    
+    def features(self):
+        """GeoJSON Feature of every cell, in index order"""
+        with self._lock:
+            if self._features is None:
+                lat_edges = self.lat_edges.tolist()
+                lon_edges = self.lon_edges.tolist()
+                self._features = [
+                    {
+                        "type": "Feature",
+                        "geometry": {
+                            "type": "Polygon",
+                            "coordinates": [[
+                                [lon_edges[col], lat_edges[row]],
+                                [lon_edges[col + 1], lat_edges[row]],
+                                [lon_edges[col + 1], lat_edges[row + 1]],
+                                [lon_edges[col], lat_edges[row + 1]],
+                                [lon_edges[col], lat_edges[row]]
+                            ]]
+                        },
+                        "properties": {
+                            "cell": f"{round(lat_edges[row], 3)},{round(lon_edges[col], 3)}",
+                            "index": row * self.cols + col,
+                            "row": row,
+                            "col": col
+                        }
+                    }
+                    for row in range(self.rows)
+                    for col in range(self.cols)
+                ]
+            return self._features
+    
+    def feature_collection(self, cells=None):
+        """FeatureCollection of a bitmap or list of cell indices (all cells by default)"""
+        features = self.features()
+        if cells is not None:
+            cells = np.asarray(cells)
+            indices = np.flatnonzero(cells) if cells.dtype == bool else cells
+            features = [features[index] for index in indices.tolist()]
+        return {"type": "FeatureCollection", "features": features}
+
+
+@functools.lru_cache(maxsize=SPATIAL_GRID_CACHE_SIZE)
+def spatial_grid(bbox, step):
+    """The shared SpatialGrid for a (min_lat, max_lat, min_lon, max_lon) box and step"""
+    return SpatialGrid(*bbox, step)
 
+def map_grid():
+    """The configured grid behind the map layers"""
+    return spatial_grid(MAP_GRID_BBOX, MAP_GRID_STEP)
 
 def generate_full_grid(min_lat=45.70, max_lat=45.82, min_lon=21.15, max_lon=21.35, step=0.009):
-    features = []
-
-    lat = min_lat
-    while lat < max_lat:
-        lon = min_lon
-        while lon < max_lon:
-            cell_lat = round(lat, 3)
-            cell_lon = round(lon, 3)
-            polygon = {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [[
-                        [cell_lon, cell_lat],
-                        [cell_lon + step, cell_lat],
-                        [cell_lon + step, cell_lat + step],
-                        [cell_lon, cell_lat + step],
-                        [cell_lon, cell_lat]
-                    ]]
-                },
-                "properties": {
-                    "cell": f"{cell_lat},{cell_lon}"
-                }
-            }
-            features.append(polygon)
-            lon += step
-        lat += step
+    return spatial_grid((min_lat, max_lat, min_lon, max_lon), step).feature_collection()
 
-    return {
-        "type": "FeatureCollection",
-        "features": features
-    }
+def heatmap_block(zoom):
+    """Grid cells per side merged into one heatmap square at a Leaflet zoom level"""
+    return min(2 ** max(0, HEATMAP_BASE_ZOOM - zoom), HEATMAP_MAX_BLOCK)
 
-def grid_cell_to_geojson(cell, cell_size=0.009):  
-    """
-    Convert a grid cell (lat, lon) to a GeoJSON polygon.
-    cell_size ~ 0.009 degrees ~ 1km at Timisoara latitude.
+def heatmap_features(grid, coverage, block=1):
+    """GeoJSON squares of `block` x `block` grid cells with their AQI statistics
+    
+    `coverage` is HourlyAQIStore.coverage() output; squares without readings
+    are left out.
     """
-    lat, lon = cell
-    lat = float(lat)
-    lon = float(lon)
-
-    return {
-        "type": "Feature",
-        "properties": {
-            "cell": f"{lat},{lon}"
-        },
-        "geometry": {
-            "type": "Polygon",
-            "coordinates": [[
-                [lon, lat],
-                [lon + cell_size, lat],
-                [lon + cell_size, lat + cell_size],
-                [lon, lat + cell_size],
-                [lon, lat]
-            ]]
+    cells, readings, aqi_sum, aqi_max, last_seen = coverage
+    rows, cols = grid.row_col(cells)
+    block_cols = -(-grid.cols // block)
+    squares, inverse = np.unique((rows // block) * block_cols + cols // block, return_inverse=True)
+    
+    counts = np.bincount(inverse, weights=readings, minlength=len(squares))
+    means = np.bincount(inverse, weights=aqi_sum, minlength=len(squares)) / np.maximum(counts, 1)
+    maxima = np.full(len(squares), -np.inf)
+    np.maximum.at(maxima, inverse, aqi_max)
+    seen = np.zeros(len(squares), dtype=np.int64)
+    np.maximum.at(seen, inverse, last_seen)
+    reporting = np.bincount(inverse, minlength=len(squares))
+    
+    square_rows, square_cols = np.divmod(squares, block_cols)
+    south = grid.lat_edges[square_rows * block].tolist()
+    north = grid.lat_edges[np.minimum((square_rows + 1) * block, grid.rows)].tolist()
+    west = grid.lon_edges[square_cols * block].tolist()
+    east = grid.lon_edges[np.minimum((square_cols + 1) * block, grid.cols)].tolist()
+    return [
+        {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[w, s], [e, s], [e, n], [w, n], [w, s]]]
+            },
+            "properties": {
+                "square": f"{round(s, 3)},{round(w, 3)}",
+                "cells_reporting": cells_reporting,
+                "readings": count,
+                "aqi_mean": round(mean, 1),
+                "aqi_max": maximum,
+                "aqi_level": level,
+                "last_seen": datetime.fromtimestamp(last).isoformat()
+            }
         }
-    }
+        for s, n, w, e, cells_reporting, count, mean, maximum, level, last in zip(
+            south, north, west, east, reporting.tolist(), counts.astype(np.int64).tolist(),
+            means.tolist(), maxima.tolist(), aqi_levels(means).tolist(), seen.tolist()
+        )
+    ]
+
+def parse_heatmap_window(args):
+    """(start_ts, end_ts) of a heatmap request: `start`/`end` datetimes or the last `hours` hours
+    
+    Raises ValueError with a message for the client.
+    """
+    if args.get('start') or args.get('end'):
+        try:
+            start_ts = parser.isoparse(args['start']).timestamp()
+            end_ts = parser.isoparse(args['end']).timestamp()
+        except (KeyError, ValueError):
+            raise ValueError("start and end must both be ISO dates or datetimes")
+    else:
+        try:
+            hours = int(args.get('hours', HEATMAP_DEFAULT_HOURS))
+        except ValueError:
+            raise ValueError("hours must be an integer")
+        end_ts = HourlyAQIStore.current_hour() + 3600
+        start_ts = end_ts - hours * 3600
+    
+    if end_ts <= start_ts:
+        raise ValueError("The window must end after it starts")
+    if end_ts - start_ts > HEATMAP_MAX_HOURS * 3600:
+        raise ValueError(f"The window can span at most {HEATMAP_MAX_HOURS} hours")
+    return int(start_ts), int(end_ts)
 
+def scan_result_points(results, max_age_hours=None):
+    """(lats, lons) arrays of scan results that have a location
+    
+    With `max_age_hours`, only results whose last_update is at most that old
+    count; timestamps without a timezone are taken as UTC.
+    """
+    cutoff = datetime.now(dateutil_tz.UTC) - timedelta(hours=max_age_hours) if max_age_hours else None
+    lats, lons = [], []
+    for entry in results:
+        location = entry.get('location')
+        if not isinstance(location, dict):
+            continue
+        try:
+            lat, lon = float(location.get('lat')), float(location.get('lng'))
+            if cutoff is not None:
+                updated = parser.isoparse(entry.get('last_update'))
+                if updated.tzinfo is None:
+                    updated = updated.replace(tzinfo=dateutil_tz.UTC)
+                if updated < cutoff:
+                    continue
+        except (TypeError, ValueError):
+            continue
+        lats.append(lat)
+        lons.append(lon)
+    return np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
 
-""" def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000  # Earth radius in meters
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
+def coverage_bitmap(grid, results, max_age_hours=None):
+    """Bitmap of the grid cells holding at least one (recent) scanned sensor"""
+    return grid.coverage(*scan_result_points(results, max_age_hours))
 
-    a = math.sin(delta_phi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(delta_lambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+
+class UncoveredCellIndex:
+    """KD-tree over the centres of a grid's uncovered cells, for nearest-cell queries.
+    
+    Centres are projected to metres with an equirectangular projection
+    around the grid's middle latitude, which is accurate to a fraction of a
+    percent across a city, so the tree ranks cells by ground distance.
+    Distances reported back are exact haversine distances. One index serves
+    a single coverage snapshot; see uncovered_cell_index.
+    """
+    
+    def __init__(self, grid, uncovered):
+        self.grid = grid
+        self.cells = np.flatnonzero(uncovered)
+        self.cos_lat = math.cos(math.radians((grid.lat_edges[0] + grid.lat_edges[-1]) / 2))
+        self.center_lats, self.center_lons = grid.cell_centers(self.cells)
+        self.tree = cKDTree(self.project(self.center_lats, self.center_lons)) if len(self.cells) else None
+    
+    def project(self, lats, lons):
+        """(n, 2) array of points in metres east and north"""
+        x = EARTH_RADIUS_M * np.radians(np.asarray(lons, dtype=float)) * self.cos_lat
+        y = EARTH_RADIUS_M * np.radians(np.asarray(lats, dtype=float))
+        return np.column_stack([x, y])
+    
+    def nearest(self, lats, lons, k=1):
+        """The k nearest uncovered cells of every point, in one batch query
+        
+        Returns (cells, distances), both shaped (points, k) and ordered by
+        distance: flat cell indices and metres to the cell centre. With fewer
+        than k uncovered cells the missing slots are -1 and inf.
+        """
+        points = len(lats)
+        cells = np.full((points, k), -1, dtype=np.int64)
+        distances = np.full((points, k), np.inf)
+        if self.tree is None or points == 0:
+            return cells, distances
+        
+        found = min(k, len(self.cells))
+        _, positions = self.tree.query(self.project(lats, lons), k=found)
+        positions = positions.reshape(points, found)
+        
+        cells[:, :found] = self.cells[positions]
+        distances[:, :found] = haversine_distances(
+            np.asarray(lats, dtype=float)[:, None], np.asarray(lons, dtype=float)[:, None],
+            self.center_lats[positions], self.center_lons[positions]
+        )
+        return cells, distances
 
 
-def suggest_nearest_uncovered_cell(mobile_devices, uncovered_cells):
-    suggestions = []
+_uncovered_indexes = OrderedDict()  # (bbox, step, packed bitmap) -> UncoveredCellIndex
+_uncovered_indexes_lock = threading.Lock()
 
-    for device in mobile_devices:
-        loc = device.get("location")
-        if not loc:
-            continue
-        lat, lon = loc.get("lat"), loc.get("lng")
-        if lat is None or lon is None:
-            continue
+def uncovered_cell_index(grid, uncovered):
+    """The UncoveredCellIndex of a coverage snapshot, built once per distinct bitmap"""
+    key = (grid.lat_edges[0], grid.lon_edges[0], grid.step, grid.rows, grid.cols, np.packbits(uncovered).tobytes())
+    with _uncovered_indexes_lock:
+        index = _uncovered_indexes.get(key)
+        if index is not None:
+            _uncovered_indexes.move_to_end(key)
+            return index
+    
+    index = UncoveredCellIndex(grid, uncovered)
+    with _uncovered_indexes_lock:
+        _uncovered_indexes[key] = index
+        while len(_uncovered_indexes) > UNCOVERED_INDEX_CACHE_SIZE:
+            _uncovered_indexes.popitem(last=False)
+    return index
 
-        min_dist = float("inf")
-        nearest_cell = None
-
-        for cell in uncovered_cells:
-            cell_lat, cell_lon = cell
-            dist = haversine(lat, lon, cell_lat, cell_lon)
-            if dist < min_dist:
-                min_dist = dist
-                nearest_cell = cell
-
-        suggestions.append({
-            "mac": device["mac"],
-            "last_location": {"lat": lat, "lon": lon},
-            "suggested_cell": nearest_cell,
-            "distance_meters": round(min_dist, 1)
-        })
 
-    return suggestions """
 
 
 
@@ -835,30 +3856,63 @@ def suggest_nearest_uncovered_cell(mobile_devices, uncovered_cells):
 
 @app.route('/api/scan_macs/start', methods=['POST'])
 def start_mac_scan():
-    """Start scanning for active MAC addresses"""
-    global scanning_status
-    
-    if scanning_status['in_progress']:
-        return jsonify({'error': 'Scan already in progress'}), 400
-    
+    """Queue a scan job for active MAC addresses; several jobs may run at once"""
     try:
         base_mac = request.form.get('base_mac', '00:A0:50:D3:74:F7')
         range_size = int(request.form.get('range_size', 100))
         
+        engine = request.form.get('engine', 'threads')
+        concurrency = request.form.get('concurrency')
+        
         if range_size > 500:
             return jsonify({'error': 'Range size too large (max 500)'}), 400
         
-        # Start background thread
-        thread = threading.Thread(
-            target=scan_macs_background, 
-            args=(base_mac, range_size)
-        )
-        thread.daemon = True
-        thread.start()
+        if engine not in ('threads', 'async', 'processes'):
+            return jsonify({'error': "Engine must be 'threads', 'async' or 'processes'"}), 400
+        
+        if concurrency:
+            concurrency = int(concurrency)
+            if concurrency < 1 or concurrency > MAX_SCAN_CONCURRENCY:
+                return jsonify({'error': f'Concurrency must be between 1 and {MAX_SCAN_CONCURRENCY}'}), 400
+        else:
+            concurrency = None
+        
+        resume = request.form.get('resume', 'false').lower() in ('1', 'true', 'yes', 'on')
+        recent_policy = request.form.get('recent_policy', 'skip')
+        skip_recent_hours = float(request.form.get('skip_recent_hours', LEDGER_SKIP_RECENT_HOURS))
+        
+        if recent_policy not in ('skip', 'defer', 'probe'):
+            return jsonify({'error': "recent_policy must be 'skip', 'defer' or 'probe'"}), 400
+        
+        mode = request.form.get('mode', 'range')
+        if mode not in ('range', 'nearby'):
+            return jsonify({'error': "Mode must be 'range' or 'nearby'"}), 400
+        
+        if engine == 'processes' and mode != 'range':
+            return jsonify({'error': "The processes engine only supports mode 'range'"}), 400
+        
+        shards = request.form.get('shards')
+        shards = int(shards) if shards else None
+        if shards is not None and (shards < 1 or shards > 64):
+            return jsonify({'error': 'Shards must be between 1 and 64'}), 400
+        
+        try:
+            job = scan_jobs.submit(
+                scan_macs_background,
+                base_mac, range_size, engine, concurrency, resume, recent_policy, skip_recent_hours, mode, shards,
+                engine=engine, mode=mode
+            )
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 429
         
         return jsonify({
             'success': True,
-            'message': f'MAC scan started for range {range_size} around {base_mac}',
+            'message': (f'MAC scan started for range {range_size} around {base_mac} ({engine} engine)' if mode == 'range'
+                        else f'Nearby scan started around known active devices ({engine} engine)'),
+            'job_id': job.job_id,
+            'state': job.get('state'),
+            'engine': engine,
+            'mode': mode,
             'estimated_time': f'{range_size // 10} seconds'
         })
     
@@ -867,10 +3921,141 @@ def start_mac_scan():
 
 @app.route('/api/scan_macs/status')
 def get_scan_status():
-    """Get current scanning status"""
-    global scanning_status
-    return jsonify(scanning_status)
+    """Get the status of a scan job (the latest one if no job_id is given)"""
+    job_id = request.args.get('job_id')
+    state = scan_status_store.load(job_id) if job_id else scan_status_store.latest()
+    if state is None:
+        if job_id:
+            return jsonify({'error': 'Unknown scan job'}), 404
+        state = dict(SCAN_STATUS_DEFAULTS)
+    return jsonify(state)
+
+@app.route('/api/scan_macs/jobs')
+def list_scan_jobs():
+    """List recent scan jobs (queued, running, paused and finished), newest first"""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        return jsonify({'jobs': scan_status_store.list_jobs(limit)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/scan_macs/jobs/<job_id>')
+def get_scan_job(job_id):
+    """Get the status of one scan job"""
+    state = scan_status_store.load(job_id)
+    if state is None:
+        return jsonify({'error': 'Unknown scan job'}), 404
+    return jsonify(state)
+
+@app.route('/api/scan_macs/jobs/<job_id>/<action>', methods=['POST'])
+def control_scan_job(job_id, action):
+    """Cancel, pause or resume a scan job"""
+    if action not in ('cancel', 'pause', 'resume'):
+        return jsonify({'error': "Action must be 'cancel', 'pause' or 'resume'"}), 400
+    try:
+        if not scan_jobs.control(job_id, action):
+            return jsonify({'error': 'Unknown or finished scan job'}), 404
+        return jsonify({'success': True, 'job_id': job_id, 'action': action})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/scan_macs/events')
+def stream_scan_events():
+    """Server-sent events for a scan job: 'progress', 'active' (one per new MAC) and 'finished'"""
+    job_id = request.args.get('job_id')
+    if not job_id:
+        latest_job = scan_status_store.latest()
+        job_id = latest_job['job_id'] if latest_job else None
+    if not job_id or scan_status_store.load(job_id) is None:
+        return jsonify({'error': 'Unknown scan job'}), 404
+    
+    # EventSource sends Last-Event-ID when it reconnects, so no event is lost or repeated
+    last_seq = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        last_seq = int(last_seq)
+    except ValueError:
+        last_seq = 0
+    
+    def stream(last_seq):
+        yield "retry: 2000\n\n"
+        last_sent = time.monotonic()
+        while True:
+            events = scan_status_store.events_since(job_id, last_seq)
+            for seq, event, payload in events:
+                last_seq = seq
+                yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+                if event == 'finished':
+                    return
+            
+            now = time.monotonic()
+            if events:
+                last_sent = now
+                continue
+            
+            state = scan_status_store.load(job_id)
+            if state is None or not state['in_progress']:
+                # Finished without a 'finished' event (e.g. the worker died); send the final state once
+                yield f"event: finished\ndata: {json.dumps(state or {})}\n\n"
+                return
+            if now - last_sent >= SCAN_EVENTS_KEEPALIVE:
+                last_sent = now
+                yield ": keep-alive\n\n"
+            time.sleep(SCAN_EVENTS_POLL_INTERVAL)
+    
+    return Response(stream(last_seq), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+
+@app.route('/api/http/stats')
+def get_http_stats():
+    """Get connection pool and reuse counters for upstream requests"""
+    return jsonify(dict(http_client.stats(), scan_probes=scan_http_client.stats(),
+                        latest_readings=latest_reading_cache.stats(), query_results=query_cache.stats()))
+
+@app.route('/api/ingest/metrics')
+def get_ingest_metrics():
+    """Get ingestion lag per device and the last ingestion cycle"""
+    try:
+        return jsonify(ingestion_scheduler.metrics())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ingest/run', methods=['POST'])
+def run_ingestion():
+    """Run one ingestion cycle in the background"""
+    threading.Thread(target=ingestion_scheduler.run_once, daemon=True).start()
+    return jsonify({'success': True, 'message': 'Ingestion cycle started'})
+
+@app.route('/api/history/stats')
+def get_history_stats():
+    """Get the hours of AQI history stored per device"""
+    try:
+        return jsonify({'devices': history_store.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/geocode/stats')
+def get_geocode_stats():
+    """Get size and hit ratio of the reverse-geocoding cache"""
+    try:
+        return jsonify(geocode_cache.stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/geocode/warm', methods=['POST'])
+def warm_geocode_cache():
+    """Resolve and cache the location of every saved device"""
+    try:
+        locations = api_client.warm_geocode_cache()
+        return jsonify({
+            'success': True,
+            'warmed': len(locations),
+            'locations': locations,
+            'cache': geocode_cache.stats()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/scan_macs/results')
@@ -969,40 +4154,58 @@ def show_mac_results():
 
 @app.route('/api/grid_coverage')
 def grid_coverage():
+    """Map grid cells holding a sensor that reported in the last COVERAGE_MAX_AGE_HOURS"""
     try:
-        with open('mac_scan_results.json', 'r') as f:
-            data = json.load(f)
-        results = data.get("results", [])
+        results = load_mac_scan_data('mac_scan_results.json')
         if not isinstance(results, list):
             raise ValueError("Unexpected JSON structure: 'results' is not a list")
 
-        covered_cells = set()
-        for entry in results:
-            loc = entry.get("location")
-            if loc:
-                lat, lon = loc.get("lat"), loc.get("lng")
-                if lat is not None and lon is not None:
-                    cell = assign_grid_cell(lat, lon)
-                    covered_cells.add(cell)
-
-        features = []
-        for lat, lon in covered_cells:
-            features.append({
-                "type": "Feature",
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [[
-                        [lon, lat],
-                        [lon + 0.009, lat],
-                        [lon + 0.009, lat + 0.009],
-                        [lon, lat + 0.009],
-                        [lon, lat]
-                    ]]
-                },
-                "properties": {"cell": f"{lat},{lon}"}
-            })
+        grid = map_grid()
+        covered = coverage_bitmap(grid, results, COVERAGE_MAX_AGE_HOURS)
+        return prepared_json.get(
+            ('covered', MAP_GRID_BBOX, MAP_GRID_STEP, np.packbits(covered).tobytes()),
+            lambda: grid.feature_collection(covered)
+        ).response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/coverage/heatmap')
+def coverage_heatmap():
+    """Per-square AQI statistics over a time window, sized for a map zoom level
+    
+    The window is `start`..`end` or the last `hours` hours (default
+    HEATMAP_DEFAULT_HOURS); `zoom` is the Leaflet zoom. Bodies come from the
+    coverage aggregate and are reused until new readings are ingested.
+    """
+    try:
+        zoom = int(request.args.get('zoom', HEATMAP_BASE_ZOOM))
+    except ValueError:
+        return jsonify({"error": "zoom must be an integer"}), 400
+    try:
+        start_ts, end_ts = parse_heatmap_window(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        return jsonify({"type": "FeatureCollection", "features": features})
+    try:
+        grid = map_grid()
+        block = heatmap_block(zoom)
+        
+        def build():
+            return {
+                "type": "FeatureCollection",
+                "window": {
+                    "start": datetime.fromtimestamp(start_ts).isoformat(),
+                    "end": datetime.fromtimestamp(end_ts).isoformat()
+                },
+                "block": block,
+                "features": heatmap_features(grid, history_store.coverage(start_ts, end_ts), block)
+            }
+        
+        return prepared_json.get(
+            ('heatmap', MAP_GRID_BBOX, MAP_GRID_STEP, start_ts, end_ts, block, history_store.coverage_version()),
+            build
+        ).response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1014,8 +4217,9 @@ def map_page():
 
 @app.route('/api/grid/full')
 def full_grid():
-    grid = generate_full_grid()
-    return jsonify(grid)
+    """The whole map grid; encoded once and revalidated by ETag afterwards"""
+    grid = map_grid()
+    return prepared_json.get(('full', MAP_GRID_BBOX, MAP_GRID_STEP), grid.feature_collection).response()
 
 
 
@@ -1056,73 +4260,45 @@ def get_inactive_devices():
 
 @app.route('/api/uncovered_cells')
 def get_uncovered_cells():
+    """Map grid cells without a sensor that reported in the last COVERAGE_MAX_AGE_HOURS"""
     try:
-        # Load data
-        with open('mac_scan_results.json', 'r') as f:
-            raw_data = json.load(f)
-            cleaned_results = raw_data.get('results', [])
-
-        # Time threshold = now - 24h
-        now = datetime.utcnow()
-        time_threshold = now - timedelta(hours=24)
-
-        # Set of covered cells in last 24h
-        covered_cells = set()
-        for device in cleaned_results:
-            timestamp_str = device.get('last_update')
-            location = device.get('location')
-            if timestamp_str and location:
-                try:
-                    ts = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
-                    if ts >= time_threshold:
-                        lat, lon = location.get("lat"), location.get("lng")
-                        if lat is not None and lon is not None:
-                            cell = assign_grid_cell(lat, lon)
-                            covered_cells.add(cell)
-                except Exception as e:
-                    continue
+        results = load_mac_scan_data('mac_scan_results.json')
 
-        # Generate full grid (Timisoara example area: approx 45.70–45.80 lat, 21.15–21.30 lon)
-        all_cells = set()
-        for lat in range(45700, 45800):  # 45.700 to 45.800
-            for lon in range(21150, 21300):  # 21.150 to 21.300
-                cell = (lat / 1000.0, lon / 1000.0)
-                all_cells.add(cell)
+        # Same grid and age window as /api/grid_coverage, so the two cell sets are complementary
+        grid = map_grid()
+        uncovered = ~coverage_bitmap(grid, results, COVERAGE_MAX_AGE_HOURS)
 
-        # Subtract covered cells to get uncovered
-        uncovered_cells = all_cells - covered_cells
-
-        # Convert to GeoJSON
-        features = [grid_cell_to_geojson(cell) for cell in uncovered_cells]
-        return jsonify({
-            "type": "FeatureCollection",
-            "features": features
-        })
+        # The same coverage always gives the same body, so it is only encoded once
+        return prepared_json.get(
+            ('uncovered', MAP_GRID_BBOX, MAP_GRID_STEP, np.packbits(uncovered).tobytes()),
+            lambda: grid.feature_collection(uncovered)
+        ).response()
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def frange(start, stop, step):
-    """Floating point range generator"""
-    while start < stop:
-        yield start
-        start += step
-
-
-
 @app.route('/api/mobile_suggestions')
 def mobile_suggestions():
+    """Nearest uncovered map cells for every mobile sensor, answered in one batch query
+    
+    `k` (default 1) asks for that many candidate cells per device, nearest first.
+    """
     try:
-        with open('mac_scan_results.json') as f:
-            data = json.load(f)
+        k = min(max(int(request.args.get('k', SUGGESTION_DEFAULT_K)), 1), SUGGESTION_MAX_K)
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
 
-        results = data.get("results", [])
-        suggestions = []
+    try:
+        results = load_mac_scan_data('mac_scan_results.json')
+        # Results saved before scans tagged device_type are classified here
+        device_types = compute_movement_by_mac([device for device in results if "device_type" not in device])
 
         # Loop through each mobile device
+        mobile = []
         for device in results:
-            if device.get("device_type") != "mobile":
+            device_type = device.get("device_type") or device_types.get(str(device.get("mac", "")).upper())
+            if device_type != "mobile":
                 continue
 
             location = device.get("location")
@@ -1134,24 +4310,36 @@ def mobile_suggestions():
 
             if lat is None or lon is None:
                 continue
+            mobile.append((device["mac"], float(lat), float(lon)))
 
-            # Find the nearest uncovered grid cell
-            nearest_cell = None
-            min_distance = float('inf')
+        # Uncovered cells are the same ones /api/uncovered_cells shows
+        grid = map_grid()
+        uncovered = ~coverage_bitmap(grid, results, COVERAGE_MAX_AGE_HOURS)
+        index = uncovered_cell_index(grid, uncovered)
 
-            for cell in uncovered_cells:
-                cell_lat, cell_lon = cell
-                dist = haversine_distance(lat, lon, cell_lat, cell_lon)
-                if dist < min_distance:
-                    min_distance = dist
-                    nearest_cell = cell
+        lats = np.array([lat for _, lat, _ in mobile])
+        lons = np.array([lon for _, _, lon in mobile])
+        cells, distances = index.nearest(lats, lons, k)
 
-            if nearest_cell:
+        features = grid.features()
+        suggestions = []
+        for (mac, lat, lon), device_cells, device_distances in zip(mobile, cells.tolist(), distances.tolist()):
+            candidates = [
+                {
+                    "cell": features[cell]["properties"]["cell"],
+                    "index": cell,
+                    "distance_meters": round(distance, 2)
+                }
+                for cell, distance in zip(device_cells, device_distances)
+                if cell >= 0
+            ]
+            if candidates:
                 suggestions.append({
-                    "mac": device["mac"],
+                    "mac": mac,
                     "sensor_location": [lat, lon],
-                    "suggested_cell": list(nearest_cell),
-                    "distance_meters": round(min_distance, 2)
+                    "suggested_cell": list(grid.cell_origin(candidates[0]["index"])),
+                    "distance_meters": candidates[0]["distance_meters"],
+                    "candidates": candidates
                 })
 
         return jsonify(suggestions)
@@ -1217,6 +4405,8 @@ def save_device():
         # Save the device
         success = api_client.save_device(mac, name)
         if success:
+            # Resolve its location now so the first download doesn't wait on the geocoder
+            threading.Thread(target=api_client.warm_geocode_cache, args=([mac],), daemon=True).start()
             return jsonify({
                 'success': True,
                 'message': f'Device {mac} saved successfully'
@@ -1244,182 +4434,160 @@ def remove_device():
 
 @app.route('/download_data', methods=['POST'])
 def download_data():
-    """Download data as CSV"""
+    """Download data as CSV (plain or compressed), Parquet or Arrow IPC"""
     try:
-        mac = request.form.get('device_mac')
-        data_type = request.form.get('data_type')
+        export_format = parse_export_format(request.form.get('format'))
         
-        if not mac:
-            return jsonify({'error': 'Device MAC is required'}), 400
+        try:
+            query = parse_data_query(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        data = None
-        filename = f"air_quality_data_{mac}.csv"
+        if export_format is None:
+            return jsonify({'error': f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
         
-        if data_type == 'time_range' or data_type == 'date_range':
-            start_date = request.form.get('start_date')
-            end_date = request.form.get('end_date')
-            start_hour = request.form.get('start_hour', '0')
-            end_hour = request.form.get('end_hour', '23')
-            
-            if not start_date or not end_date:
-                return jsonify({'error': 'Start date and end date are required'}), 400
-            
-            try:
-                # Validate date format
-                datetime.strptime(start_date, '%Y-%m-%d')
-                datetime.strptime(end_date, '%Y-%m-%d')
-                start_hour = int(start_hour)
-                end_hour = int(end_hour)
-                
-                if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
-            
-            data = api_client.get_date_range_data(mac, start_date, end_date, start_hour, end_hour)
-            filename = f"date_range_data_{mac}_{start_date}_to_{end_date}.csv"
-            
-            if len(data) == 0:
-                return jsonify({'error': f'No data found for dates {start_date} to {end_date}. Try different dates.'}), 404
+        data_type, mac, params = query
+        frames = iter(())
         
-        elif data_type == 'hourly':
-            hours_from = request.form.get('hours_from')
-            hours_to = request.form.get('hours_to')
-            
-            if not hours_from or not hours_to:
-                return jsonify({'error': 'Hours from and to are required'}), 400
-            
-            try:
-                hours_from = int(hours_from)
-                hours_to = int(hours_to)
-                
-                if hours_from < 0 or hours_from > 23 or hours_to < 0 or hours_to > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-                if hours_from >= hours_to:
-                    return jsonify({'error': 'Start hour must be less than end hour'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Hours must be integers'}), 400
-            
-            data = api_client.get_hourly_data(mac, hours_from, hours_to)
-            filename = f"hourly_data_{mac}_{hours_from}h_to_{hours_to}h.csv"
-            
-            if len(data) == 0:
-                return jsonify({'error': f'No data found for hours {hours_from} to {hours_to}. Try a different time range.'}), 404
+        if data_type == 'date_range' and date_range_hours(*params[:2]) > EXPORT_WINDOW_HOURS:
+            # Too big to cache: stream straight from the history store, one window
+            # at a time; the first non-empty window decides between a 404 and a stream
+            frames = api_client.iter_date_range_frames(mac, *params)
+            first_frame = next(frames, None)
+        else:
+            # Shares the result with /preview_data, so a download right after a preview is local
+            _, first_frame, _ = cached_query_result(api_client, query)
         
-        elif data_type == 'latest':
-            data = api_client.get_device_data(mac)
-            filename = f"latest_data_{mac}.csv"
-            
-            if not data or len(data) == 0:
-                return jsonify({'error': 'No latest data found'}), 404
+        if first_frame is None or first_frame.empty:
+            return jsonify({'error': no_data_message(query)}), 404
         
-        else:
-            return jsonify({'error': 'Invalid data type'}), 400
-        
-        # Convert to CSV
-        csv_data = convert_to_csv(data)
-        if not csv_data:
-            return jsonify({'error': 'Failed to convert data to CSV or no valid data found'}), 500
-        
-        # Create file buffer
-        csv_buffer = io.StringIO(csv_data)
-        csv_bytes = io.BytesIO(csv_buffer.getvalue().encode('utf-8'))
-        
-        return send_file(
-            csv_bytes,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
+        columns = list(first_frame.columns) if data_type == 'latest' else HOURLY_COLUMNS
+        return export_response(itertools.chain([first_frame], frames), columns, query_filename(query), export_format)
     
     except Exception as e:
         print(f"Download error: {e}")
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
-@app.route('/preview_data', methods=['POST'])
-def preview_data():
-    """Preview data without downloading"""
+@app.route('/download_bulk', methods=['POST'])
+def download_bulk():
+    """Export one date range for several devices, as one long table or a zip of per-device files"""
     try:
-        mac = request.form.get('device_mac')
-        data_type = request.form.get('data_type')
+        export_format = parse_export_format(request.form.get('format'))
+        layout = request.form.get('layout', 'long').lower()
         
-        if not mac:
-            return jsonify({'error': 'Device MAC is required'}), 400
+        if export_format is None:
+            return jsonify({'error': f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
         
-        data = None
+        if layout not in BULK_EXPORT_LAYOUTS:
+            return jsonify({'error': f"Unsupported layout. Use one of: {', '.join(BULK_EXPORT_LAYOUTS)}"}), 400
         
-        if data_type == 'time_range' or data_type == 'date_range':
-            start_date = request.form.get('start_date')
-            end_date = request.form.get('end_date')
-            start_hour = request.form.get('start_hour', '0')
-            end_hour = request.form.get('end_hour', '23')
-            
-            if not start_date or not end_date:
-                return jsonify({'error': 'Start date and end date are required'}), 400
-            
-            try:
-                # Validate date format
-                datetime.strptime(start_date, '%Y-%m-%d')
-                datetime.strptime(end_date, '%Y-%m-%d')
-                start_hour = int(start_hour)
-                end_hour = int(end_hour)
-                
-                if start_hour < 0 or start_hour > 23 or end_hour < 0 or end_hour > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
-            
-            data = api_client.get_date_range_data(mac, start_date, end_date, start_hour, end_hour)
-            
-            if len(data) == 0:
-                return jsonify({'error': f'No data found for dates {start_date} to {end_date}. Try different dates.'}), 404
+        try:
+            start_date, end_date, start_hour, end_hour = parse_date_range_form(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        elif data_type == 'hourly':
-            hours_from = request.form.get('hours_from')
-            hours_to = request.form.get('hours_to')
-            
-            if not hours_from or not hours_to:
-                return jsonify({'error': 'Hours from and to are required'}), 400
-            
-            try:
-                hours_from = int(hours_from)
-                hours_to = int(hours_to)
-                
-                if hours_from < 0 or hours_from > 23 or hours_to < 0 or hours_to > 23:
-                    return jsonify({'error': 'Hours must be between 0 and 23'}), 400
-                
-                if hours_from >= hours_to:
-                    return jsonify({'error': 'Start hour must be less than end hour'}), 400
-                
-            except ValueError:
-                return jsonify({'error': 'Hours must be integers'}), 400
-            
-            data = api_client.get_hourly_data(mac, hours_from, hours_to)
-            
-            if len(data) == 0:
-                return jsonify({'error': f'No data found for hours {hours_from} to {hours_to}. Try a different time range.'}), 404
+        macs = parse_bulk_macs(request.form, api_client.get_saved_devices())
+        if not macs:
+            return jsonify({'error': 'At least one device MAC (or all_devices) is required'}), 400
         
-        elif data_type == 'latest':
-            data = api_client.get_device_data(mac)
-            
-            if not data or len(data) == 0:
-                return jsonify({'error': 'No latest data found'}), 404
+        if len(macs) > BULK_EXPORT_MAX_DEVICES:
+            return jsonify({'error': f'At most {BULK_EXPORT_MAX_DEVICES} devices per export'}), 400
         
-        else:
-            return jsonify({'error': 'Invalid data type'}), 400
+        manifest = {
+            'start_date': start_date,
+            'end_date': end_date,
+            'start_hour': start_hour,
+            'end_hour': end_hour,
+            'format': export_format,
+            'layout': layout,
+            'generated_at': datetime.now().isoformat(),
+            'devices': []
+        }
+        results = iter_bulk_frames(api_client, macs, start_date, end_date, start_hour, end_hour)
+        filename = f"bulk_data_{len(macs)}_devices_{start_date}_to_{end_date}"
+        
+        if layout == 'zip':
+            return Response(
+                stream_bulk_zip(results, export_format, manifest),
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename="{filename}.zip"'}
+            )
+        
+        # The manifest goes out with the table, so every device is fetched first
+        frames = []
+        for mac, frame, entry in results:
+            manifest['devices'].append(entry)
+            if frame is not None:
+                frames.append(frame)
+        
+        if not frames:
+            return jsonify({'error': f'No data found for dates {start_date} to {end_date}. Try different dates.',
+                            'manifest': manifest}), 404
+        
+        # Columnar files carry the whole manifest in their schema metadata; CSV
+        # only gets the bounded summary header
+        columnar = export_format not in ('csv', *EXPORT_CSV_CODECS)
+        metadata = {'export_manifest': json.dumps(manifest)} if columnar else None
+        header = bulk_manifest_header(manifest, 'schema_metadata' if columnar else 'layout=zip')
+        return export_response(frames, HOURLY_COLUMNS, filename, export_format,
+                               headers={'X-Export-Manifest': header}, metadata=metadata)
+    
+    except Exception as e:
+        print(f"Bulk download error: {e}")
+        return jsonify({'error': f'Error: {str(e)}'}), 500
+
+@app.route('/preview_data', methods=['POST'])
+def preview_data():
+    """One page of a query's rows plus summary stats of the whole result
+    
+    Optional form fields: `page` (1-based), `page_size` and `columns`
+    (comma-separated projection). The full result is cached, so further
+    pages and a following download don't fetch it again.
+    """
+    try:
+        try:
+            query = parse_data_query(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            page = int(request.form.get('page', 1))
+            page_size = int(request.form.get('page_size', PREVIEW_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'error': 'Page and page size must be integers'}), 400
+        
+        if page < 1 or page_size < 1:
+            return jsonify({'error': 'Page and page size must be positive'}), 400
+        page_size = min(page_size, PREVIEW_MAX_PAGE_SIZE)
         
-        # Return all data for preview
-        preview_data = data if isinstance(data, list) else [data]
-        total_records = len(data) if isinstance(data, list) else 1
+        query_key, frame, stats = cached_query_result(api_client, query)
+        if frame.empty:
+            return jsonify({'error': no_data_message(query)}), 404
+        
+        columns = list(frame.columns)
+        requested = [name.strip() for name in request.form.get('columns', '').split(',') if name.strip()]
+        if requested:
+            unknown = [name for name in requested if name not in frame.columns]
+            if unknown:
+                return jsonify({'error': f"Unknown columns: {', '.join(unknown)}"}), 400
+            columns = requested
+        
+        total_records = len(frame)
+        total_pages = max(1, math.ceil(total_records / page_size))
+        page = min(page, total_pages)
+        start = (page - 1) * page_size
         
         return jsonify({
             'success': True,
-            'data': preview_data,
-            'total_records': total_records
+            'data': frame_records(frame.iloc[start:start + page_size][columns]),
+            'columns': columns,
+            'available_columns': list(frame.columns),
+            'page': page,
+            'page_size': page_size,
+            'total_pages': total_pages,
+            'total_records': total_records,
+            'stats': stats,
+            'query_key': query_key
         })
     
     except Exception as e:
@@ -1427,6 +4595,15 @@ def preview_data():
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'ingest':
+        # Run the ingestion daemon in the foreground instead of the web server
+        print(f"Ingesting {len(ingestion_scheduler.targets())} devices every {INGEST_INTERVAL:.0f} s")
+        try:
+            ingestion_scheduler.run_forever()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    
     if not os.path.exists('templates'):
         os.makedirs('templates')
     
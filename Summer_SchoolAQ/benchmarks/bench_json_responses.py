@@ -0,0 +1,94 @@
+"""Benchmark JSON responses: Flask's stdlib encoder vs. the orjson provider, plus compression.
+
+Payloads are taken from the map and scan endpoints (/api/uncovered_cells,
+/api/grid/full, /api/scan_macs/results, served from mac_scan_results.json
+in the working directory) and from a synthetic /preview_data page built by
+AirQualityAPI.build_hourly_frame. Each payload is encoded by both providers
+(checked to decode to the same value first) and its wire size is reported
+uncompressed, gzip-compressed and, when brotli is installed, brotli-compressed.
+
+Usage:
+    cd Summer_SchoolAQ && python benchmarks/bench_json_responses.py --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aq  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+
+ENDPOINTS = ('/api/uncovered_cells', '/api/grid/full', '/api/scan_macs/results')
+
+
+def preview_payload(rows):
+    """A /preview_data response body with `rows` readings"""
+    api = aq.AirQualityAPI('http://localhost', history_store=aq.HourlyAQIStore(':memory:'))
+    current_hour = aq.HourlyAQIStore.current_hour()
+    hour_ts = current_hour - np.arange(rows)[::-1] * 3600
+    aqi = np.random.default_rng(0).integers(0, 350, size=rows).astype('float64')
+    frame = api.build_hourly_frame('AA:BB:CC:DD:EE:FF', hour_ts, aqi, 'Timisoara, Timis, Romania',
+                                   45.7613, 21.2513, 'historical_aqi', 'Historical AQI reading from ',
+                                   current_hour=current_hour)
+    return {
+        'success': True,
+        'data': aq.frame_records(frame),
+        'columns': list(frame.columns),
+        'total_records': len(frame),
+        'stats': aq.summarize_frame(frame)
+    }
+
+
+def time_response(provider, payload, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = provider.response(payload).get_data()
+    return (time.perf_counter() - started) / repeat, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--preview-rows', type=int, default=aq.PREVIEW_MAX_PAGE_SIZE)
+    args = parser.parse_args()
+
+    if aq.orjson is None:
+        sys.exit('orjson is not installed')
+
+    payloads = {}
+    client = aq.app.test_client()
+    for endpoint in ENDPOINTS:
+        response = client.get(endpoint)
+        if response.status_code != 200:
+            print(f"{endpoint}: skipped (HTTP {response.status_code})")
+            continue
+        payloads[endpoint] = json.loads(response.get_data())
+    payloads['/preview_data'] = preview_payload(args.preview_rows)
+
+    stdlib = DefaultJSONProvider(aq.app)
+    fast = aq.OrjsonProvider(aq.app)
+
+    with aq.app.app_context():
+        for name, payload in payloads.items():
+            stdlib_time, stdlib_body = time_response(stdlib, payload, args.repeat)
+            fast_time, fast_body = time_response(fast, payload, args.repeat)
+            assert json.loads(stdlib_body) == json.loads(fast_body), f'{name}: encoders disagree'
+
+            sizes = f"{len(fast_body) / 1024:.0f} KiB raw, " \
+                    f"{len(aq.compress_body(fast_body, 'gzip')) / 1024:.0f} KiB gzip"
+            if aq.brotli is not None:
+                sizes += f", {len(aq.compress_body(fast_body, 'br')) / 1024:.0f} KiB br"
+
+            print(f"{name}: {sizes}")
+            print(f"  stdlib: {stdlib_time * 1000:.1f} ms  orjson: {fast_time * 1000:.1f} ms  "
+                  f"speedup: {stdlib_time / fast_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
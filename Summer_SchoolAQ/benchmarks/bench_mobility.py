@@ -0,0 +1,101 @@
+"""Benchmark mobility classification: per-MAC pairwise loop vs. classify_mobility.
+
+Synthetic tracks are generated around Timisoara: static sensors report a
+position jittered by a few metres, mobile ones drift along a random walk,
+and every device reports at random times over `--days` days. The reference
+is the former compute_movement_by_mac loop, comparing each sighting with
+every later one inside the window using the scalar haversine_distance; it
+runs on a subset of MACs (`--reference-macs`) since it is quadratic in
+dense tracks, and both implementations must agree on that subset.
+
+Usage:
+    cd Summer_SchoolAQ && python benchmarks/bench_mobility.py --points 100000 --macs 500
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aq  # noqa: E402
+
+
+def synthetic_tracks(points, macs, days, mobile_share, seed=0):
+    """(macs, epoch seconds, lats, lngs) of `points` sightings spread over `macs` devices"""
+    rng = np.random.default_rng(seed)
+    owner = rng.integers(0, macs, size=points)
+    times = time.time() - rng.uniform(0, days * 86400, size=points)
+    home_lat = rng.uniform(45.70, 45.82, size=macs)[owner]
+    home_lng = rng.uniform(21.15, 21.35, size=macs)[owner]
+    # ~5 m of GPS jitter for everyone; mobile devices also wander up to a few km
+    mobile = (rng.random(macs) < mobile_share)[owner]
+    drift = rng.normal(0, 0.01, size=(points, 2)) * mobile[:, None]
+    lats = home_lat + drift[:, 0] + rng.normal(0, 0.00004, size=points)
+    lngs = home_lng + drift[:, 1] + rng.normal(0, 0.00004, size=points)
+    names = np.array([f'AA:BB:CC:DD:{m // 256:02X}:{m % 256:02X}' for m in range(macs)], dtype=object)
+    return names[owner], times, lats, lngs
+
+
+def pairwise_loop(macs, times, lats, lngs, window_hours, min_distance_m):
+    """The former per-MAC nested loop over time-sorted sightings"""
+    tracks = defaultdict(list)
+    for mac, observed, lat, lng in zip(macs, times, lats, lngs):
+        tracks[mac].append((observed, lat, lng))
+
+    result = {}
+    for mac, points in tracks.items():
+        points.sort(key=lambda x: x[0])
+        is_mobile = False
+        for i in range(len(points)):
+            t1, lat1, lon1 = points[i]
+            for j in range(i + 1, len(points)):
+                t2, lat2, lon2 = points[j]
+                if (t2 - t1) / 3600.0 > window_hours:
+                    break
+                if aq.haversine_distance(lat1, lon1, lat2, lon2) > min_distance_m:
+                    is_mobile = True
+                    break
+            if is_mobile:
+                break
+        result[mac] = 'mobile' if is_mobile else 'static'
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--macs', type=int, default=500)
+    parser.add_argument('--days', type=float, default=aq.MOBILITY_LOOKBACK_DAYS)
+    parser.add_argument('--mobile-share', type=float, default=0.2)
+    parser.add_argument('--reference-macs', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    macs, times, lats, lngs = synthetic_tracks(args.points, args.macs, args.days, args.mobile_share)
+    window, threshold = aq.MOBILITY_WINDOW_HOURS, aq.MOBILITY_MIN_DISTANCE_M
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        fast = aq.classify_mobility(macs, times, lats, lngs, window, threshold)
+    fast_time = (time.perf_counter() - started) / args.repeat
+
+    subset = np.isin(macs, np.unique(macs)[:args.reference_macs])
+    started = time.perf_counter()
+    reference = pairwise_loop(macs[subset], times[subset], lats[subset], lngs[subset], window, threshold)
+    loop_time = time.perf_counter() - started
+    assert all(fast[mac] == kind for mac, kind in reference.items()), 'classifications disagree'
+
+    mobile = sum(kind == 'mobile' for kind in fast.values())
+    print(f"{args.points} sightings, {len(fast)} MACs ({mobile} mobile), "
+          f"{args.points / len(fast):.0f} sightings per MAC")
+    print(f"classify_mobility: {fast_time * 1000:.1f} ms for all MACs")
+    print(f"pairwise loop:     {loop_time * 1000:.1f} ms for {len(reference)} MACs "
+          f"(~{loop_time * len(fast) / len(reference):.1f} s extrapolated to all)")
+
+
+if __name__ == '__main__':
+    main()
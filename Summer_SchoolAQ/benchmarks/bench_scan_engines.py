@@ -0,0 +1,105 @@
+"""Benchmark the thread and async MAC scan engines against a local stub.
+
+The stub serves /api/v1/data-intake/<mac> with a fixed artificial latency,
+answering 200 with a small reading for every `--active-every`-th MAC and 404
+for the rest, which is roughly what airview.cs.upt.ro does during a scan.
+
+Usage:
+    python benchmarks/bench_scan_engines.py --range-size 60 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import ActiveMACExtractor, ScanJob  # noqa: E402
+
+
+def start_stub_server(latency, active_every):
+    """Run the stub data-intake endpoint in a background thread, return its base URL"""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    address = {}
+
+    async def data_intake(request):
+        mac = request.match_info['mac']
+        await asyncio.sleep(latency)
+        if int(mac.replace(':', ''), 16) % active_every == 0:
+            return web.json_response({
+                'mac': mac,
+                'timestamp': '2025-07-09T12:00:00.000Z',
+                't': 24.5,
+                'pm25': 12,
+                'pm10': 20,
+                'iaq': 40,
+                'lat': 45.75,
+                'lng': 21.22
+            })
+        return web.json_response({'error': 'not found'}, status=404)
+
+    async def serve():
+        stub = web.Application()
+        stub.router.add_get('/api/v1/data-intake/{mac}', data_intake)
+        runner = web.AppRunner(stub, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0, backlog=2048)
+        await site.start()
+        address['port'] = site._server.sockets[0].getsockname()[1]
+        started.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return f"http://127.0.0.1:{address['port']}"
+
+
+def run_engine(base_url, engine, base_mac, range_size, concurrency):
+    scanner = ActiveMACExtractor(base_url)
+    job = ScanJob()
+    started = time.perf_counter()
+    active = scanner.scan_mac_range(base_mac, range_size, engine=engine, concurrency=concurrency, job=job)
+    elapsed = time.perf_counter() - started
+    return elapsed, len(active), job.get('total')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-mac', default='00:A0:50:D3:74:F7')
+    parser.add_argument('--range-size', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub response latency in seconds')
+    parser.add_argument('--active-every', type=int, default=37)
+    parser.add_argument('--thread-workers', type=int, default=15)
+    parser.add_argument('--async-concurrency', type=int, default=200)
+    args = parser.parse_args()
+
+    base_url = start_stub_server(args.latency, args.active_every)
+
+    # Silence the per-hit prints from the scanner so the timings stay readable
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        thread_time, thread_active, probes = run_engine(base_url, 'threads', args.base_mac, args.range_size, args.thread_workers)
+        async_time, async_active, _ = run_engine(base_url, 'async', args.base_mac, args.range_size, args.async_concurrency)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"Probes per scan: {probes}, stub latency: {args.latency * 1000:.0f} ms")
+    print(f"threads ({args.thread_workers} workers): {thread_time:.2f} s, {thread_active} active")
+    print(f"async   ({args.async_concurrency} in flight): {async_time:.2f} s, {async_active} active")
+    if async_time > 0:
+        print(f"speedup: {thread_time / async_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
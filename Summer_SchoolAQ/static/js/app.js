@@ -1,6 +1,7 @@
 // Air Quality Data Downloader - JavaScript
 // Global variables
 let currentDeviceData = null;
+let previewQuery = null;  // FormData of the query being paged through
 let testInProgress = false;
 
 // Show/hide time inputs based on data type selection
@@ -381,7 +382,7 @@ function formatCellValue(key, value) {
 }
 
 // Enhanced data preview table creation
-function createPreviewTable(data) {
+function createPreviewTable(data, columns) {
     if (!data || data.length === 0) {
         return '<div style="text-align: center; padding: 40px; color: #666;">📊 No data available</div>';
     }
@@ -396,7 +397,8 @@ function createPreviewTable(data) {
         't', 'pm25', 'pm10', 'co', 'no2', 'so2', 'o3', 'battery', 'data_source'
     ];
     
-    const availableKeys = Object.keys(sample);
+    // The server sends rows with sorted keys; its column list keeps the real order
+    const availableKeys = columns || Object.keys(sample);
     const selectedKeys = [];
     
     // Add priority fields that exist
@@ -441,6 +443,34 @@ function createPreviewTable(data) {
     return html;
 }
 
+// Summary of the whole result, computed on the server
+function createPreviewStats(stats) {
+    if (!stats) return '';
+    
+    let html = '<div class="preview-stats">';
+    html += `<span><strong>Records:</strong> ${stats.count}</span>`;
+    if (stats.aqi) {
+        html += `<span><strong>AQI:</strong> min ${stats.aqi.min} · mean ${stats.aqi.mean} · max ${stats.aqi.max}</span>`;
+    }
+    Object.entries(stats.levels || {}).forEach(([level, count]) => {
+        if (count > 0) {
+            html += `<span style="${getAqiColor(level)} padding: 2px 8px; border-radius: 4px;">${level}: ${count}</span>`;
+        }
+    });
+    html += '</div>';
+    return html;
+}
+
+function createPreviewPager(result) {
+    if (result.total_pages <= 1) return '';
+    
+    return `<div class="preview-pager">
+        <button type="button" class="btn btn-small" data-preview-page="${result.page - 1}" ${result.page <= 1 ? 'disabled' : ''}>◀ Previous</button>
+        <span>Page ${result.page} of ${result.total_pages}</span>
+        <button type="button" class="btn btn-small" data-preview-page="${result.page + 1}" ${result.page >= result.total_pages ? 'disabled' : ''}>Next ▶</button>
+    </div>`;
+}
+
 // AQI color coding
 function getAqiColor(level) {
     if (!level) return '';
@@ -462,31 +492,48 @@ function getAqiColor(level) {
     return '';
 }
 
-// Preview data functionality
+// Preview data functionality: the server keeps the result, pages are fetched on demand
+async function loadPreviewPage(page) {
+    const formData = new FormData();
+    for (const [key, value] of previewQuery.entries()) {
+        formData.append(key, value);
+    }
+    formData.append('page', page);
+    
+    const response = await fetch('/preview_data', {
+        method: 'POST',
+        body: formData
+    });
+    
+    const result = await response.json();
+    
+    if (result.success) {
+        const previewContent = document.getElementById('previewContent');
+        const recordCount = document.getElementById('recordCount');
+        const first = (result.page - 1) * result.page_size + 1;
+        
+        currentDeviceData = result.data;
+        recordCount.textContent = `📊 Showing ${first}-${first + result.data.length - 1} of ${result.total_records} records`;
+        previewContent.innerHTML = createPreviewStats(result.stats) +
+            createPreviewTable(result.data, result.columns) +
+            createPreviewPager(result);
+    }
+    return result;
+}
+
 document.getElementById('previewBtn').addEventListener('click', async function() {
     if (!validateForm()) return;
     
     clearAlerts();
     showLoading(true, 'Loading data preview...');
     
-    const formData = new FormData(document.getElementById('dataForm'));
+    previewQuery = new FormData(document.getElementById('dataForm'));
     
     try {
-        const response = await fetch('/preview_data', {
-            method: 'POST',
-            body: formData
-        });
-        
-        const result = await response.json();
+        const result = await loadPreviewPage(1);
         
         if (result.success) {
             const previewSection = document.getElementById('previewSection');
-            const previewContent = document.getElementById('previewContent');
-            const recordCount = document.getElementById('recordCount');
-            
-            currentDeviceData = result.data;
-            recordCount.textContent = `📊 Showing ${result.data.length} of ${result.total_records} records`;
-            previewContent.innerHTML = createPreviewTable(result.data);
             previewSection.classList.add('show');
             
             // Scroll to preview
@@ -503,23 +550,34 @@ document.getElementById('previewBtn').addEventListener('click', async function()
     }
 });
 
+document.getElementById('previewContent').addEventListener('click', async function(event) {
+    const button = event.target.closest('[data-preview-page]');
+    if (!button || !previewQuery) return;
+    
+    try {
+        const result = await loadPreviewPage(parseInt(button.dataset.previewPage, 10));
+        if (!result.success) {
+            showAlert(result.error || 'Failed to load data preview', 'error');
+        }
+    } catch (error) {
+        showAlert('Network error occurred while loading preview', 'error');
+    }
+});
+
 // Close preview functionality
 document.getElementById('closePreviewBtn').addEventListener('click', function() {
     document.getElementById('previewSection').classList.remove('show');
     currentDeviceData = null;
+    previewQuery = null;
 });
 
 // Download data functionality
-document.getElementById('downloadBtn').addEventListener('click', async function() {
-    if (!validateForm()) return;
-    
+async function downloadFile(url, formData, loadingMessage) {
     clearAlerts();
-    showLoading(true, 'Preparing download...');
-    
-    const formData = new FormData(document.getElementById('dataForm'));
+    showLoading(true, loadingMessage);
     
     try {
-        const response = await fetch('/download_data', {
+        const response = await fetch(url, {
             method: 'POST',
             body: formData
         });
@@ -554,6 +612,35 @@ document.getElementById('downloadBtn').addEventListener('click', async function(
     } finally {
         showLoading(false);
     }
+}
+
+document.getElementById('downloadBtn').addEventListener('click', async function() {
+    if (!validateForm()) return;
+    
+    const formData = new FormData(document.getElementById('dataForm'));
+    await downloadFile('/download_data', formData, 'Preparing download...');
+});
+
+// Bulk export of every saved device for the selected date range, one file per device in a zip
+document.getElementById('bulkDownloadBtn').addEventListener('click', async function() {
+    const startDate = document.getElementById('start_date').value;
+    const endDate = document.getElementById('end_date').value;
+    
+    if (!startDate || !endDate) {
+        showAlert('Please select both start and end dates for a bulk export', 'warning');
+        return;
+    }
+    
+    const formData = new FormData();
+    formData.append('all_devices', 'true');
+    formData.append('layout', 'zip');
+    formData.append('format', document.getElementById('export_format').value);
+    formData.append('start_date', startDate);
+    formData.append('end_date', endDate);
+    formData.append('start_hour', document.getElementById('hours_from').value || '0');
+    formData.append('end_hour', document.getElementById('hours_to').value || '23');
+    
+    await downloadFile('/download_bulk', formData, 'Exporting all saved devices...');
 });
 
 // Initialize application
@@ -588,10 +675,13 @@ document.addEventListener('keydown', function(e) {
 async function startScan() {
     const base_mac = document.getElementById('base_mac').value;
     const range_size = document.getElementById('range_size').value;
+    const engine = document.getElementById('scan_engine').value;
+    const resume = document.getElementById('scan_resume').checked;
+    const mode = document.getElementById('scan_mode').value;
 
     const res = await fetch('/api/scan_macs/start', {
         method: 'POST',
-        body: new URLSearchParams({ base_mac, range_size })
+        body: new URLSearchParams({ base_mac, range_size, engine, resume, mode })
     });
 
     const result = await res.json();
@@ -599,15 +689,54 @@ async function startScan() {
     statusEl.style.display = 'block';
     statusEl.className = 'alert ' + (result.success ? 'alert-success' : 'alert-error');
     statusEl.innerText = result.success ? result.message : `❌ ${result.error}`;
+    if (result.success) watchScan(result.job_id);
+}
+
+let scanEvents = null;
+let scanFoundMacs = [];
+let scanJobId = null;
+
+function renderScanStatus(status) {
+    const statusEl = document.getElementById('scanStatus');
+    statusEl.style.display = 'block';
+    statusEl.className = 'alert ' + (status.in_progress ? 'alert-info' : 'alert-success');
+    const icon = status.in_progress ? '⏳' : '✅';
+    const found = scanFoundMacs.length ? `\nLatest active: ${scanFoundMacs.slice(-5).join(', ')}` : '';
+    statusEl.innerText = `${icon} [${status.state}] Progress: ${status.progress}/${status.total}, Current: ${status.current_mac}, Active found: ${status.active_found}, ` +
+        `In flight: ${status.concurrency}, Retries: ${status.retries} (${status.retry_pending} waiting)` + found;
+}
+
+// Follow a scan job through server-sent events instead of polling the status endpoint
+function watchScan(jobId) {
+    if (scanEvents) scanEvents.close();
+    scanFoundMacs = [];
+    scanJobId = jobId;
+    scanEvents = new EventSource(`/api/scan_macs/events?job_id=${encodeURIComponent(jobId)}`);
+    scanEvents.addEventListener('progress', (e) => renderScanStatus(JSON.parse(e.data)));
+    scanEvents.addEventListener('active', (e) => scanFoundMacs.push(JSON.parse(e.data).mac));
+    scanEvents.addEventListener('finished', (e) => {
+        scanEvents.close();
+        scanEvents = null;
+        renderScanStatus(JSON.parse(e.data));
+    });
 }
 
 async function fetchScanStatus() {
     const res = await fetch('/api/scan_macs/status');
     const status = await res.json();
-    const statusEl = document.getElementById('scanStatus');
-    statusEl.style.display = 'block';
-    statusEl.className = 'alert alert-info';
-    statusEl.innerText = `⏳ Progress: ${status.progress}/${status.total}, Current: ${status.current_mac}, Active found: ${status.active_found}`;
+    renderScanStatus(status);
+    if (status.job_id) scanJobId = status.job_id;
+    if (status.in_progress && status.job_id && !scanEvents) watchScan(status.job_id);
+}
+
+async function controlScan(action) {
+    if (!scanJobId) {
+        alert('❌ No scan job selected');
+        return;
+    }
+    const res = await fetch(`/api/scan_macs/jobs/${encodeURIComponent(scanJobId)}/${action}`, { method: 'POST' });
+    const result = await res.json();
+    if (!result.success) alert(`❌ ${result.error}`);
 }
 
 async function fetchScanResults() {
@@ -0,0 +1,19 @@
+"""Shared test setup.
+
+app opens its SQLite stores at import time, in the working directory by
+default; the tests point them at a scratch directory instead so running
+the suite never touches the databases next to app.py.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix='summer-school-aq-tests-')
+for variable, filename in (('PROBE_LEDGER_DB', 'probe_ledger.db'),
+                           ('SCAN_JOBS_DB', 'scan_jobs.db'),
+                           ('GEOCODE_CACHE_DB', 'geocode_cache.db'),
+                           ('AQI_HISTORY_DB', 'aqi_history.db')):
+    os.environ.setdefault(variable, os.path.join(_scratch, filename))
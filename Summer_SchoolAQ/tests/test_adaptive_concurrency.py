@@ -0,0 +1,70 @@
+import http.server
+import threading
+
+import pytest
+
+import app as aq
+
+
+def test_controller_grows_additively_up_to_max():
+    controller = aq.AdaptiveConcurrencyController(max_limit=10, initial_limit=4, target_latency=1.0)
+    limits = []
+    for _ in range(200):
+        controller.record(0.1, failed=False)
+        limits.append(controller.limit)
+
+    assert limits == sorted(limits)
+    # One probe per round of successes: four successes at limit 4 add about one
+    assert limits[3] == pytest.approx(4.92, abs=0.01)
+    assert controller.current_limit == 10
+
+
+def test_controller_halves_at_most_once_per_round():
+    controller = aq.AdaptiveConcurrencyController(max_limit=32, initial_limit=16, min_limit=2,
+                                                  target_latency=1.0, error_threshold=0.1)
+    for _ in range(15):
+        controller.record(0.1, failed=True)
+    assert controller.current_limit == 16
+
+    controller.record(0.1, failed=True)
+    assert controller.current_limit == 8
+
+    for _ in range(7):
+        controller.record(0.1, failed=True)
+    assert controller.current_limit == 8
+    controller.record(0.1, failed=True)
+    assert controller.current_limit == 4
+
+
+def test_controller_backs_off_on_latency_but_not_below_min():
+    controller = aq.AdaptiveConcurrencyController(max_limit=16, initial_limit=8, min_limit=3, target_latency=0.5)
+    for _ in range(100):
+        controller.record(5.0, failed=False)
+    assert controller.current_limit == 3
+
+
+class Unavailable(http.server.BaseHTTPRequestHandler):
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_scan_probes_are_not_retried_by_the_transport():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Unavailable)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        scanner = aq.ActiveMACExtractor(f'http://127.0.0.1:{server.server_port}')
+        result = scanner.test_single_mac('00:A0:50:00:00:10', use_cache=False)
+    finally:
+        server.shutdown()
+
+    # One attempt per probe: retrying is left to the scanner and its controller
+    assert result == {'mac': '00:A0:50:00:00:10', 'status': 'error', 'reason': 'http_503'}
+    assert Unavailable.hits == 1
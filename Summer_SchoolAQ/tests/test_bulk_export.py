@@ -0,0 +1,57 @@
+import io
+import json
+
+import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+import app as aq
+
+
+def fake_results(failed):
+    def iter_bulk_frames(api_client, macs, *args):
+        for i, mac in enumerate(macs):
+            if i < failed:
+                yield mac, None, {'mac': mac, 'status': 'error', 'rows': 0, 'error': 'upstream timed out ' * 5}
+            else:
+                frame = pd.DataFrame({'mac': [mac], 'aqi': [float(i)]}).reindex(columns=aq.HOURLY_COLUMNS)
+                yield mac, frame, {'mac': mac, 'status': 'ok', 'rows': 1}
+    return iter_bulk_frames
+
+
+def bulk_download(monkeypatch, export_format, devices=3, failed=1):
+    monkeypatch.setattr(aq, 'iter_bulk_frames', fake_results(failed))
+    macs = ','.join(f'00:A0:50:00:{i // 256:02X}:{i % 256:02X}' for i in range(devices))
+    with aq.app.test_client() as client:
+        return client.post('/download_bulk', data={'device_macs': macs, 'format': export_format, 'layout': 'long',
+                                                   'start_date': '2026-01-01', 'end_date': '2026-01-02'})
+
+
+@pytest.mark.parametrize('export_format, read', [('parquet', pq.read_table), ('feather', feather.read_table)])
+def test_columnar_exports_carry_the_full_manifest(monkeypatch, export_format, read):
+    response = bulk_download(monkeypatch, export_format)
+    assert response.status_code == 200
+
+    table = read(io.BytesIO(response.get_data()))
+    manifest = json.loads(table.schema.metadata[b'export_manifest'])
+    assert [entry['status'] for entry in manifest['devices']] == ['error', 'ok', 'ok']
+    assert table.num_rows == 2
+    assert json.loads(response.headers['X-Export-Manifest'])['full_manifest'] == 'schema_metadata'
+
+
+def test_manifest_header_stays_bounded(monkeypatch):
+    response = bulk_download(monkeypatch, 'csv', devices=aq.BULK_EXPORT_MAX_DEVICES, failed=400)
+    assert response.status_code == 200
+
+    header = response.headers['X-Export-Manifest']
+    assert len(header) <= aq.BULK_MANIFEST_HEADER_MAX_BYTES
+    summary = json.loads(header)
+    assert summary['failed'] == 400 and summary['ok'] == 100 and summary['truncated']
+    assert summary['full_manifest'] == 'layout=zip'
+
+
+def test_small_manifests_list_failed_devices_in_the_header(monkeypatch):
+    summary = json.loads(bulk_download(monkeypatch, 'csv').headers['X-Export-Manifest'])
+    assert list(summary['failed']) == ['00:A0:50:00:00:00']
+    assert 'truncated' not in summary
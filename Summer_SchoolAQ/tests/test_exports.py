@@ -0,0 +1,74 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+import app as aq
+
+
+def frames():
+    return [
+        pd.DataFrame({'mac': ['AA'] * 5, 'aqi': [10.0, 20.5, 30.0, 40.0, 50.0], 'note': ['a, b', 'c', 'd', 'e', 'f']}),
+        pd.DataFrame({'aqi': [60.0, 70.0], 'mac': ['BB', 'BB']}),
+    ]
+
+
+def test_stream_csv_uses_one_line_ending():
+    body = ''.join(aq.stream_csv(frames(), ['mac', 'aqi', 'note'], chunk_rows=2))
+    assert '\r' not in body
+    assert body.splitlines()[0] == 'mac,aqi,note'
+    assert body.endswith('\n')
+
+
+def test_stream_csv_keeps_column_order_and_fills_missing_columns():
+    body = ''.join(aq.stream_csv(frames(), ['mac', 'aqi', 'note'], chunk_rows=2))
+    parsed = pd.read_csv(io.StringIO(body), keep_default_na=False)
+
+    expected = pd.concat(frames(), ignore_index=True).reindex(columns=['mac', 'aqi', 'note']).fillna('')
+    assert parsed['mac'].tolist() == expected['mac'].tolist()
+    assert parsed['aqi'].tolist() == expected['aqi'].tolist()
+    assert parsed['note'].tolist() == expected['note'].tolist()
+
+
+def test_stream_csv_chunking_does_not_change_the_output():
+    columns = ['mac', 'aqi', 'note']
+    whole = ''.join(aq.stream_csv(frames(), columns, chunk_rows=1000))
+    assert ''.join(aq.stream_csv(frames(), columns, chunk_rows=1)) == whole
+    assert len(list(aq.stream_csv(frames(), columns, chunk_rows=2))) == 1 + 3 + 1
+
+
+def download(export_format):
+    with aq.app.test_request_context():
+        response = aq.export_response(frames(), ['mac', 'aqi', 'note'], 'readings', export_format)
+        return response, response.get_data()
+
+
+def test_columnar_formats_round_trip():
+    expected = pd.concat(frames(), ignore_index=True).reindex(columns=['mac', 'aqi', 'note'])
+
+    response, body = download('parquet')
+    assert response.headers['Content-Disposition'].endswith('readings.parquet"')
+    assert pq.read_table(io.BytesIO(body)).to_pandas().equals(expected)
+
+    response, body = download('feather')
+    assert response.headers['Content-Disposition'].endswith('readings.arrow"')
+    assert feather.read_table(io.BytesIO(body)).to_pandas().equals(expected)
+
+
+@pytest.mark.parametrize('export_format, codec', [('csv.gz', 'gzip'), ('csv.zst', 'zstd')])
+def test_compressed_csv_decodes_to_the_plain_csv(export_format, codec):
+    _, plain = download('csv')
+    response, body = download(export_format)
+
+    assert response.headers['Content-Disposition'].endswith(f'readings.{export_format}"')
+    assert pa.input_stream(pa.py_buffer(body), compression=codec).read() == plain
+
+
+def test_format_aliases():
+    assert aq.parse_export_format(None) == 'csv'
+    assert aq.parse_export_format(' GZIP ') == 'csv.gz'
+    assert aq.parse_export_format('arrow') == 'feather'
+    assert aq.parse_export_format('xlsx') is None
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import app as aq
+
+
+def pairwise_reference(macs, times, lats, lngs, window_hours=6, min_distance_m=100):
+    """The per-MAC nested loop classify_mobility replaces"""
+    tracks = {}
+    for mac, observed, lat, lng in zip(macs, times, lats, lngs):
+        tracks.setdefault(mac, []).append((observed, lat, lng))
+
+    result = {}
+    for mac, points in tracks.items():
+        points.sort()
+        result[mac] = 'static'
+        for i, (t1, lat1, lng1) in enumerate(points):
+            for t2, lat2, lng2 in points[i + 1:]:
+                if t2 - t1 > window_hours * 3600:
+                    break
+                if aq.haversine_distance(lat1, lng1, lat2, lng2) > min_distance_m:
+                    result[mac] = 'mobile'
+    return result
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_pairwise_reference(seed):
+    rng = np.random.default_rng(seed)
+    points = int(rng.integers(1, 400))
+    macs = np.array([f'M{m}' for m in rng.integers(0, 15, points)], dtype=object)
+    times = rng.uniform(0, 2 * 86400, points).round(-2)
+    spread = rng.choice([0.0003, 0.0008, 0.003])
+    lats = 45.75 + rng.normal(0, spread, points)
+    lngs = 21.22 + rng.normal(0, spread, points)
+
+    result = aq.classify_mobility(macs, times, lats, lngs, 6, 100, pair_batch=int(rng.integers(1, 50)))
+    assert result == pairwise_reference(macs, times, lats, lngs)
+
+
+def test_window_bound_is_inclusive():
+    lats = [45.75, 45.752]  # about 220 m apart
+    lngs = [21.22, 21.22]
+    assert aq.classify_mobility(['A', 'A'], [0, 6 * 3600], lats, lngs) == {'A': 'mobile'}
+    assert aq.classify_mobility(['A', 'A'], [0, 6 * 3600 + 1], lats, lngs) == {'A': 'static'}
+
+
+def test_windows_never_span_two_macs():
+    result = aq.classify_mobility(['A', 'B'], [0, 60], [45.70, 45.80], [21.20, 21.30])
+    assert result == {'A': 'static', 'B': 'static'}
+
+
+def test_incomplete_sightings_are_ignored():
+    assert aq.classify_mobility([], [], [], []) == {}
+    result = aq.classify_mobility(['A', 'A', 'B'], [0, 60, np.nan], [45.75, np.nan, 45.75], [21.22, 21.30, 21.22])
+    assert result == {'A': 'static'}
+
+
+def test_window_extents_match_slices():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=300)
+    starts = rng.integers(0, 299, 500)
+    ends = starts + rng.integers(1, 300 - starts)
+
+    lows, highs = aq.window_extents(values, starts, ends)
+    assert np.array_equal(lows, [values[s:e].min() for s, e in zip(starts, ends)])
+    assert np.array_equal(highs, [values[s:e].max() for s, e in zip(starts, ends)])
@@ -0,0 +1,65 @@
+import pytest
+
+import app as aq
+
+
+def frontier_order(frontier, count):
+    return [next(frontier) for _ in range(count)]
+
+
+def test_frontier_probes_seed_then_nearest_neighbours():
+    frontier = aq.PrioritizedMACFrontier(['00:A0:50:00:00:10'], radius=2, max_probes=100)
+    order = frontier_order(frontier, 5)
+
+    assert order[0] == '00:A0:50:00:00:10'
+    assert set(order[1:3]) == {'00:A0:50:00:00:0F', '00:A0:50:00:00:11'}
+    assert set(order[3:5]) == {'00:A0:50:00:00:0E', '00:A0:50:00:00:12'}
+
+
+def test_frontier_expands_around_hits_and_skips_excluded():
+    frontier = aq.PrioritizedMACFrontier(['00:A0:50:00:00:10'], radius=1, max_probes=100,
+                                         exclude=['00:A0:50:00:00:0F'])
+    assert frontier_order(frontier, 2) == ['00:A0:50:00:00:10', '00:A0:50:00:00:11']
+
+    frontier.observe({'mac': '00:A0:50:00:00:10', 'status': 'active'})
+    frontier.observe({'mac': '00:A0:50:00:00:11', 'status': 'active'})
+    assert next(frontier) == '00:A0:50:00:00:12'
+    assert frontier.hits == {aq.mac_to_int('00:A0:50:00:00:10'), aq.mac_to_int('00:A0:50:00:00:11')}
+
+
+def test_frontier_stays_within_the_vendor_prefix():
+    frontier = aq.PrioritizedMACFrontier(['00:A0:50:00:00:00'], radius=2, max_probes=100)
+    order = frontier_order(frontier, 3)
+    assert all(mac.startswith('00:A0:50:') for mac in order)
+
+
+def test_frontier_waits_for_in_flight_probes_then_stops():
+    frontier = aq.PrioritizedMACFrontier(['00:A0:50:00:00:10'], radius=0, max_probes=100)
+    assert next(frontier) == '00:A0:50:00:00:10'
+    assert next(frontier) is aq.SCAN_WAIT
+
+    frontier.observe({'mac': '00:A0:50:00:00:10', 'status': 'not_found'})
+    with pytest.raises(StopIteration):
+        next(frontier)
+
+
+def test_frontier_stops_at_max_probes():
+    frontier = aq.PrioritizedMACFrontier(['00:A0:50:00:00:10'], radius=10, max_probes=3)
+    assert frontier.planned == 3
+    frontier_order(frontier, 3)
+    with pytest.raises(StopIteration):
+        next(frontier)
+    assert frontier.stop_reason == 'max_probes'
+    assert frontier.planned == 3
+
+
+def test_frontier_stops_when_hit_density_drops():
+    frontier = aq.PrioritizedMACFrontier(['00:A0:50:00:00:10'], radius=10, max_probes=100,
+                                         density_window=4, min_density=0.5)
+    for mac in frontier_order(frontier, 4):
+        frontier.observe({'mac': mac, 'status': 'not_found'})
+
+    assert frontier.stop_reason == 'low_hit_density'
+    assert frontier.planned == 4
+    with pytest.raises(StopIteration):
+        next(frontier)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import app as aq
+
+
+def result(rows):
+    frame = pd.DataFrame({'aqi': [float(i) for i in range(rows)]})
+    return frame, {'count': rows}
+
+
+def frame_bytes(value):
+    return int(value[0].memory_usage(index=True, deep=True).sum())
+
+
+def test_evicts_least_recently_used_by_bytes():
+    size = frame_bytes(result(100))
+    cache = aq.QueryResultCache(max_bytes=int(size * 2.5))
+    loads = []
+
+    def loader(key):
+        def load():
+            loads.append(key)
+            return result(100)
+        return load
+
+    cache.get_or_load('a', loader('a'))
+    cache.get_or_load('b', loader('b'))
+    cache.get_or_load('a', loader('a'))  # 'a' is now the most recently used
+    cache.get_or_load('c', loader('c'))
+
+    assert cache.stats()['evictions'] == 1
+    cache.get_or_load('a', loader('a'))
+    cache.get_or_load('b', loader('b'))
+    assert loads == ['a', 'b', 'c', 'b']
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+
+def test_results_larger_than_the_budget_are_served_but_not_kept():
+    cache = aq.QueryResultCache(max_bytes=10)
+    value = result(100)
+
+    assert cache.get_or_load('big', lambda: value) is value
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0
+
+
+def test_failed_loads_are_not_cached():
+    cache = aq.QueryResultCache()
+
+    def fail():
+        raise RuntimeError('upstream down')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('key', fail)
+    value = result(3)
+    assert cache.get_or_load('key', lambda: value) is value
+    assert cache.stats()['misses'] == 2
+
+
+def test_concurrent_loads_of_one_key_share_a_fetch():
+    cache = aq.QueryResultCache()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return result(3)
+
+    values = []
+    threads = [threading.Thread(target=lambda: values.append(cache.get_or_load('key', load))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()['coalesced'] < 4 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(value is values[0] for value in values)
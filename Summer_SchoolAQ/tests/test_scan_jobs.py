@@ -0,0 +1,54 @@
+import threading
+import time
+
+import app as aq
+
+
+def test_a_starting_job_counts_itself_in_the_concurrency_share(tmp_path):
+    store = aq.ScanStatusStore(db_path=str(tmp_path / 'jobs.db'))
+    aq.ScanJob(store=store, in_progress=True, state='running').persist(force=True)
+    manager = aq.ScanJobManager(store)
+    started = threading.Event()
+    seen = {}
+
+    def target(job):
+        seen['cap'] = job.concurrency_cap
+        seen['running'] = store.running_count()
+        started.set()
+
+    job = manager.submit(target)
+    assert started.wait(5)
+    assert seen == {'cap': aq.GLOBAL_SCAN_CONCURRENCY // 2, 'running': 2}
+    assert job.get('concurrency_share') == aq.GLOBAL_SCAN_CONCURRENCY // 2
+
+
+def test_only_the_latest_progress_events_are_kept(tmp_path):
+    store = aq.ScanStatusStore(db_path=str(tmp_path / 'jobs.db'), progress_events_kept=3)
+    for i in range(10):
+        store.add_event('job', 'progress', {'progress': i})
+        if i in (2, 7):
+            store.add_event('job', 'active', {'mac': f'M{i}'})
+    store.add_event('other', 'progress', {'progress': 0})
+
+    events = [(event, payload) for _, event, payload in store.events_since('job')]
+    assert events == [('active', {'mac': 'M2'}), ('progress', {'progress': 7}), ('active', {'mac': 'M7'}),
+                      ('progress', {'progress': 8}), ('progress', {'progress': 9})]
+    assert len(store.events_since('other')) == 1
+
+
+def test_finished_jobs_are_pruned_after_the_retention_window(tmp_path, monkeypatch):
+    monkeypatch.setattr(aq, 'SCAN_JOB_RETENTION_HOURS', 0)
+    store = aq.ScanStatusStore(db_path=str(tmp_path / 'jobs.db'))
+    old = aq.ScanJob(store=store, in_progress=True, state='running')
+    old.finish()
+    running = aq.ScanJob(store=store, in_progress=True, state='running')
+    running.persist(force=True)
+
+    job = aq.ScanJobManager(store).submit(lambda job: job.finish())
+    deadline = time.monotonic() + 5
+    while store.load(job.job_id) is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert store.load(old.job_id) is None and store.events_since(old.job_id) == []
+    assert store.load(job.job_id) is None
+    assert store.load(running.job_id)['in_progress']
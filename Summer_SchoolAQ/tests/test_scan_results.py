@@ -0,0 +1,35 @@
+import json
+
+import app as aq
+
+
+def active(mac, aqi=42):
+    return {'mac': mac, 'status': 'active', 'aqi': aqi}
+
+
+def test_probed_in_scan_filters_by_status(tmp_path):
+    ledger = aq.ProbeLedger(db_path=str(tmp_path / 'ledger.db'))
+    scan_id, _ = ledger.start_scan('00:A0:50:00:00:00', 4, 'threads')
+    for mac, status in (('AA', 'active'), ('BB', 'not_found'), ('CC', 'inactive'),
+                        ('DD', 'timeout'), ('EE', 'connection_error'), ('FF', 'error')):
+        ledger.record(scan_id, active(mac) if status == 'active' else {'mac': mac, 'status': status})
+    ledger.flush()
+
+    assert ledger.probed_in_scan(scan_id) == {'AA', 'BB', 'CC', 'DD', 'EE', 'FF'}
+    assert ledger.probed_in_scan(scan_id, statuses=aq.LEDGER_ABSENT_STATUSES) == {'BB', 'CC'}
+    assert ledger.probed_in_scan(scan_id + 1, statuses=aq.LEDGER_ABSENT_STATUSES) == set()
+
+
+def test_merge_keeps_other_entries_and_drops_only_absent_macs(tmp_path):
+    path = str(tmp_path / 'mac_scan_results.json')
+    aq.merge_scan_results({'scan_id': 1, 'results': [active('AA'), active('BB'), active('CC')]}, set(), path)
+
+    # A rescan where AA timed out, BB answered 404 and CC was found again
+    results = aq.merge_scan_results({'scan_id': 2, 'results': [active('CC', aqi=7), active('DD')]}, {'bb'}, path)
+
+    by_mac = {entry['mac']: entry for entry in results}
+    assert set(by_mac) == {'AA', 'CC', 'DD'}
+    assert by_mac['CC']['aqi'] == 7
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved['scan_id'] == 2 and saved['total_active'] == 3
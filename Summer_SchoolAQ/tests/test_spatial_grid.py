@@ -0,0 +1,79 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+import app as aq
+
+
+def grid():
+    return aq.SpatialGrid(45.70, 45.82, 21.15, 21.35, 0.009)
+
+
+def test_dimensions_cover_the_bounding_box():
+    assert (grid().rows, grid().cols) == (14, 23)
+    # A span that is a whole number of steps gets no extra row
+    assert aq.SpatialGrid(0.0, 0.3, 0.0, 0.1, 0.1).rows == 3
+
+
+def test_cell_indices_are_row_major_from_the_south_west():
+    g = grid()
+    lats = [45.7001, 45.7001, 45.7095, 45.8199]
+    lons = [21.1501, 21.1595, 21.1501, 21.3499]
+    assert g.cell_indices(lats, lons).tolist() == [0, 1, g.cols, g.size - 1]
+
+
+def test_points_on_a_cell_edge_belong_to_the_cell_above():
+    g = grid()
+    edge = 45.70 + 3 * 0.009
+    assert g.cell_index(edge, 21.1501) == 3 * g.cols
+
+
+def test_points_outside_or_nan_are_minus_one():
+    g = grid()
+    indices = g.cell_indices([45.69, 45.83, 45.75, np.nan], [21.20, 21.20, 21.40, 21.20])
+    assert indices.tolist() == [-1, -1, -1, -1]
+    assert g.cell_index(45.69, 21.20) is None
+
+
+def test_row_col_origin_and_centres_round_trip():
+    g = grid()
+    indices = np.array([0, 5, g.cols + 2, g.size - 1])
+    rows, cols = g.row_col(indices)
+    assert (rows * g.cols + cols).tolist() == indices.tolist()
+
+    assert g.cell_origin(g.cols + 2) == (45.709, 21.168)
+    lats, lons = g.cell_centers(indices)
+    assert g.cell_indices(lats, lons).tolist() == indices.tolist()
+
+
+def test_bitmaps_and_feature_collections():
+    g = grid()
+    covered = g.coverage([45.7001, 45.7002, 45.75, 50.0], [21.1501, 21.1502, 21.25, 21.25])
+    assert covered.dtype == bool and covered.sum() == 2
+    assert g.bitmap([-1, 3]).nonzero()[0].tolist() == [3]
+
+    by_bitmap = g.feature_collection(covered)
+    by_index = g.feature_collection(np.flatnonzero(covered))
+    assert by_bitmap == by_index
+    assert [f['properties']['index'] for f in by_bitmap['features']] == np.flatnonzero(covered).tolist()
+    assert len(g.feature_collection()['features']) == g.size
+
+
+def test_coverage_and_uncovered_layers_are_complementary(tmp_path, monkeypatch):
+    now = datetime.now(timezone.utc)
+    results = [
+        {'mac': 'AA', 'location': {'lat': 45.7501, 'lng': 21.2201}, 'last_update': now.isoformat()},
+        {'mac': 'BB', 'location': {'lat': 45.7801, 'lng': 21.3001},
+         'last_update': (now - timedelta(hours=aq.COVERAGE_MAX_AGE_HOURS + 1)).isoformat()},
+    ]
+    (tmp_path / 'mac_scan_results.json').write_text(json.dumps({'results': results}))
+    monkeypatch.chdir(tmp_path)
+
+    with aq.app.test_client() as client:
+        covered = {f['properties']['index'] for f in client.get('/api/grid_coverage').get_json()['features']}
+        uncovered = {f['properties']['index'] for f in client.get('/api/uncovered_cells').get_json()['features']}
+
+    assert covered == {grid().cell_index(45.7501, 21.2201)}
+    assert not covered & uncovered
+    assert covered | uncovered == set(range(grid().size))